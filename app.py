@@ -3,9 +3,14 @@
 Tarifierungstool Backend – Sichere Groq-API-Proxy + Klassifizierungslogik.
 Deployed auf Render.com als Web Service.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import json, os, re, signal, time, urllib.request, urllib.error, urllib.parse
+import atexit, bisect, codecs, contextvars, copy, hashlib, hmac, http.client, io, json, math, mmap, os, queue, re, socket
+import sqlite3, ssl, struct, sys, threading, time, urllib.error, urllib.parse
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
 
 app = Flask(__name__)
 CORS(app)
@@ -17,11 +22,103 @@ GROQ_MODEL_QUALITY = "llama-3.3-70b-versatile"   # 6,000 TPM free tier, best rea
 GROQ_JSON_MODE_MODELS = {"llama-3.3-70b-versatile", "llama-3.1-70b-versatile",
                           "mixtral-8x7b-32768"}
 GROQ_MODEL = GROQ_MODEL_QUALITY  # Best reasoning for tariff classification
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_URL = os.environ.get("GROQ_URL", "https://api.groq.com/openai/v1/chat/completions")
+
+# ── Groq Rate-Limits (clientseitiger Token-Bucket, pro Modell) ──
+GROQ_TPM = int(os.environ.get("GROQ_TPM", "6000"))      # Tokens pro Minute (Free Tier)
+GROQ_RPM = int(os.environ.get("GROQ_RPM", "30"))        # Requests pro Minute
+GROQ_LIMITER_MAX_WAIT = float(os.environ.get("GROQ_LIMITER_MAX_WAIT", "20"))  # max. Wartezeit in der Queue
+GROQ_MIN_CALL_SECONDS = 5.0  # so viel Deadline muss nach dem Warten für den Aufruf übrig bleiben
+
+# ── Hedging: antwortet das Primärmodell zu langsam, geht der Prompt zusätzlich an ein schnelles Modell ──
+GROQ_HEDGE_MODEL = os.environ.get("GROQ_HEDGE_MODEL", "")     # z.B. llama-3.1-8b-instant; leer = aus
+GROQ_HEDGE_PERCENTILE = float(os.environ.get("GROQ_HEDGE_PERCENTILE", "0.9"))     # der Primär-Latenz
+GROQ_HEDGE_MIN_DELAY = float(os.environ.get("GROQ_HEDGE_MIN_DELAY", "2.0"))       # Sekunden
+GROQ_HEDGE_DEFAULT_DELAY = float(os.environ.get("GROQ_HEDGE_DEFAULT_DELAY", "8.0"))  # bis genug Messwerte da sind
+GROQ_HEDGE_MIN_SAMPLES = 20
+GROQ_HEDGE_WINDOW = 200      # letzte N Latenzen pro Modell
+
+# ── Open Food Facts ──
+OFF_BASE_URL = os.environ.get("OFF_BASE_URL", "https://world.openfoodfacts.org")
+
+# ── Zeitbudget pro Anfrage (Render bricht nach 30s ab) ──
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "27"))  # 3s Reserve für Flask/Proxy
+OFF_TIMEOUT = 3.0            # Obergrenze für den OFF-Lookup
+GROQ_TIMEOUT = 22.0          # Obergrenze für einen Groq-Aufruf ohne Anfrage-Deadline
+GUESS_CHAPTER_TIMEOUT = 8.0  # Kapitel-Fallback darf den Hauptaufruf nicht aushungern
+
+# ── Fast Path: eindeutige Produkte regelbasiert, ohne LLM ──
+FAST_PATH_ENABLED = os.environ.get("FAST_PATH_ENABLED", "1") == "1"
+
+# ── Batch-Klassifizierung (/classify/batch) ──
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "3"))     # parallele Pipelines pro Batch
+BATCH_RATE_LIMIT_RETRIES = int(os.environ.get("BATCH_RATE_LIMIT_RETRIES", "3"))
+BATCH_HEARTBEAT = 10.0       # Sekunden ohne Ergebnis → Keep-Alive-Zeile (Proxy-Idle-Timeouts)
 
 # ── BAZG Cache Pfad ──
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CACHE_DIR = os.path.join(BASE_DIR, 'bazg_cache')
+# Vorkompilierter Korpus (build_corpus.py); fehlt er oder ist er veraltet, wird bazg_cache gelesen
+CORPUS_BIN_PATH = os.environ.get("CORPUS_BIN_PATH", os.path.join(BASE_DIR, 'bazg_corpus.bin'))
+# Geänderte erl/anm-Dateien im laufenden Betrieb nachladen (Prüfintervall in s, 0 = nur per /admin/corpus/reload)
+CORPUS_WATCH_INTERVAL = float(os.environ.get("CORPUS_WATCH_INTERVAL", "30"))
+
+# ── Prompt-Budget (geschätzte Tokens, siehe TokenEstimator) ──
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "4800"))  # 6000 TPM − Antwort (max_tokens 1000) − Reserve
+PROMPT_PRODUCT_TOKENS = 400    # feste Reserve für Produktdaten
+PROMPT_NOTES_TOKENS = 800      # Anmerkungen Primärkapitel (erster Durchgang)
+PROMPT_PRIMARY_TOKENS = 1500   # Erläuterungen Primärposition (erster Durchgang)
+PROMPT_EXTRA_TOKENS = 500      # je konkurrierende Position (erster Durchgang)
+PROMPT_POSITIONS_K = 3         # Retrieval-Treffer pro Kapitel
+PROMPT_PREFIX_CACHE_SIZE = int(os.environ.get("PROMPT_PREFIX_CACHE_SIZE", "256"))
+
+# ── Zweistufige Einreihung: kleines Modell wählt Positionen, grosses nur noch die Unterposition ──
+CLASSIFY_MODE = os.environ.get("CLASSIFY_MODE", "single")   # "single" | "two_stage"
+SHORTLIST_MODEL = os.environ.get("SHORTLIST_MODEL", "llama-3.1-8b-instant")
+SHORTLIST_CHAPTERS = 3           # Kapitel in der Titelliste für die Vorauswahl
+SHORTLIST_MAX_POSITIONS = 3      # Positionen, die das grosse Modell bekommt
+SHORTLIST_HEADING_CHARS = 160    # Positionstitel kürzen
+SHORTLIST_TIMEOUT = 6.0
+TWO_STAGE_PROMPT_BUDGET = int(os.environ.get("TWO_STAGE_PROMPT_BUDGET", "3100"))
+SUBPOSITION_NOTES_TOKENS = 250      # Anmerkungen in der zweiten Stufe (erster Durchgang)
+SUBPOSITION_POSITION_TOKENS = 400   # je vorausgewählte Position (erster Durchgang)
+
+# ── Ergebnis-Cache (Klassifikationen, pro Prozess) ──
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(24 * 3600)))
+# Ähnliche Anfragen ("Coca Cola 0.5l" / "cola coca 50cl") nutzen dasselbe Ergebnis
+FUZZY_CACHE_ENABLED = os.environ.get("FUZZY_CACHE_ENABLED", "1") == "1"
+FUZZY_CACHE_THRESHOLD = float(os.environ.get("FUZZY_CACHE_THRESHOLD", "0.8"))  # Trigramm-Jaccard
+FUZZY_CACHE_SIZE = int(os.environ.get("FUZZY_CACHE_SIZE", str(4 * RESULT_CACHE_SIZE)))
+
+# ── Persistenter Ergebnis-Speicher (SQLite/WAL, von allen Workern geteilt, übersteht Neustarts) ──
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", os.path.join(BASE_DIR, 'result_store.sqlite'))  # leer = aus
+RESULT_STORE_MAX_AGE = int(os.environ.get("RESULT_STORE_MAX_AGE", str(90 * 24 * 3600)))  # Sekunden
+RESULT_STORE_FLUSH_INTERVAL = float(os.environ.get("RESULT_STORE_FLUSH_INTERVAL", "0.5"))
+RESULT_STORE_BATCH_SIZE = 64
+RESULT_STORE_QUEUE_SIZE = 1024     # volle Queue → Eintrag verwerfen, Anfrage wartet nie
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")   # für /admin/* (Authorization: Bearer …)
+
+# ── Anreicherungs-Cache (Open Food Facts / Web-Suche) ──
+ENRICH_CACHE_SIZE = int(os.environ.get("ENRICH_CACHE_SIZE", "4096"))
+ENRICH_TTL_BARCODE = int(os.environ.get("ENRICH_TTL_BARCODE", str(7 * 24 * 3600)))  # Treffer per EAN
+ENRICH_TTL_TEXT = int(os.environ.get("ENRICH_TTL_TEXT", str(24 * 3600)))           # Treffer per Textsuche
+ENRICH_TTL_NEGATIVE = int(os.environ.get("ENRICH_TTL_NEGATIVE", "600"))             # "nicht gefunden"
+ENRICH_TTL_ERROR = int(os.environ.get("ENRICH_TTL_ERROR", "60"))                    # Timeout/Netzwerkfehler
+
+# ── Anreicherung: Quellen parallel, bestes Ergebnis gewinnt ──
+ENRICH_BUDGET = float(os.environ.get("ENRICH_BUDGET", str(OFF_TIMEOUT)))  # gemeinsames Zeitbudget (s)
+ENRICH_TEXT_VARIANTS = int(os.environ.get("ENRICH_TEXT_VARIANTS", "2"))  # OFF-Textsuchen (ab 3: ohne Marke)
+ENRICH_WEB_SEARCH = os.environ.get("ENRICH_WEB_SEARCH", "0") == "1"      # Web-Suche (Groq Compound) mitlaufen lassen
+ENRICH_WEB_BUDGET = float(os.environ.get("ENRICH_WEB_BUDGET", "8"))        # eigenes Budget der Web-Suche (s)
+ENRICH_WORKERS = 32
+
+# ── HTTP-Verbindungspools (Keep-Alive pro Upstream-Host) ──
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "4"))
+
+# ── Lokaler OFF-Barcode-Index (erstellt mit import_off_dump.py) ──
+OFF_INDEX_PATH = os.environ.get("OFF_INDEX_PATH", os.path.join(BASE_DIR, 'off_index.sqlite'))
 
 # ── Allgemeine Vorschriften & CH-Vorschriften (vollständig) ──
 AV_TEXT = """═══ ALLGEMEINE VORSCHRIFTEN FÜR DIE EINREIHUNG (AV) ═══
@@ -66,6 +163,443 @@ CHV 4: Behältnis = unmittelbare Umschliessung der Ware.
 - Kap. 25-97 (Industrieprodukte): seit 1.1.2024 weitgehend zollfrei (0 CHF)"""
 
 
+# ── Zeitbudget ──
+class Deadline:
+    """Zeitbudget einer Anfrage, das durch alle Pipeline-Stufen gereicht wird.
+
+    Ersetzt den SIGALRM-Timeout: funktioniert in jedem Thread, und jede Stufe bekommt
+    nur die tatsächlich verbleibende Zeit (schneller OFF-Lookup → mehr Zeit für das LLM).
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None):
+        """Timeout für die nächste Stufe (höchstens cap); TimeoutError, wenn nichts übrig ist."""
+        left = self.remaining()
+        if left <= 0:
+            raise TimeoutError(f"Zeitbudget der Anfrage ({self.seconds:.0f}s) aufgebraucht")
+        return min(left, cap) if cap else left
+
+
+# ── Metriken: Stufen-Timing (/metrics, Server-Timing) ──
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+METRICS_HELP = {
+    "tarif_request_seconds": "Dauer der HTTP-Anfragen an dieses Backend",
+    "tarif_stage_seconds": "Dauer der Pipeline-Stufen (OFF, Kapitel, Dokumente, Prompt, LLM, ...)",
+    "tarif_upstream_seconds": "Dauer der ausgehenden HTTP-Aufrufe (Groq, Open Food Facts, ...)",
+}
+
+
+class Metrics:
+    """Prometheus-Histogramme mit festen Buckets (ohne Client-Bibliothek).
+
+    observe() kostet eine Bisektion und ein Lock – klein genug, um immer aktiv zu sein.
+    Buckets werden nicht-kumulativ gezählt und erst in render() aufsummiert.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._series = {}  # (Metrik, Labels) -> [Bucket-Zähler..., +Inf], Summe, Anzahl
+        self._lock = threading.Lock()
+
+    def observe(self, metric, labels, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get((metric, labels))
+            if series is None:
+                series = self._series[(metric, labels)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        """Text-Exposition-Format 0.0.4."""
+        with self._lock:
+            snapshot = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        current = None
+        for (metric, labels), (counts, total, count) in snapshot:
+            if metric != current:
+                current = metric
+                lines.append(f"# HELP {metric} {METRICS_HELP.get(metric, metric)}")
+                lines.append(f"# TYPE {metric} histogram")
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+            prefix = label_str + "," if label_str else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{label_str}}} {total:.6f}")
+            lines.append(f"{metric}_count{{{label_str}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+# Spans der laufenden Anfrage für den Server-Timing-Header (None ausserhalb einer Anfrage,
+# z.B. in Batch-Worker-Threads – dort landen die Werte nur in den Histogrammen)
+REQUEST_TIMINGS = contextvars.ContextVar("request_timings", default=None)
+
+
+def record_timing(name, seconds):
+    timings = REQUEST_TIMINGS.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def span(stage):
+    """Misst eine Pipeline-Stufe: Histogramm tarif_stage_seconds + Server-Timing."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        METRICS.observe("tarif_stage_seconds", (("stage", stage),), elapsed)
+        record_timing(stage, elapsed)
+
+
+_UPSTREAM_NAMES = {}
+
+
+def upstream_name(url):
+    """Kurzname des Upstreams für Metriken: groq, off oder der Hostname."""
+    # erst über die konfigurierten URLs (lokale Stand-ins teilen sich einen Host), dann per Host
+    if url == GROQ_URL:
+        return "groq"
+    if url.startswith(OFF_BASE_URL):
+        return "off"
+    host = urllib.parse.urlsplit(url).hostname or "unknown"
+    name = _UPSTREAM_NAMES.get(host)
+    if name is None:
+        if host == urllib.parse.urlsplit(GROQ_URL).hostname:
+            name = "groq"
+        else:
+            name = host
+        _UPSTREAM_NAMES[host] = name
+    return name
+
+
+def observe_upstream(url, status, seconds):
+    """Ausgehender HTTP-Aufruf (status: HTTP-Code oder 'error')."""
+    name = upstream_name(url)
+    METRICS.observe("tarif_upstream_seconds", (("status", str(status)), ("upstream", name)), seconds)
+    record_timing(f"{name}_http", seconds)
+
+
+def server_timing_header(timings, total=None):
+    """Server-Timing-Wert: Spans gleichen Namens summiert, in Reihenfolge des ersten Auftretens."""
+    merged = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ── HTTP-Client mit Verbindungspool ──
+class PooledResponse:
+    """Vollständig gelesene Antwort aus HTTPPool.request()."""
+    __slots__ = ("status", "reason", "headers", "data")
+
+    def __init__(self, status, reason, headers, data):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+    def json(self):
+        return json.loads(self.data.decode("utf-8"))
+
+
+class StreamingResponse:
+    """Antwort aus HTTPPool.open(): Body wird zeilenweise gelesen (z.B. Server-Sent Events).
+
+    Als Context-Manager verwenden; die Verbindung geht nur zurück in den Pool, wenn der
+    Body vollständig gelesen wurde, sonst wird sie geschlossen.
+    """
+
+    def __init__(self, pool, conn, sock, resp, deadline):
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        self._pool = pool
+        self._conn = conn
+        self._sock = sock
+        self._resp = resp
+        self._deadline = deadline
+        self._complete = False
+
+    def iter_lines(self):
+        # Restzeit des Gesamt-Timeouts vor jeder Zeile neu setzen (wie HTTPPool._read_body)
+        while True:
+            self._sock.settimeout(self._deadline.timeout())
+            line = self._resp.readline()
+            if not line:
+                self._complete = True
+                return
+            yield line.rstrip(b"\r\n")
+
+    def read(self):
+        data = HTTPPool._read_body(self._sock, self._resp, self._deadline)
+        self._complete = True
+        return data
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._complete and not self._resp.will_close:
+            self._pool._release(conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Cancellation:
+    """Bricht einen laufenden HTTPPool.request() aus einem anderen Thread ab.
+
+    cancel() schliesst den Socket des Aufrufs (shutdown), der blockierte Thread bekommt
+    CancelledError; die Verbindung wird verworfen. Wer erst nach cancel() senden will,
+    bekommt CancelledError, bevor etwas rausgeht.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sock = None
+        self.cancelled = False
+
+    def attach(self, sock):
+        with self._lock:
+            if self.cancelled:
+                raise CancelledError()
+            self._sock = sock
+
+    def detach(self):
+        # vor _release(): eine Verbindung im Pool gehört niemandem mehr
+        with self._lock:
+            self._sock = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._sock is not None:
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class HTTPPool:
+    """Thread-sicherer Keep-Alive-Verbindungspool für einen Upstream-Host.
+
+    Idle-Verbindungen werden LIFO wiederverwendet (maxsize begrenzt nur die Idle-Menge).
+    Der Timeout gilt für den gesamten Request (Verbindung, Antwort und Body), nicht nur
+    pro Socket-Operation. Bricht eine wiederverwendete Verbindung ab, weil der Server sie
+    inzwischen geschlossen hat, wird einmal mit neuer Verbindung wiederholt.
+    """
+
+    def __init__(self, scheme, host, port, maxsize=HTTP_POOL_SIZE, ssl_context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.ssl_context = ssl_context
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.requests = 0
+        self.discarded = 0
+
+    def _new_connection(self, timeout):
+        if self.scheme == "https":
+            context = self.ssl_context or ssl.create_default_context()
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _acquire(self, timeout):
+        with self._lock:
+            self.requests += 1
+            if self._idle:
+                self.reused += 1
+                conn = self._idle.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.opened += 1
+        return self._new_connection(timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    @staticmethod
+    def _read_body(sock, resp, deadline):
+        # Socket-Timeout vor jedem Block auf die Restzeit setzen → Gesamt-Timeout
+        chunks = []
+        while True:
+            sock.settimeout(deadline.timeout())
+            chunk = resp.read(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def request(self, method, path, body=None, headers=None, timeout=10, cancel=None):
+        deadline = Deadline(timeout)
+        for attempt in range(2):
+            conn, reused = self._acquire(deadline.timeout())
+            try:
+                if cancel is not None:
+                    if conn.sock is None:
+                        conn.connect()
+                    cancel.attach(conn.sock)
+                conn.request(method, path, body=body, headers=headers or {})
+                # getresponse() gibt conn.sock bei "Connection: close" an die Antwort ab
+                sock = conn.sock
+                sock.settimeout(deadline.timeout())
+                resp = conn.getresponse()
+                data = self._read_body(sock, resp, deadline)
+                if cancel is not None:
+                    cancel.detach()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if cancel is not None and cancel.cancelled:
+                    raise CancelledError() from None
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                # Auch bei Timeout: halb gelesene Verbindung nie zurückgeben
+                conn.close()
+                if cancel is not None and cancel.cancelled:
+                    raise CancelledError() from None
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return PooledResponse(resp.status, resp.reason, resp.headers, data)
+
+    def open(self, method, path, body=None, headers=None, timeout=10):
+        """Wie request(), liest den Body aber nicht: gibt eine StreamingResponse zurück."""
+        deadline = Deadline(timeout)
+        for attempt in range(2):
+            conn, reused = self._acquire(deadline.timeout())
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                sock = conn.sock
+                sock.settimeout(deadline.timeout())
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return StreamingResponse(self, conn, sock, resp, deadline)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "opened": self.opened,
+            "reused": self.reused,
+            "idle": len(self._idle),
+            "maxsize": self.maxsize,
+            "discarded": self.discarded,
+        }
+
+
+HTTP_POOLS = {}
+ASYNC_HTTP_POOLS = {}   # befüllt von asgi.py (ASGI-Modus), hier nur für /stats
+_HTTP_POOLS_LOCK = threading.Lock()
+
+
+def get_http_pool(url):
+    """Pool für Schema+Host+Port der URL (wird beim ersten Zugriff angelegt)."""
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    origin = f"{parts.scheme}://{parts.hostname}:{port}"
+    with _HTTP_POOLS_LOCK:
+        pool = HTTP_POOLS.get(origin)
+        if pool is None:
+            pool = HTTP_POOLS[origin] = HTTPPool(parts.scheme, parts.hostname, port)
+    return pool
+
+
+def http_request(url, data=None, headers=None, timeout=10, method=None, cancel=None):
+    """Wie urllib.request.urlopen(...).read(), aber über den Keep-Alive-Pool des Hosts.
+    HTTP-Status >= 400 wird als urllib.error.HTTPError geworfen; cancel: siehe Cancellation."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    method = method or ("POST" if data is not None else "GET")
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        resp = get_http_pool(url).request(method, path, body=data, headers=headers, timeout=timeout,
+                                          cancel=cancel)
+        status = resp.status
+    except CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        observe_upstream(url, status, time.perf_counter() - t0)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(resp.data))
+    return resp
+
+
+def http_stream(url, data=None, headers=None, timeout=10, method=None):
+    """Wie http_request, aber mit zeilenweise lesbarem Body (StreamingResponse)."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    method = method or ("POST" if data is not None else "GET")
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        resp = get_http_pool(url).open(method, path, body=data, headers=headers, timeout=timeout)
+        status = resp.status
+    finally:
+        # nur bis zu den Antwort-Headern; der gestreamte Body zählt zur Stufe "llm"
+        observe_upstream(url, status, time.perf_counter() - t0)
+    if resp.status >= 400:
+        with resp:
+            body = resp.read()
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+    return resp
+
+
 def _extract_json(text):
     """Extract JSON object from text, handling markdown code fences."""
     text = text.strip()
@@ -88,156 +622,1064 @@ def _extract_json(text):
     raise ValueError(f"No valid JSON found in response: {text[:200]}")
 
 
-def _call_groq_model(model, messages, max_tokens, temperature):
-    """Perform a single Groq API call with the given model."""
+def _groq_request(model, messages, max_tokens, temperature, stream=False):
+    """Build payload and headers for a chat-completions call (shared by sync/async)."""
     body = {
         "model": model,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature,
     }
+    if stream:
+        # Groq: JSON mode is not available together with streaming → _extract_json afterwards
+        body["stream"] = True
     # Only add JSON mode for models that support it (avoids 413/422 errors)
-    if model in GROQ_JSON_MODE_MODELS:
+    elif model in GROQ_JSON_MODE_MODELS:
         body["response_format"] = {"type": "json_object"}
     # ensure_ascii=False keeps German chars as UTF-8 (saves ~15% payload size)
     payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
 
-    req = urllib.request.Request(GROQ_URL, data=payload, headers={
+    headers = {
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json",
         "User-Agent": "Tarifierungstool/4.0"
-    })
+    }
+    return payload, headers
+
+
+class TokenEstimator:
+    """Lokale Token-Schätzung (Llama-3-Tokenizer), laufend an Groq-usage kalibriert.
+
+    Zählt Wortstücke statt Zeichen: lange deutsche Komposita und Umlaute zerfallen in
+    mehr Tokens als englischer Text, Ziffern werden in Dreiergruppen tokenisiert.
+    Der Korrekturfaktor (tatsächliche / geschätzte prompt_tokens) wird aus jeder
+    Groq-Antwort als gleitender Mittelwert nachgeführt.
+    """
+    PIECE_RE = re.compile(r"[^\W\d_]+|\d+|\n+| +|[^\w\s]+|\s")
+    MESSAGE_OVERHEAD = 4   # Rollen-Header pro Chat-Nachricht
+    ALPHA = 0.2            # Gewicht einer neuen Messung
+
+    def __init__(self, factor=1.0):
+        self.factor = factor
+        self.samples = 0
+        self.error = 0.0   # gleitender relativer Fehler der Schätzung (vor der Korrektur)
+        self._costs = {}   # Wortstück → Rohkosten
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _piece_cost(piece):
+        first = piece[0]
+        if first.isalpha():
+            # ~5 Zeichen pro Wortstück, Nicht-ASCII-Buchstaben (ä, ö, ü, ß, é) kosten extra
+            return 1 + (len(piece) - 1) // 5 + 0.5 * sum(1 for c in piece if ord(c) > 127)
+        if first.isdigit():
+            return (len(piece) + 2) // 3
+        if first == " ":
+            return 0 if len(piece) == 1 else 1   # einzelnes Leerzeichen gehört zum nächsten Wort
+        if first.isspace():
+            return 1
+        if first.isascii():
+            return (len(piece) + 1) // 2
+        return len(piece)   # Rahmenzeichen (═), Pfeile, Symbole: je ein Token
+
+    def _cost(self, piece):
+        cost = self._costs.get(piece)
+        if cost is None:
+            cost = self._piece_cost(piece)
+            if len(self._costs) < 200000:   # Wortschatz des Korpus + Anfragen, begrenzt
+                self._costs[piece] = cost
+        return cost
+
+    def _raw(self, text):
+        cost = self._cost
+        return sum(cost(piece) for piece in self.PIECE_RE.findall(text))
+
+    def count(self, text):
+        return round(self._raw(text) * self.factor)
+
+    def count_messages(self, messages):
+        raw = sum(self._raw(m.get("content", "")) + self.MESSAGE_OVERHEAD for m in messages)
+        return round(raw * self.factor)
+
+    def truncate(self, text, max_tokens):
+        """Kürzt text auf höchstens max_tokens (möglichst an einem Zeilenende)."""
+        limit = max_tokens / self.factor
+        total = 0.0
+        cost = self._cost
+        for m in self.PIECE_RE.finditer(text):
+            total += cost(m.group())
+            if total > limit:
+                cut = m.start()
+                newline = text.rfind("\n", 0, cut)
+                if newline > cut * 0.8:
+                    cut = newline
+                return text[:cut].rstrip()
+        return text
+
+    def observe(self, messages, usage):
+        """Kalibriert den Faktor mit den prompt_tokens einer Groq-Antwort."""
+        actual = (usage or {}).get("prompt_tokens")
+        if not actual:
+            return
+        raw = sum(self._raw(m.get("content", "")) + self.MESSAGE_OVERHEAD for m in messages)
+        if not raw:
+            return
+        ratio = min(2.5, max(0.4, actual / raw))
+        with self._lock:
+            error = abs(raw * self.factor - actual) / actual
+            if self.samples == 0:
+                self.factor, self.error = ratio, error
+            else:
+                self.factor += self.ALPHA * (ratio - self.factor)
+                self.error += self.ALPHA * (error - self.error)
+            self.samples += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "factor": round(self.factor, 3),
+                "samples": self.samples,
+                "error_pct": round(self.error * 100, 1),
+            }
+
+
+TOKEN_ESTIMATOR = TokenEstimator()
 
-    # Hard total timeout via SIGALRM (Linux only).
-    # urllib timeout=25 is per-socket-read; Groq streaming can still exceed 30s total.
-    # SIGALRM fires after 22s total regardless of streaming, giving Flask ~7s margin.
-    def _alarm(signum, frame):
-        raise TimeoutError("Groq-Anfrage nach 22s abgebrochen (Render-Limit)")
 
-    old = signal.signal(signal.SIGALRM, _alarm)
-    signal.alarm(22)
+def estimate_prompt_tokens(messages):
+    """Token-Schätzung der Nachrichten für die Rate-Limit-Buchung."""
+    return TOKEN_ESTIMATOR.count_messages(messages)
+
+
+def _limiter_max_wait(deadline):
+    """Wie lange ein Aufruf in der Limiter-Queue warten darf, ohne die Deadline zu reissen."""
+    return max(0.0, min(GROQ_LIMITER_MAX_WAIT, deadline.remaining() - GROQ_MIN_CALL_SECONDS))
+
+
+def _call_groq_model(model, messages, max_tokens, temperature, deadline=None, purpose="classify",
+                     cancel=None, max_wait=None):
+    """Perform a single Groq API call with the given model (usage is booked under purpose).
+    cancel (Cancellation) aborts the call from another thread; max_wait caps the limiter queue."""
+    payload, headers = _groq_request(model, messages, max_tokens, temperature)
+    deadline = deadline or Deadline(GROQ_TIMEOUT)
+
+    # Client-side TPM/RPM budget: queue until free instead of provoking a 429.
+    limiter = groq_limiter(model)
+    prompt_tokens = estimate_prompt_tokens(messages)
+    cost = prompt_tokens + max_tokens
+    with span("groq_queue"):
+        limiter.acquire(cost, _limiter_max_wait(deadline) if max_wait is None else max_wait)
+
+    # Hard total timeout: whatever is left of the request deadline (no SIGALRM, thread-safe).
+    # Without a deadline (e.g. /test-groq) the call is capped at GROQ_TIMEOUT.
+    if cancel is not None and cancel.cancelled:   # Rennen schon entschieden, nichts gesendet
+        limiter.settle(cost, usage={"total_tokens": 0})
+        raise CancelledError()
+    timeout = deadline.timeout()
+    t0 = time.perf_counter()
     try:
-        with urllib.request.urlopen(req, timeout=25) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old)
+        resp = http_request(GROQ_URL, data=payload, headers=headers, timeout=timeout, cancel=cancel)
+    except urllib.error.HTTPError as e:
+        limiter.settle(cost, headers=e.headers, rate_limited=_is_rate_limit_error(e))
+        raise
+    except CancelledError:
+        _book_cancelled_call(limiter, cost, model, purpose, prompt_tokens)
+        raise
+    except TimeoutError as e:
+        _book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise TimeoutError(f"Groq-Anfrage nach {timeout:.0f}s abgebrochen (Render-Limit)")
+    except Exception as e:
+        _book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise
+    GROQ_HEDGER.observe(model, time.perf_counter() - t0)
+    data = resp.json()
+    limiter.settle(cost, usage=data.get("usage"), headers=resp.headers)
+    TOKEN_ESTIMATOR.observe(messages, data.get("usage"))
+    GROQ_USAGE.record(model, purpose, data.get("usage"))
 
     content = data["choices"][0]["message"]["content"]
     return _extract_json(content)
 
 
+def _book_cancelled_call(limiter, cost, model, purpose, prompt_tokens):
+    """Abgebrochener Aufruf (Verlierer beim Hedging): Groq hat den Prompt schon angenommen,
+    die Prompt-Tokens zählen also gegen das TPM-Budget – gebucht wird die Schätzung."""
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
+    limiter.settle(cost, usage=usage)
+    GROQ_USAGE.record(model, purpose, usage)
+
+
+def _book_failed_call(limiter, cost, model, purpose, prompt_tokens, error):
+    """Timeout oder Netzwerkfehler nach acquire(): Reservierung abrechnen. Ohne Verbindung hat
+    Groq nichts verbraucht; sonst kann der Prompt schon angenommen sein (wie _book_cancelled_call)."""
+    if isinstance(error, (socket.gaierror, ConnectionRefusedError)):
+        limiter.settle(cost, usage={"total_tokens": 0})
+    else:
+        _book_cancelled_call(limiter, cost, model, purpose, prompt_tokens)
+
+
 def _is_rate_limit_error(e):
     """Groq uses 429 OR 413 with 'Too Many Requests' for rate limiting."""
     return e.code == 429 or (e.code == 413 and 'too many' in str(e.reason).lower())
 
 
-def call_groq(messages, max_tokens=2000, temperature=0.1):
-    """Groq API call. Returns rate-limit errors as structured exceptions."""
+def _groq_http_error(e):
+    """Map a Groq HTTPError to RateLimitError or a generic Exception."""
+    if _is_rate_limit_error(e):
+        retry_after = e.headers.get('Retry-After', '60')
+        return RateLimitError(f"Groq Rate Limit – bitte {retry_after}s warten",
+                              int(float(retry_after)) if retry_after.replace(".", "", 1).isdigit() else 60)
+    return Exception(f"HTTP Error {e.code}: {e.reason}")
+
+
+def _is_rate_limited(e):
+    """Rate-Limit in jeder Form: RateLimitError des Limiters oder 429/413 von Groq
+    (HTTPError, erst call_groq wandelt ihn um) – für das Hedging."""
+    return isinstance(e, RateLimitError) or (isinstance(e, urllib.error.HTTPError) and _is_rate_limit_error(e))
+
+
+def _stream_groq_model(model, messages, max_tokens, temperature, deadline=None, purpose="classify"):
+    """Groq-Aufruf mit stream: true – liefert die Text-Deltas, sobald sie eintreffen."""
+    payload, headers = _groq_request(model, messages, max_tokens, temperature, stream=True)
+    deadline = deadline or Deadline(GROQ_TIMEOUT)
+
+    limiter = groq_limiter(model)
+    prompt_tokens = estimate_prompt_tokens(messages)
+    cost = prompt_tokens + max_tokens
+    with span("groq_queue"):
+        limiter.acquire(cost, _limiter_max_wait(deadline))
+
+    timeout = deadline.timeout()
+    usage = None
+    try:
+        with http_stream(GROQ_URL, data=payload, headers=headers, timeout=timeout) as resp:
+            # Bis zum Ende lesen (nicht bei [DONE] abbrechen), damit die Verbindung wiederverwendbar bleibt
+            for line in resp.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    continue
+                chunk = json.loads(data)
+                # Groq liefert usage im letzten Chunk unter x_groq
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+    except urllib.error.HTTPError as e:
+        limiter.settle(cost, headers=e.headers, rate_limited=_is_rate_limit_error(e))
+        raise
+    except TimeoutError as e:
+        _book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise TimeoutError(f"Groq-Anfrage nach {timeout:.0f}s abgebrochen (Render-Limit)")
+    except (Exception, GeneratorExit) as e:   # GeneratorExit: Client hat den SSE-Stream geschlossen
+        _book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise
+    limiter.settle(cost, usage=usage, headers=resp.headers)
+    TOKEN_ESTIMATOR.observe(messages, usage)
+    GROQ_USAGE.record(model, purpose, usage)
+
+
+def stream_groq(messages, max_tokens=2000, temperature=0.1, deadline=None):
+    """Streaming-Variante von call_groq: Generator über die Text-Deltas."""
     try:
-        return _call_groq_model(GROQ_MODEL, messages, max_tokens, temperature)
+        yield from _stream_groq_model(GROQ_MODEL, messages, max_tokens, temperature, deadline)
     except urllib.error.HTTPError as e:
-        if _is_rate_limit_error(e):
-            retry_after = e.headers.get('Retry-After', '60')
-            raise RateLimitError(f"Groq Rate Limit – bitte {retry_after}s warten")
-        raise Exception(f"HTTP Error {e.code}: {e.reason}")
+        raise _groq_http_error(e)
+
+
+def call_groq(messages, max_tokens=2000, temperature=0.1, deadline=None, purpose="classify", validate=None):
+    """Groq API call. Returns rate-limit errors as structured exceptions.
+
+    With validate (schema check of the parsed JSON) the call is hedged, see GroqHedger;
+    the result then carries "model" (who answered) and "hedged".
+    """
+    try:
+        if validate is not None:
+            return GROQ_HEDGER.call(messages, max_tokens, temperature, deadline, purpose, validate)
+        return _call_groq_model(GROQ_MODEL, messages, max_tokens, temperature, deadline, purpose)
+    except urllib.error.HTTPError as e:
+        raise _groq_http_error(e)
+
+
+class GroqHedger:
+    """Hedging für Groq-Aufrufe gegen langsame Ausreisser des Primärmodells.
+
+    Hat GROQ_MODEL nach delay() – dem GROQ_HEDGE_PERCENTILE seiner zuletzt beobachteten
+    Latenzen – nicht geantwortet, geht derselbe Prompt zusätzlich an GROQ_HEDGE_MODEL. Das
+    erste JSON, das validate() besteht, gewinnt; der andere Aufruf wird abgebrochen (Socket
+    zu, Prompt-Tokens werden trotzdem gebucht). Gehedgt wird nur wegen Langsamkeit: scheitert
+    das Primärmodell vorher, kommt sein Fehler zurück; ein Rate-Limit (RateLimitError des
+    Limiters oder 429 von Groq, siehe _is_rate_limited) wird immer weitergereicht
+    (retry_after für Aufrufer und Batch-Retry), auch wenn der Hedge schon läuft.
+    Der Hedge wartet nicht in der Limiter-Queue: ist das Budget des schnellen Modells
+    erschöpft, läuft nur das Primärmodell weiter.
+    """
+
+    def __init__(self, model, percentile, min_delay, default_delay):
+        self.model = model
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self._latencies = {}   # Modell → deque der letzten GROQ_HEDGE_WINDOW Aufrufdauern (s)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="groq-hedge")
+        self.calls = 0
+        self.hedged = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.answered_by = Counter()
+
+    def observe(self, model, seconds):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=GROQ_HEDGE_WINDOW)).append(seconds)
+
+    def delay(self, model):
+        """Wartezeit bis zum Hedge: Perzentil der beobachteten Latenz, vorher default_delay."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < GROQ_HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, samples[min(len(samples) - 1, int(len(samples) * self.percentile))])
+
+    def _start(self, model, messages, max_tokens, temperature, deadline, purpose, max_wait=None):
+        cancel = Cancellation()
+        # Kontext kopieren: Spans und Groq-Verbrauch landen bei der auslösenden Anfrage
+        future = self._pool.submit(contextvars.copy_context().run, _call_groq_model, model, messages,
+                                   max_tokens, temperature, deadline, purpose, cancel, max_wait)
+        return future, cancel
+
+    def call(self, messages, max_tokens, temperature, deadline, purpose, validate):
+        deadline = deadline or Deadline(GROQ_TIMEOUT)
+        if not self.model or self.model == GROQ_MODEL:
+            try:
+                result = _call_groq_model(GROQ_MODEL, messages, max_tokens, temperature, deadline, purpose)
+            except Exception as e:
+                return self.finish(None, {GROQ_MODEL: e}, False, 0)
+            return self.finish((GROQ_MODEL, result), {}, False, 0)
+
+        future, cancel = self._start(GROQ_MODEL, messages, max_tokens, temperature, deadline, purpose)
+        running = {future: (GROQ_MODEL, cancel)}
+        hedge_at = time.monotonic() + self.delay(GROQ_MODEL)
+        hedge_pending, hedged = True, False
+        winner, invalid, errors = None, None, {}
+        try:
+            while running and winner is None and not _is_rate_limited(errors.get(GROQ_MODEL)):
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_pending else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    model, _ = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors[model] = e
+                        continue
+                    if winner is None and validate(result):
+                        winner = (model, result)
+                    elif invalid is None:
+                        invalid = (model, result)
+                if GROQ_MODEL in errors:
+                    hedge_pending = False   # früher Fehler ist keine Langsamkeit
+                if winner is None and hedge_pending and time.monotonic() >= hedge_at:
+                    hedge_pending = False
+                    if deadline.remaining() > GROQ_MIN_CALL_SECONDS:
+                        hedged = True
+                        future, cancel = self._start(self.model, messages, max_tokens, temperature, deadline,
+                                                     "hedge", max_wait=0)
+                        running[future] = (self.model, cancel)
+        finally:
+            for _, cancel in running.values():
+                cancel.cancel()
+        if _is_rate_limited(errors.get(GROQ_MODEL)):
+            return self.finish(None, errors, hedged, len(running))
+        return self.finish(winner or invalid, errors, hedged, len(running))
+
+    def finish(self, answer, errors, hedged, cancelled):
+        """Bucht ein Rennen (auch für asgi.py) und gibt das Ergebnis mit model/hedged zurück.
+        Ohne Antwort wird der Fehler des Primärmodells geworfen (sonst der des Hedges)."""
+        with self._lock:
+            self.calls += 1
+            self.hedged += 1 if hedged else 0
+            self.cancelled += cancelled
+            if answer:
+                self.answered_by[answer[0]] += 1
+            else:
+                self.failed += 1
+        if answer is None:
+            raise errors.get(GROQ_MODEL) or next(iter(errors.values()))
+        model, result = answer
+        if isinstance(result, dict):
+            result["model"], result["hedged"] = model, hedged
+        return result
+
+    def stats(self):
+        with self._lock:
+            latency = {}
+            for model, samples in self._latencies.items():
+                ordered = sorted(samples)
+                latency[model] = {
+                    "samples": len(ordered),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000),
+                    "p90_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000),
+                }
+            stats = {
+                "model": self.model or None,
+                "percentile": self.percentile,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.calls, 3) if self.calls else 0.0,
+                "cancelled": self.cancelled,
+                "failed": self.failed,
+                "answered_by": dict(self.answered_by),
+                "latency": latency,
+            }
+        stats["delay_ms"] = round(self.delay(GROQ_MODEL) * 1000)
+        return stats
+
+
+GROQ_HEDGER = GroqHedger(GROQ_HEDGE_MODEL, GROQ_HEDGE_PERCENTILE, GROQ_HEDGE_MIN_DELAY, GROQ_HEDGE_DEFAULT_DELAY)
+
+TARIFF_NUMBER_RE = re.compile(r'^\d{4}\.\d{4}$')
+
+
+def is_valid_classification(result):
+    """Schema-Check der LLM-Antwort für das Hedging: Objekt mit Tarifnummer XXXX.XXXX."""
+    return isinstance(result, dict) and bool(TARIFF_NUMBER_RE.match(str(result.get("tariff_number", "")).strip()))
 
 
 class RateLimitError(Exception):
-    pass
+    def __init__(self, message, retry_after=60):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ── Groq Rate-Limiter ──
+def _parse_groq_duration(value):
+    """Groq-Reset-Angaben wie '7.66s', '2m59.56s' oder '120ms' → Sekunden."""
+    if not value:
+        return None
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+class GroqRateLimiter:
+    """Token-Bucket für Tokens/Minute und Requests/Minute eines Groq-Modells.
+
+    Aufrufe reservieren ihre geschätzten Kosten sofort; reicht das Budget nicht, darf
+    der Bucket negativ werden und der Aufrufer wartet, bis die Schuld abgebaut ist.
+    Spätere Aufrufer stehen damit automatisch hinten an (FIFO). Wäre die Wartezeit
+    länger als max_wait, wird sofort RateLimitError geworfen. Nach dem Aufruf wird die
+    Schätzung mit den tatsächlichen usage-Werten und den x-ratelimit-Headern abgeglichen.
+    """
 
+    def __init__(self, tpm, rpm):
+        self.tpm = tpm
+        self.rpm = rpm
+        self.tokens = float(tpm)
+        self.requests = float(rpm)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.max_queued = 0
+        self.calls = 0
+        self.waits = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+        self.upstream_429 = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60.0)
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60.0)
+
+    def reserve(self, cost, max_wait):
+        """Bucht cost Tokens + 1 Request; gibt die nötige Wartezeit in Sekunden zurück."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            needed = min(cost, self.tpm)   # Prompts grösser als das TPM-Limit: voller Bucket genügt
+            wait = max(
+                (needed - self.tokens) * 60.0 / self.tpm if self.tokens < needed else 0.0,
+                (1 - self.requests) * 60.0 / self.rpm if self.requests < 1 else 0.0,
+                self.blocked_until - now,
+            )
+            if wait > max_wait:
+                self.rejected += 1
+                retry_after = max(1, round(wait))
+                raise RateLimitError(f"Groq Rate Limit – bitte {retry_after}s warten", retry_after)
+            self.tokens -= cost
+            self.requests -= 1
+            self.calls += 1
+            self.estimated_tokens += cost
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            return wait
+
+    def _enter_queue(self):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def _leave_queue(self):
+        with self._lock:
+            self.queued -= 1
+
+    def acquire(self, cost, max_wait):
+        """Reserviert und blockiert den Thread, bis das Budget frei ist."""
+        wait = self.reserve(cost, max_wait)
+        if wait > 0:
+            self._enter_queue()
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_queue()
+
+    async def acquire_async(self, cost, max_wait):
+        """Wie acquire(), wartet aber auf dem Event-Loop (ASGI-Modus)."""
+        import asyncio
+        wait = self.reserve(cost, max_wait)
+        if wait > 0:
+            self._enter_queue()
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_queue()
+
+    def settle(self, cost, usage=None, headers=None, rate_limited=False):
+        """Abgleich nach dem Aufruf: tatsächliche Tokens, Groq-Header, 429-Sperre."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if usage and usage.get("total_tokens") is not None:
+                actual = int(usage["total_tokens"])
+                self.tokens += cost - actual
+                self.actual_tokens += actual
+            if headers is not None:
+                limit = headers.get("x-ratelimit-limit-tokens")
+                if limit and limit.isdigit():
+                    self.tpm = int(limit)
+                remaining = headers.get("x-ratelimit-remaining-tokens")
+                if remaining and remaining.isdigit():
+                    # Groq ist massgebend; eigene, noch laufende Reservierungen bleiben abgezogen
+                    self.tokens = min(self.tokens, float(remaining))
+            if rate_limited:
+                self.upstream_429 += 1
+                self.tokens = min(self.tokens, 0.0)
+                retry_after = None
+                if headers is not None:
+                    value = headers.get("retry-after")
+                    retry_after = (float(value) if value and value.replace(".", "", 1).isdigit()
+                                   else _parse_groq_duration(headers.get("x-ratelimit-reset-tokens")))
+                self.blocked_until = time.monotonic() + (retry_after or 60.0)
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "tpm": self.tpm,
+                "rpm": self.rpm,
+                "tokens_available": round(self.tokens),
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "calls": self.calls,
+                "waits": self.waits,
+                "rejected": self.rejected,
+                "upstream_429": self.upstream_429,
+                "avg_wait_ms": round(self.wait_seconds / self.waits * 1000, 1) if self.waits else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+            }
+
+
+GROQ_LIMITERS = {}
+_GROQ_LIMITERS_LOCK = threading.Lock()
+
+
+def groq_limiter(model):
+    with _GROQ_LIMITERS_LOCK:
+        limiter = GROQ_LIMITERS.get(model)
+        if limiter is None:
+            limiter = GROQ_LIMITERS[model] = GroqRateLimiter(GROQ_TPM, GROQ_RPM)
+    return limiter
+
+
+# ── Groq-Verbrauch (Tokens und Kosten) ──
+# Listenpreise in USD pro 1M Tokens (Input, Output); groq/compound rechnet je nach
+# verwendetem Modell und Tool ab und wird nur in Tokens geführt.
+GROQ_PRICES_USD = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+USAGE_WINDOWS = (60, 300, 900)  # Sekunden für die rollierende TPM-Auswertung
 
-# ── Open Food Facts lookup ──
-def search_openfoodfacts(query):
-    clean = re.sub(r'\D', '', query)
-    if len(clean) >= 8:
-        result = off_by_barcode(clean)
-        if result:
-            return result
-    return off_text_search(query)
+# Groq-Aufrufe der laufenden Klassifizierung (für result["usage"] und die Kapitel-Statistik)
+REQUEST_USAGE = contextvars.ContextVar("request_usage", default=None)
+# Route der laufenden Anfrage (/classify, /classify/stream, /classify/batch, ...)
+REQUEST_ROUTE = contextvars.ContextVar("request_route", default=None)
 
 
-def off_by_barcode(ean):
+def groq_cost_usd(model, prompt_tokens, completion_tokens):
+    prices = GROQ_PRICES_USD.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6
+
+
+@contextmanager
+def collect_usage():
+    """Sammelt die Groq-Aufrufe einer Klassifizierung (liefert die Liste)."""
+    calls = []
+    token = REQUEST_USAGE.set(calls)
     try:
-        url = f"https://world.openfoodfacts.org/api/v2/product/{ean}.json?fields=product_name,brands,ingredients_text,categories,quantity"
-        req = urllib.request.Request(url, headers={"User-Agent": "Tarifierungstool/4.0"})
-        with urllib.request.urlopen(req, timeout=2) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            if data.get("status") == 1 and data.get("product"):
-                return format_off_product(data["product"], ean)
-    except Exception:
-        pass
-    return None
+        yield calls
+    finally:
+        try:
+            REQUEST_USAGE.reset(token)
+        except ValueError:  # Generator in anderem Kontext fortgesetzt
+            REQUEST_USAGE.set(None)
 
 
-def off_text_search(query):
-    result = _off_search(query)
-    if result:
-        return result
-    clean = re.sub(r'[\d,]+\s*(ml|l|g|kg|cl|dl)\b', '', query, flags=re.IGNORECASE).strip()
-    if clean != query:
-        result = _off_search(clean)
-        if result:
-            return result
-    words = query.lower().split()
-    if len(words) >= 2:
-        for i in range(len(words) - 1, 0, -1):
-            product_part = ' '.join(words[i:])
-            brand_part = ' '.join(words[:i])
-            if len(product_part) > 3:
-                result = _off_search(f"{brand_part} {product_part}")
-                if result:
-                    return result
-    return None
+def summarize_usage(calls):
+    """Summe über Groq-Aufrufe für result["usage"] (inkl. Einzelaufrufe)."""
+    costs = [c["cost_usd"] for c in calls if c["cost_usd"] is not None]
+    return {
+        "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+        "completion_tokens": sum(c["completion_tokens"] for c in calls),
+        "total_tokens": sum(c["total_tokens"] for c in calls),
+        "cost_usd": round(sum(costs), 6) if costs else None,
+        "calls": [dict(c) for c in calls],
+    }
 
 
-def _off_search(query):
-    try:
-        encoded = urllib.parse.quote(query)
-        url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={encoded}&search_simple=1&action=process&json=1&page_size=3&fields=product_name,brands,ingredients_text,categories,quantity,code"
-        req = urllib.request.Request(url, headers={"User-Agent": "Tarifierungstool/4.0"})
-        with urllib.request.urlopen(req, timeout=2) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            products = data.get("products", [])
-            for p in products:
-                if p.get("ingredients_text"):
-                    return format_off_product(p, p.get("code", ""))
-            if products:
-                return format_off_product(products[0], products[0].get("code", ""))
-    except Exception:
-        pass
+class GroqUsageLedger:
+    """Verbuchte Groq-usage: Summen pro Modell, Zweck, Route und Kapitel, rollierende TPM.
+
+    record() wird nach jedem erfolgreichen Aufruf gerufen (auch Kapitel-Fallback und
+    Web-Suche) und hängt den Aufruf an die laufende Klassifizierung (REQUEST_USAGE).
+    record_request() bucht die Summe einer Klassifizierung auf ihr Kapitel – so wird
+    sichtbar, welche Kapitel die grössten Prompts erzeugen.
+    """
+
+    def __init__(self, windows=USAGE_WINDOWS):
+        self.windows = windows
+        self._events = deque()  # (Zeit, Modell, Tokens) der letzten max(windows) Sekunden
+        self._groups = {"model": {}, "purpose": {}, "route": {}, "chapter": {}}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(group, key, prompt, completion, cost, calls=1, requests=0):
+        entry = group.get(key)
+        if entry is None:
+            entry = group[key] = {"requests": 0, "calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                  "total_tokens": 0, "max_prompt_tokens": 0, "cost_usd": 0.0}
+        entry["requests"] += requests
+        entry["calls"] += calls
+        entry["prompt_tokens"] += prompt
+        entry["completion_tokens"] += completion
+        entry["total_tokens"] += prompt + completion
+        entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], prompt)
+        entry["cost_usd"] += cost or 0.0
+
+    def _expire(self, now):
+        horizon = now - max(self.windows)
+        while self._events and self._events[0][0] < horizon:
+            self._events.popleft()
+
+    def record(self, model, purpose, usage):
+        usage = usage or {}
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        cost = groq_cost_usd(model, prompt, completion)
+        route = REQUEST_ROUTE.get() or "other"
+        call = {"model": model, "purpose": purpose, "prompt_tokens": prompt, "completion_tokens": completion,
+                "total_tokens": prompt + completion,
+                "cost_usd": round(cost, 6) if cost is not None else None}
+        now = time.monotonic()
+        with self._lock:
+            self._events.append((now, model, prompt + completion))
+            self._expire(now)
+            self._add(self._groups["model"], model, prompt, completion, cost)
+            self._add(self._groups["purpose"], purpose, prompt, completion, cost)
+            self._add(self._groups["route"], route, prompt, completion, cost)
+        calls = REQUEST_USAGE.get()
+        if calls is not None:
+            calls.append(call)
+        return call
+
+    def record_request(self, chapter, calls):
+        """Summe einer Klassifizierung auf das (Primär-)Kapitel buchen."""
+        if not calls:
+            return
+        prompt = sum(c["prompt_tokens"] for c in calls)
+        completion = sum(c["completion_tokens"] for c in calls)
+        cost = sum(c["cost_usd"] or 0.0 for c in calls)
+        with self._lock:
+            self._add(self._groups["chapter"], str(chapter), prompt, completion, cost,
+                      calls=len(calls), requests=1)
+
+    def rolling(self):
+        """Tokens und Aufrufe pro Minute je Modell über die Fenster in USAGE_WINDOWS."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            events = list(self._events)
+        report = {}
+        for model in sorted({m for _, m, _ in events}):
+            entry = report[model] = {}
+            for window in self.windows:
+                recent = [tokens for t, m, tokens in events if m == model and t >= now - window]
+                minutes = window / 60
+                entry[f"tpm_{window // 60}m"] = round(sum(recent) / minutes)
+                entry[f"rpm_{window // 60}m"] = round(len(recent) / minutes, 1)
+            entry["tpm_limit"] = GROQ_TPM
+            entry["tpm_utilization_1m"] = round(entry["tpm_1m"] / GROQ_TPM, 3) if GROQ_TPM else None
+        return report
+
+    def report(self):
+        with self._lock:
+            groups = {name: {key: dict(entry) for key, entry in group.items()}
+                      for name, group in self._groups.items()}
+        for name, group in groups.items():
+            for entry in group.values():
+                # Klassifizierungen (requests) gibt es nur auf Kapitelebene, sonst Aufrufe
+                requests = entry.pop("requests") if name != "chapter" else entry["requests"]
+                count = requests or entry["calls"]
+                entry["cost_usd"] = round(entry["cost_usd"], 6)
+                entry["avg_prompt_tokens"] = round(entry["prompt_tokens"] / count) if count else 0
+            # grösste Verbraucher zuerst
+            groups[name] = dict(sorted(group.items(), key=lambda kv: -kv[1]["total_tokens"]))
+        for model, entry in groups["model"].items():
+            if model not in GROQ_PRICES_USD:
+                entry["cost_usd"] = None  # kein Listenpreis hinterlegt
+        return {"rolling": self.rolling(), **{f"by_{name}": group for name, group in groups.items()}}
+
+    def stats(self):
+        with self._lock:
+            models = self._groups["model"]
+            return {
+                "calls": sum(e["calls"] for e in models.values()),
+                "total_tokens": sum(e["total_tokens"] for e in models.values()),
+                "cost_usd": round(sum(e["cost_usd"] for e in models.values()), 6),
+            }
+
+
+GROQ_USAGE = GroqUsageLedger()
+
+
+# ── In-Process-Cache ──
+class TTLCache:
+    """Thread-sicherer LRU-Cache mit Ablaufzeit pro Eintrag und Zählern für /stats."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key → (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Gibt den Wert zurück oder None (fehlend/abgelaufen)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def normalize_query(product_query):
+    """Normalisierte Anfrage für Cache-Schlüssel: Kleinschreibung, einfache Leerzeichen."""
+    return ' '.join(product_query.lower().split())
+
+
+class EnrichmentCache:
+    """Cache für Produktdaten-Lookups (OFF, Web-Suche) inkl. Negativ-Caching.
+
+    Treffer werden mit der Quell-TTL gespeichert, "nicht gefunden" mit ENRICH_TTL_NEGATIVE
+    und Timeouts/Fehler mit ENRICH_TTL_ERROR; abgebrochene Lookups gar nicht. Pro Quelle wird gezählt, wie viele Lookups
+    der Cache beantwortet hat und wie viel Upstream-Latenz dadurch eingespart wurde.
+    """
+
+    def __init__(self, maxsize):
+        self._cache = TTLCache(maxsize, ENRICH_TTL_TEXT)
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    def _count(self, source, field, amount=1):
+        with self._lock:
+            counters = self._sources.setdefault(source, {
+                "hits": 0, "negative_hits": 0, "misses": 0, "errors": 0, "cancelled": 0,
+                "saved_seconds": 0.0, "upstream_seconds": 0.0,
+            })
+            counters[field] += amount
+
+    def _cached(self, source, key):
+        """(True, Wert) bei Cache-Treffer (auch negativ), sonst (False, None)."""
+        entry = self._cache.get((source, key))
+        if entry is None:
+            self._count(source, "misses")
+            return False, None
+        value, cost = entry
+        self._count(source, "hits" if value else "negative_hits")
+        self._count(source, "saved_seconds", cost)
+        return True, (dict(value) if value else None)
+
+    def _store(self, source, key, value, cost, ttl):
+        self._count(source, "upstream_seconds", cost)
+        self._cache.set((source, key), (dict(value) if value else None, cost), ttl)
+
+    def lookup(self, source, key, fetch, ttl):
+        """Gibt das gecachte Ergebnis zurück oder ruft fetch() auf (darf Exceptions werfen)."""
+        hit, value = self._cached(source, key)
+        if hit:
+            return value
+        t0 = time.perf_counter()
+        try:
+            value = fetch()
+            entry_ttl = ttl if value else ENRICH_TTL_NEGATIVE
+        except CancelledError:   # Anreicherung schon entschieden: nichts cachen
+            self._count(source, "cancelled")
+            raise
+        except Exception:
+            value = None
+            entry_ttl = ENRICH_TTL_ERROR
+            self._count(source, "errors")
+        self._store(source, key, value, time.perf_counter() - t0, entry_ttl)
+        return value
+
+    async def lookup_async(self, source, key, fetch, ttl):
+        """Wie lookup(), aber fetch ist eine Coroutine-Funktion (ASGI-Modus)."""
+        hit, value = self._cached(source, key)
+        if hit:
+            return value
+        t0 = time.perf_counter()
+        try:
+            value = await fetch()
+            entry_ttl = ttl if value else ENRICH_TTL_NEGATIVE
+        except Exception:
+            value = None
+            entry_ttl = ENRICH_TTL_ERROR
+            self._count(source, "errors")
+        self._store(source, key, value, time.perf_counter() - t0, entry_ttl)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            sources = {}
+            for source, c in self._sources.items():
+                lookups = c["hits"] + c["negative_hits"] + c["misses"]
+                sources[source] = {
+                    **{k: v for k, v in c.items() if not k.endswith("_seconds")},
+                    "hit_rate": round((c["hits"] + c["negative_hits"]) / lookups, 3) if lookups else 0.0,
+                    "saved_ms": round(c["saved_seconds"] * 1000, 1),
+                    "upstream_ms": round(c["upstream_seconds"] * 1000, 1),
+                }
+        return {"cache": self._cache.stats(), "sources": sources}
+
+
+ENRICH_CACHE = EnrichmentCache(ENRICH_CACHE_SIZE)
+
+
+# ── Open Food Facts lookup ──
+class OffBarcodeIndex:
+    """Read-only Zugriff auf den lokalen OFF-Index (SQLite, Schlüssel = EAN).
+
+    Die Zutaten sind bereits beim Import auf das deutsche "Zutaten:"-Segment gekürzt.
+    Fehlt die Datei, ist der Index inaktiv und get() liefert immer None.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.enabled = os.path.exists(path)
+        self.rows = 0
+        self._local = threading.local()   # sqlite3-Verbindungen sind pro Thread
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+        if self.enabled:
+            try:
+                row = self._conn().execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()
+                self.rows = int(row[0]) if row else 0
+            except sqlite3.Error:
+                self.enabled = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, ean):
+        if not self.enabled or not ean:
+            return None
+        t0 = time.perf_counter()
+        candidates = [ean] if len(ean) >= 13 else [ean, ean.zfill(13)]
+        row = None
+        try:
+            for code in candidates:
+                row = self._conn().execute(
+                    "SELECT name, brands, ingredients, categories, quantity FROM products WHERE ean = ?",
+                    (code,)).fetchone()
+                if row:
+                    break
+        except sqlite3.Error:
+            row = None
+        with self._lock:
+            self.lookups += 1
+            self.hits += 1 if row else 0
+            self.lookup_seconds += time.perf_counter() - t0
+        if not row:
+            return None
+        product = format_off_product({
+            "product_name": row[0], "brands": row[1], "ingredients_text": row[2],
+            "categories": row[3], "quantity": row[4],
+        }, ean)
+        product["source"] = "Open Food Facts (lokaler Index)"
+        return product
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "rows": self.rows,
+            "size_bytes": os.path.getsize(self.path) if self.enabled else 0,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "avg_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+        }
+
+
+OFF_INDEX = OffBarcodeIndex(OFF_INDEX_PATH)
+
+
+def off_by_barcode(ean, timeout=2, cancel=None):
+    # Lokaler Index zuerst (keine Netzwerklatenz), Live-API nur bei Fehltreffer
+    product = OFF_INDEX.get(ean)
+    if product:
+        return product
+    return ENRICH_CACHE.lookup("off_barcode", ean, lambda: _fetch_off_barcode(ean, timeout, cancel),
+                               ENRICH_TTL_BARCODE)
+
+
+def _off_barcode_url(ean):
+    return f"{OFF_BASE_URL}/api/v2/product/{ean}.json?fields=product_name,brands,ingredients_text,categories,quantity"
+
+
+def _parse_off_barcode(data, ean):
+    if data.get("status") == 1 and data.get("product"):
+        return format_off_product(data["product"], ean)
     return None
 
 
-def off_quick_search(query):
-    """Single-attempt OFF lookup with 3s total budget. No retries, no fallbacks.
-    Budget: OFF 3s + Groq 22s (SIGALRM) + overhead = 27s < Render's 30s."""
-    # Barcode?
-    clean = re.sub(r'\D', '', query)
-    if len(clean) >= 8:
-        return off_by_barcode(clean)
-    # Text: one request, page_size=3, prefer result with ingredients
-    try:
-        encoded = urllib.parse.quote(query)
-        url = (f"https://world.openfoodfacts.org/cgi/search.pl"
-               f"?search_terms={encoded}&search_simple=1&action=process"
-               f"&json=1&page_size=3&fields=product_name,brands,ingredients_text,categories,quantity,code")
-        req = urllib.request.Request(url, headers={"User-Agent": "Tarifierungstool/4.0"})
-        with urllib.request.urlopen(req, timeout=3) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            products = data.get("products", [])
-            for p in products:
-                if p.get("ingredients_text"):
-                    return format_off_product(p, p.get("code", ""))
-            if products:
-                return format_off_product(products[0], products[0].get("code", ""))
-    except Exception:
-        pass
+def _fetch_off_barcode(ean, timeout, cancel=None):
+    data = http_request(_off_barcode_url(ean), headers={"User-Agent": "Tarifierungstool/4.0"}, timeout=timeout,
+                        cancel=cancel).json()
+    return _parse_off_barcode(data, ean)
+
+
+def off_search_variants(query):
+    """OFF-Suchbegriffe, wichtigster zuerst: Anfrage, ohne Mengenangabe, ohne führende
+    (Marken-)Wörter. Gleiche Begriffe (nach normalize_query) nur einmal, Varianten ab 4 Zeichen."""
+    clean = ' '.join(re.sub(r'[\d,.]+\s*(ml|l|g|kg|cl|dl)\b', '', query, flags=re.IGNORECASE).split())
+    words = clean.split()
+    variants, seen = [query], {normalize_query(query)}
+    for candidate in [clean] + [' '.join(words[i:]) for i in range(1, len(words))]:
+        key = normalize_query(candidate)
+        if len(key) > 3 and key not in seen:
+            seen.add(key)
+            variants.append(candidate)
+    return variants
+
+
+def _off_search(query, timeout=2, cancel=None):
+    return ENRICH_CACHE.lookup("off_search", normalize_query(query),
+                               lambda: _fetch_off_search(query, timeout, cancel), ENRICH_TTL_TEXT)
+
+
+def _off_search_url(query):
+    # One request, page_size=3
+    encoded = urllib.parse.quote(query)
+    return (f"{OFF_BASE_URL}/cgi/search.pl"
+            f"?search_terms={encoded}&search_simple=1&action=process"
+            f"&json=1&page_size=3&fields=product_name,brands,ingredients_text,categories,quantity,code")
+
+
+def _parse_off_search(data):
+    # Prefer result with ingredients
+    products = data.get("products", [])
+    for p in products:
+        if p.get("ingredients_text"):
+            return format_off_product(p, p.get("code", ""))
+    if products:
+        return format_off_product(products[0], products[0].get("code", ""))
     return None
 
 
-def format_off_product(product, ean=""):
-    ingredients = product.get("ingredients_text", "") or ""
+def _fetch_off_search(query, timeout, cancel=None):
+    data = http_request(_off_search_url(query), headers={"User-Agent": "Tarifierungstool/4.0"}, timeout=timeout,
+                        cancel=cancel).json()
+    return _parse_off_search(data)
+
+
+def trim_ingredients(ingredients):
+    """Kürzt mehrsprachige OFF-Zutatenlisten auf das deutsche "Zutaten:"-Segment (sonst 600 Zeichen)."""
+    ingredients = ingredients or ""
     if "Zutaten:" in ingredients:
         de_start = ingredients.index("Zutaten:")
         for marker in ["Ingrédients:", "Ingredienti:", "Ingredients:"]:
@@ -249,6 +1691,11 @@ def format_off_product(product, ean=""):
             ingredients = ingredients[de_start:].strip()
     elif len(ingredients) > 600:
         ingredients = ingredients[:600]
+    return ingredients
+
+
+def format_off_product(product, ean=""):
+    ingredients = trim_ingredients(product.get("ingredients_text", ""))
     return {
         "name": product.get("product_name", ""),
         "brand": product.get("brands", ""),
@@ -261,63 +1708,209 @@ def format_off_product(product, ean=""):
 
 
 # ── Web Search Fallback (Groq Compound) ──
-def web_search_product(query):
-    try:
-        search_prompt = (
-            f"Suche im Internet nach dem Produkt: '{query}'.\n"
-            f"Finde folgende zollrelevante Informationen:\n"
-            f"- Exakter Produktname und Marke\n"
-            f"- Zusammensetzung / Zutaten / Material (mit Prozentangaben wenn verfügbar)\n"
-            f"- Menge/Gewicht\n"
-            f"- Produktkategorie\n"
-            f"- Verwendungszweck\n\n"
-            f"Antworte NUR als JSON:\n"
-            f'{{"name": "...", "brand": "...", "ingredients": "...", "categories": "...", '
-            f'"quantity": "...", "description": "...", "search_url": "..."}}'
-        )
-        payload = json.dumps({
-            "model": "groq/compound",
-            "messages": [
-                {"role": "system", "content": "Du bist ein Produktrecherche-Assistent. Suche im Web nach dem angegebenen Produkt und extrahiere zollrelevante Daten. Antworte ausschliesslich als JSON."},
-                {"role": "user", "content": search_prompt}
-            ],
-            "max_tokens": 1000,
-            "temperature": 0.1
-        }).encode("utf-8")
-
-        req = urllib.request.Request(GROQ_URL, data=payload, headers={
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json",
-            "User-Agent": "Tarifierungstool/4.0"
-        })
-
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            content = data["choices"][0]["message"]["content"]
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                result = json.loads(content)
-            name = result.get("name", "").strip()
-            ingredients = result.get("ingredients", "").strip()
-            if name or ingredients:
-                return {
-                    "name": name or query,
-                    "brand": result.get("brand", "").strip(),
-                    "ingredients": ingredients,
-                    "categories": result.get("categories", "").strip(),
-                    "quantity": result.get("quantity", "").strip(),
-                    "description": result.get("description", "").strip(),
-                    "ean": "",
-                    "source": "Web-Suche",
-                    "search_url": result.get("search_url", "")
-                }
-    except Exception:
-        pass
+WEB_SEARCH_MODEL = "groq/compound"
+
+
+def web_search_product(query, timeout=15, cancel=None):
+    return ENRICH_CACHE.lookup("web_search", normalize_query(query),
+                               lambda: _fetch_web_search(query, timeout, cancel), ENRICH_TTL_TEXT)
+
+
+def _fetch_web_search(query, timeout=15, cancel=None):
+    search_prompt = (
+        f"Suche im Internet nach dem Produkt: '{query}'.\n"
+        f"Finde folgende zollrelevante Informationen:\n"
+        f"- Exakter Produktname und Marke\n"
+        f"- Zusammensetzung / Zutaten / Material (mit Prozentangaben wenn verfügbar)\n"
+        f"- Menge/Gewicht\n"
+        f"- Produktkategorie\n"
+        f"- Verwendungszweck\n\n"
+        f"Antworte NUR als JSON:\n"
+        f'{{"name": "...", "brand": "...", "ingredients": "...", "categories": "...", '
+        f'"quantity": "...", "description": "...", "search_url": "..."}}'
+    )
+    payload = json.dumps({
+        "model": WEB_SEARCH_MODEL,
+        "messages": [
+            {"role": "system", "content": "Du bist ein Produktrecherche-Assistent. Suche im Web nach dem angegebenen Produkt und extrahiere zollrelevante Daten. Antworte ausschliesslich als JSON."},
+            {"role": "user", "content": search_prompt}
+        ],
+        "max_tokens": 1000,
+        "temperature": 0.1
+    }).encode("utf-8")
+
+    data = http_request(GROQ_URL, data=payload, headers={
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json",
+        "User-Agent": "Tarifierungstool/4.0"
+    }, timeout=timeout, cancel=cancel).json()
+    GROQ_USAGE.record(WEB_SEARCH_MODEL, "web_search", data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
+    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
+    if json_match:
+        result = json.loads(json_match.group())
+    else:
+        result = json.loads(content)
+    name = result.get("name", "").strip()
+    ingredients = result.get("ingredients", "").strip()
+    if name or ingredients:
+        return {
+            "name": name or query,
+            "brand": result.get("brand", "").strip(),
+            "ingredients": ingredients,
+            "categories": result.get("categories", "").strip(),
+            "quantity": result.get("quantity", "").strip(),
+            "description": result.get("description", "").strip(),
+            "ean": "",
+            "source": "Web-Suche",
+            "search_url": result.get("search_url", "")
+        }
     return None
 
 
+# ── Anreicherung (OFF-Barcode, OFF-Textvarianten, Web-Suche parallel) ──
+def enrichment_sources(query):
+    """Quellen einer Anfrage als (Quelle, Argument), wichtigste zuerst (entscheidet bei gleicher Qualität).
+
+    Barcodes laufen zusätzlich durch die OFF-Textsuche: nicht jede EAN steht im OFF-Index.
+    """
+    clean = re.sub(r'\D', '', query)
+    sources = [("off_barcode", clean)] if len(clean) >= 8 else []
+    sources += [("off_search", variant) for variant in off_search_variants(query)[:ENRICH_TEXT_VARIANTS]]
+    if ENRICH_WEB_SEARCH and GROQ_API_KEY:
+        sources.append(("web_search", query))
+    return sources
+
+
+def enrichment_quality(product):
+    """Rang eines Treffers: 3 = mit Zutaten/Material, 2 = mit Kategorien, 1 = nur Name, 0 = nichts."""
+    if not product:
+        return 0
+    if product.get("ingredients"):
+        return 3
+    if product.get("categories"):
+        return 2
+    return 1 if product.get("name") else 0
+
+
+ENRICH_GOOD_QUALITY = 3   # ab hier gewinnt der erste Treffer, die übrigen Quellen werden abgebrochen
+
+
+def enrichment_budget(source, deadline=None):
+    """Zeitbudget einer Quelle: ENRICH_WEB_BUDGET für die Web-Suche, sonst ENRICH_BUDGET, gekappt
+    auf den Rest der Request-Deadline. TimeoutError, wenn davon nichts mehr übrig ist."""
+    cap = ENRICH_WEB_BUDGET if source == "web_search" else ENRICH_BUDGET
+    return deadline.timeout(cap) if deadline else cap
+
+
+def enrichment_data_source(product_info):
+    """data_source für Prompt und Ergebnis: "web", "off" oder "none"."""
+    if not product_info:
+        return "none"
+    return "web" if product_info.get("source") == "Web-Suche" else "off"
+
+
+class EnrichmentFanout:
+    """Produktdaten aus allen Quellen gleichzeitig, jede unter ihrem Zeitbudget (enrichment_budget).
+
+    Alle Quellen aus enrichment_sources() starten sofort. Der erste Treffer mit
+    ENRICH_GOOD_QUALITY (Zutaten vorhanden) gewinnt; sonst nach Ablauf des längsten Budgets oder
+    wenn alle fertig sind der beste nach (Qualität, Rang der Quelle). Offene Aufrufe
+    werden abgebrochen (Socket zu, nichts gecacht). Die Latenz ist damit die der
+    schnellsten guten Quelle statt der Summe aller Versuche.
+    """
+
+    def __init__(self, workers):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich")
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.found = 0
+        self.early = 0              # guter Treffer, während andere Quellen noch liefen
+        self.budget_exhausted = 0
+        self.cancelled = 0
+        self.seconds = 0.0
+        self.winners = Counter()    # Quelle → Anzahl gewonnener Anreicherungen
+
+    @staticmethod
+    def _fetch(source, arg, timeout, cancel):
+        if source == "off_barcode":
+            return off_by_barcode(arg, timeout=min(timeout, 2), cancel=cancel)
+        if source == "off_search":
+            return _off_search(arg, timeout=timeout, cancel=cancel)
+        return web_search_product(arg, timeout=timeout, cancel=cancel)
+
+    def enrich(self, query, deadline=None):
+        """Bestes Produkt (dict) oder None; höchstens das längste Quellenbudget der Request-Deadline."""
+        try:
+            sources = [(source, arg, enrichment_budget(source, deadline)) for source, arg in enrichment_sources(query)]
+        except TimeoutError:
+            return None
+        t0 = time.monotonic()
+        end = t0 + max(budget for _, _, budget in sources)
+        running = {}
+        for rank, (source, arg, budget) in enumerate(sources):
+            cancel = Cancellation()
+            # Kontext kopieren: Upstream-Metriken und Web-Suche-Verbrauch gehören zur Anfrage
+            future = self._pool.submit(contextvars.copy_context().run, self._fetch, source, arg, budget, cancel)
+            running[future] = (rank, source, cancel)
+        best = None   # (Qualität, -Rang, Quelle, Produkt)
+        try:
+            while running and not (best and best[0] >= ENRICH_GOOD_QUALITY):
+                done, _ = wait(running, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    rank, source, _ = running.pop(future)
+                    try:
+                        product = future.result()
+                    except Exception:
+                        continue
+                    quality = enrichment_quality(product)
+                    if quality and (best is None or (quality, -rank) > best[:2]):
+                        best = (quality, -rank, source, product)
+        finally:
+            for _, _, cancel in running.values():
+                cancel.cancel()
+        self.record(best[2] if best else None, bool(running) and best is not None and best[0] >= ENRICH_GOOD_QUALITY,
+                    len(running), time.monotonic() - t0, time.monotonic() >= end)
+        return best[3] if best else None
+
+    def record(self, winner, early, cancelled, seconds, exhausted):
+        """Bucht eine Anreicherung (auch für asgi.py)."""
+        with self._lock:
+            self.requests += 1
+            self.found += 1 if winner else 0
+            self.early += 1 if early else 0
+            self.budget_exhausted += 1 if exhausted else 0
+            self.cancelled += cancelled
+            self.seconds += seconds
+            if winner:
+                self.winners[winner] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_s": ENRICH_BUDGET,
+                "web_budget_s": ENRICH_WEB_BUDGET,
+                "text_variants": ENRICH_TEXT_VARIANTS,
+                "web_search": ENRICH_WEB_SEARCH,
+                "requests": self.requests,
+                "found_rate": round(self.found / self.requests, 3) if self.requests else 0.0,
+                "early": self.early,
+                "budget_exhausted": self.budget_exhausted,
+                "cancelled": self.cancelled,
+                "winners": dict(self.winners),
+                "avg_ms": round(self.seconds / self.requests * 1000, 1) if self.requests else 0.0,
+            }
+
+
+ENRICH_FANOUT = EnrichmentFanout(ENRICH_WORKERS)
+
+
+def enrich_product(query, deadline=None):
+    return ENRICH_FANOUT.enrich(query, deadline)
+
+
 # ── BAZG document reading ──
 def read_cache_file(filename):
     path = os.path.join(CACHE_DIR, filename)
@@ -327,40 +1920,14 @@ def read_cache_file(filename):
     return None
 
 
-def get_chapter_docs(chapter_nums):
-    """Load erl + anm for one or multiple chapters. Returns dict with labeled texts."""
-    if isinstance(chapter_nums, int):
-        chapter_nums = [chapter_nums]
-    result = {}
-    for ch_num in chapter_nums:
-        ch = str(ch_num).zfill(2)
-        erl = read_cache_file(f"erl_{ch}.txt")
-        anm = read_cache_file(f"anm_{ch}.txt")
-        if erl:
-            result[f"erl_{ch}"] = erl
-        if anm:
-            result[f"anm_{ch}"] = anm
-    return result
-
+# Positions-Überschrift in den Erläuterungen: "2202.   Wasser, ..." (Spalte 0)
+POSITION_HEADING_RE = re.compile(r'^(\d{4})\.(?=\s|$)', re.MULTILINE)
+# Beginn der nächsten 4-stelligen Position (auch eingerückt, wie bisher)
+NEXT_POSITION_RE = re.compile(r'^\s{0,8}\d{4}[\.\s]', re.MULTILINE)
 
-def extract_position_section(full_text, target_position, intro_chars=1500, max_section=7000):
-    """
-    Extrahiert aus dem vollen Erläuterungs-Text nur:
-    1. Die Kapiteleinleitung (intro_chars Zeichen)
-    2. Den Abschnitt zur target_position (z.B. '2202' oder '2009')
-       → von 'XXXX.' bis zur nächsten '####.' Überschrift
-    3. Tabellen (Mindestgehalt) werden nicht abgeschnitten
-
-    Das reduziert 50k-Zeichen-Kapitel auf ~8-10k relevante Zeichen.
-    """
-    # Kapiteleinleitung
-    intro = full_text[:intro_chars]
-
-    if not target_position:
-        return intro
-
-    pos_str = str(target_position)
 
+def _find_position_span(full_text, pos_str):
+    """Liefert (start, end) des Abschnitts zu pos_str oder None, wenn nicht gefunden."""
     # Suche die Startposition des Abschnitts (z.B. "2202.")
     start_patterns = [
         rf'^\s{{0,8}}{re.escape(pos_str)}\.',
@@ -375,33 +1942,31 @@ def extract_position_section(full_text, target_position, intro_chars=1500, max_s
             break
 
     if start < 0:
-        # Position nicht gefunden – gib Einleitung + erste 5k zurück
-        return intro + '\n' + full_text[intro_chars:intro_chars + 5000]
+        return None
 
     # Suche das Ende des Abschnitts (nächste 4-stellige Position)
-    next_pos_pattern = re.compile(
-        rf'^\s{{0,8}}\d{{4}}[\.\s]',
-        re.MULTILINE
-    )
     end = len(full_text)
-    for m in next_pos_pattern.finditer(full_text, start + 10):
+    for m in NEXT_POSITION_RE.finditer(full_text, start + 10):
         candidate = full_text[m.start():m.start() + 6].strip()
         # Nur wenn es eine ANDERE Position ist (nicht Unterposition)
         if candidate[:4] != pos_str:
             end = m.start()
             break
 
-    section = full_text[start:end]
+    return start, end
+
+
+def _format_position_excerpt(full_text, start, section, intro_chars, max_section):
+    """Setzt Kapiteleinleitung + Positionsabschnitt wie extract_position_section zusammen."""
+    intro = full_text[:intro_chars]
+
+    if start is None:
+        # Position nicht gefunden – gib Einleitung + erste 5k zurück
+        return intro + '\n' + full_text[intro_chars:intro_chars + 5000]
 
     # Sicherheits-Truncation bei sehr langen Abschnitten
     if len(section) > max_section:
-        # Behalte immer die Tabellen (Mindestgehalt etc.)
-        table_idx = section.lower().find('mindestgehalt')
-        if 0 < table_idx < max_section - 2000:
-            # Tabelle einschliessen, danach kürzen
-            section = section[:max_section]
-        else:
-            section = section[:max_section]
+        section = section[:max_section]
 
     # Duplikate im Intro vermeiden
     if start < intro_chars:
@@ -410,6 +1975,618 @@ def extract_position_section(full_text, target_position, intro_chars=1500, max_s
     return intro + '\n\n' + section
 
 
+def extract_position_section(full_text, target_position, intro_chars=1500, max_section=7000):
+    """
+    Extrahiert aus dem vollen Erläuterungs-Text nur:
+    1. Die Kapiteleinleitung (intro_chars Zeichen)
+    2. Den Abschnitt zur target_position (z.B. '2202' oder '2009')
+       → von 'XXXX.' bis zur nächsten '####.' Überschrift
+    3. Tabellen (Mindestgehalt) werden nicht abgeschnitten
+
+    Das reduziert 50k-Zeichen-Kapitel auf ~8-10k relevante Zeichen.
+    Für Kapitel im CORPUS besser ChapterDocs.position_excerpt() verwenden (ohne Regex-Suche).
+    """
+    if not target_position:
+        return full_text[:intro_chars]
+
+    span = _find_position_span(full_text, str(target_position))
+    if span is None:
+        return _format_position_excerpt(full_text, None, "", intro_chars, max_section)
+    start, end = span
+    return _format_position_excerpt(full_text, start, full_text[start:end], intro_chars, max_section)
+
+
+def chapter_version(erl, anm):
+    """Version eines Kapitels: Hash über Erläuterungen und Anmerkungen (UTF-8)."""
+    return hashlib.sha256(erl + b"\0" + anm).hexdigest()[:12]
+
+
+class ChapterDocs:
+    """Vorverarbeitete BAZG-Texte eines Kapitels: Einleitung, Anmerkungen, Positionsabschnitte."""
+    __slots__ = ("chapter", "erl", "anm", "intro", "positions", "offsets", "version")
+
+    def __init__(self, chapter, erl, anm):
+        self.chapter = chapter
+        self.erl = erl or ""
+        self.anm = anm or ""
+        self.version = chapter_version(self.erl.encode("utf-8"), self.anm.encode("utf-8"))
+        self.positions = {}   # "2202" → Abschnittstext
+        self.offsets = {}     # "2202" → Startoffset im Erläuterungstext
+        headings = [m.start() for m in POSITION_HEADING_RE.finditer(self.erl)]
+        # Einleitung = alles vor der ersten eigentlichen Positionsüberschrift
+        self.intro = self.erl[:headings[0]] if headings else self.erl
+        # Alle Kandidaten, die extract_position_section als Start finden würde
+        codes = {m.group().strip()[:4] for m in NEXT_POSITION_RE.finditer(self.erl)}
+        for code in sorted(codes):
+            span = _find_position_span(self.erl, code)
+            if span:
+                self.offsets[code] = span[0]
+                self.positions[code] = self.erl[span[0]:span[1]]
+
+    def headings(self):
+        """Die eigentlichen 4-stelligen Positionen des Kapitels (ohne Textverweise)."""
+        return [m.group(1) for m in POSITION_HEADING_RE.finditer(self.erl)]
+
+    has_erl = property(lambda self: bool(self.erl))
+    has_anm = property(lambda self: bool(self.anm))
+
+    def position_excerpt(self, position, intro_chars=1500, max_section=7000):
+        """Wie extract_position_section, aber als reiner Dictionary-Lookup."""
+        if not position:
+            return self.erl[:intro_chars]
+        pos_str = str(position)
+        return _format_position_excerpt(self.erl, self.offsets.get(pos_str),
+                                        self.positions.get(pos_str, ""),
+                                        intro_chars, max_section)
+
+    def memory_bytes(self):
+        size = sys.getsizeof(self.erl) + sys.getsizeof(self.anm) + sys.getsizeof(self.intro)
+        size += sys.getsizeof(self.positions) + sys.getsizeof(self.offsets)
+        for code, section in self.positions.items():
+            size += sys.getsizeof(code) + sys.getsizeof(section) + sys.getsizeof(self.offsets[code])
+        return size
+
+
+class MappedSections(Mapping):
+    """Positionsabschnitte als Bereiche im gemappten Korpus; dekodiert erst beim Zugriff."""
+    __slots__ = ("_mm", "_spans")
+
+    def __init__(self, mm, spans):
+        self._mm = mm
+        self._spans = spans   # "2202" → (Byte-Offset, Byte-Länge)
+
+    def __getitem__(self, code):
+        start, length = self._spans[code]
+        return self._mm[start:start + length].decode("utf-8")
+
+    def __iter__(self):
+        return iter(self._spans)
+
+    def __len__(self):
+        return len(self._spans)
+
+
+class MappedChapterDocs(ChapterDocs):
+    """ChapterDocs über dem gemappten Korpus (bazg_corpus.bin).
+
+    Texte werden nicht im Prozess gehalten, sondern bei jedem Zugriff aus dem mmap
+    geschnitten; die Seiten teilen sich alle Worker über den Page-Cache des OS.
+    Einleitung und Positionsabschnitte sind Bereiche innerhalb des Erläuterungstexts.
+    has_erl/has_anm und position_excerpt() dekodieren nie das ganze Kapitel.
+    """
+    __slots__ = ("_mm", "_erl", "_anm", "_intro", "_headings")
+
+    def __init__(self, chapter, mm, erl, anm, intro, positions, offsets, headings):
+        self.chapter = chapter
+        self._mm = mm
+        self._erl, self._anm, self._intro = erl, anm, intro   # (Byte-Offset, Byte-Länge)
+        self.version = chapter_version(mm[erl[0]:erl[0] + erl[1]], mm[anm[0]:anm[0] + anm[1]])
+        self.positions = MappedSections(mm, positions)
+        self.offsets = offsets
+        self._headings = headings
+
+    def _text(self, span):
+        start, length = span
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _erl_prefix(self, chars):
+        """Die ersten chars Zeichen des Erläuterungstexts (höchstens 4 Bytes je Zeichen dekodiert)."""
+        start, length = self._erl
+        if chars * 4 >= length:
+            return self._text(self._erl)[:chars]
+        # ein am Ende angeschnittenes Zeichen bleibt im Decoder-Puffer
+        return codecs.getincrementaldecoder("utf-8")().decode(self._mm[start:start + chars * 4])[:chars]
+
+    erl = property(lambda self: self._text(self._erl))
+    anm = property(lambda self: self._text(self._anm))
+    intro = property(lambda self: self._text(self._intro))
+    has_erl = property(lambda self: self._erl[1] > 0)
+    has_anm = property(lambda self: self._anm[1] > 0)
+
+    def headings(self):
+        return list(self._headings)
+
+    def position_excerpt(self, position, intro_chars=1500, max_section=7000):
+        if not position:
+            return self._erl_prefix(intro_chars)
+        pos_str = str(position)
+        start = self.offsets.get(pos_str)
+        section = self.positions.get(pos_str, "") if start is not None else ""
+        # _format_position_excerpt liest den Erläuterungstext nur bis hier
+        needed = intro_chars + (5000 if start is None else min(start, intro_chars) + min(len(section), max_section))
+        return _format_position_excerpt(self._erl_prefix(needed), start, section, intro_chars, max_section)
+
+    def memory_bytes(self):
+        # nur die Python-Objekte; die Texte liegen im gemappten File
+        size = sys.getsizeof(self.offsets) + sys.getsizeof(self.positions._spans) + sys.getsizeof(self._headings)
+        for code, span in self.positions._spans.items():
+            size += sys.getsizeof(code) + sys.getsizeof(span) + sys.getsizeof(self.offsets.get(code))
+        return size
+
+
+# Binärformat bazg_corpus.bin (little-endian):
+#   Header:  Magic, Formatversion, Korpus-Version, Dateien, Kapitel, Einträge, neueste mtime der Quellen
+#   Tabelle: je Eintrag Kapitel, Art, Positionscode, Byte-Offset, Byte-Länge, Zeichen-Offset im erl-Text
+#   Daten:   erl- und anm-Texte als UTF-8 (Einleitung und Positionen zeigen in den erl-Text)
+CORPUS_BIN_MAGIC = b"BAZGCORP"
+CORPUS_BIN_FORMAT = 1
+CORPUS_BIN_HEADER = struct.Struct("<8sH16sIIId")
+CORPUS_BIN_ENTRY = struct.Struct("<HB4sIII")
+CORPUS_KIND_ERL, CORPUS_KIND_ANM, CORPUS_KIND_INTRO, CORPUS_KIND_POSITION, CORPUS_KIND_HEADING = range(5)
+CORPUS_SOURCE_RE = re.compile(r'^(erl|anm)_(\d{2})\.txt$')
+
+
+def corpus_source_mtime(cache_dir):
+    """(Anzahl, neueste mtime) der erl/anm-Dateien – Prüfung, ob bazg_corpus.bin noch aktuell ist."""
+    if not os.path.isdir(cache_dir):
+        return 0, 0.0
+    files, newest = 0, 0.0
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if CORPUS_SOURCE_RE.match(entry.name):
+                files += 1
+                newest = max(newest, entry.stat().st_mtime)
+    return files, newest
+
+
+def corpus_source_stamps(cache_dir):
+    """{Dateiname: (mtime_ns, Grösse)} der erl/anm-Dateien – erkennt Änderungen für reload()."""
+    if not os.path.isdir(cache_dir):
+        return {}
+    with os.scandir(cache_dir) as entries:
+        return {entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in entries if CORPUS_SOURCE_RE.match(entry.name)}
+
+
+def _corpus_version(chapters):
+    """Korpus-Version: Hash über die Kapitel-Versionen."""
+    digest = hashlib.sha256()
+    for ch in sorted(chapters):
+        digest.update(f"{ch}:{chapters[ch].version}\0".encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+class CorpusIndex:
+    """In-Memory-Index über alle erl_XX/anm_XX-Dateien – beim Start aufgebaut.
+
+    Liegt ein aktueller bazg_corpus.bin vor (build_corpus.py), wird stattdessen dieser
+    per mmap geöffnet (open()); die Kapitel sind dann MappedChapterDocs. Jedes Kapitel
+    trägt eine eigene Version; reload() liest nur geänderte Dateien neu ein.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.chapters = {}
+        self.files = 0
+        self.build_seconds = 0.0
+        self.version = ""   # Hash über die Kapitel-Versionen
+        self.source = "files"
+        self.mapped_bytes = 0
+        self.stamps = {}    # Dateiname → (mtime_ns, Grösse) beim Einlesen
+
+    @classmethod
+    def build(cls, cache_dir):
+        index = cls(cache_dir)
+        t0 = time.perf_counter()
+        index.stamps = corpus_source_stamps(cache_dir)
+        texts = {}
+        for filename in sorted(index.stamps):
+            kind, ch = CORPUS_SOURCE_RE.match(filename).groups()
+            texts.setdefault(int(ch), {})[kind] = _read_corpus_file(cache_dir, filename)
+            index.files += 1
+        for ch, parts in texts.items():
+            index.chapters[ch] = ChapterDocs(ch, parts.get("erl"), parts.get("anm"))
+        index.version = _corpus_version(index.chapters)
+        index.build_seconds = time.perf_counter() - t0
+        return index
+
+    def reload(self):
+        """Neuer Index, in dem nur Kapitel mit geänderten, neuen oder gelöschten erl/anm-Dateien
+        neu eingelesen sind; die übrigen ChapterDocs werden übernommen (auch gemappte).
+        Gibt (Index, [Kapitel mit neuer Version]) zurück – ohne Änderung (self, [])."""
+        t0 = time.perf_counter()
+        stamps = corpus_source_stamps(self.cache_dir)
+        touched = {int(CORPUS_SOURCE_RE.match(name).group(2))
+                   for name in set(stamps) | set(self.stamps) if stamps.get(name) != self.stamps.get(name)}
+        if not touched:
+            return self, []
+        index = CorpusIndex(self.cache_dir)
+        index.chapters = {ch: docs for ch, docs in self.chapters.items() if ch not in touched}
+        for ch in touched:
+            erl_name, anm_name = f"erl_{ch:02d}.txt", f"anm_{ch:02d}.txt"
+            if erl_name in stamps or anm_name in stamps:
+                index.chapters[ch] = ChapterDocs(ch, _read_corpus_file(self.cache_dir, erl_name),
+                                                 _read_corpus_file(self.cache_dir, anm_name))
+        index.stamps = stamps
+        index.files = len(stamps)
+        index.version = _corpus_version(index.chapters)
+        index.source = self.source if any(isinstance(d, MappedChapterDocs) for d in index.chapters.values()) \
+            else "files"
+        index.mapped_bytes = self.mapped_bytes if index.source == "mmap" else 0
+        index.build_seconds = time.perf_counter() - t0
+        changed = sorted(ch for ch in touched
+                         if getattr(self.chapters.get(ch), "version", None)
+                         != getattr(index.chapters.get(ch), "version", None))
+        return index, changed
+
+    @classmethod
+    def load(cls, path, cache_dir):
+        """Öffnet bazg_corpus.bin per mmap; ValueError bei fremdem Format oder veralteter Datei."""
+        t0 = time.perf_counter()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, _, files, chapters, entries, source_mtime = CORPUS_BIN_HEADER.unpack_from(mm, 0)
+        if magic != CORPUS_BIN_MAGIC or fmt != CORPUS_BIN_FORMAT:
+            mm.close()
+            raise ValueError(f"{path}: kein Korpus im Format {CORPUS_BIN_FORMAT}")
+        current_files, current_mtime = corpus_source_mtime(cache_dir)
+        if current_files and (current_files != files or current_mtime > source_mtime):
+            mm.close()
+            raise ValueError(f"{path}: älter als {cache_dir} – build_corpus.py erneut ausführen")
+
+        index = cls(cache_dir)
+        parts = {}
+        table = mm[CORPUS_BIN_HEADER.size:CORPUS_BIN_HEADER.size + entries * CORPUS_BIN_ENTRY.size]
+        for ch, kind, code, start, length, char_offset in CORPUS_BIN_ENTRY.iter_unpack(table):
+            chapter = parts.setdefault(ch, {"erl": (0, 0), "anm": (0, 0), "intro": (0, 0),
+                                            "positions": {}, "offsets": {}, "headings": []})
+            span = (start, length)
+            if kind == CORPUS_KIND_ERL:
+                chapter["erl"] = span
+            elif kind == CORPUS_KIND_ANM:
+                chapter["anm"] = span
+            elif kind == CORPUS_KIND_INTRO:
+                chapter["intro"] = span
+            elif kind == CORPUS_KIND_POSITION:
+                code = code.decode("ascii")
+                chapter["positions"][code] = span
+                chapter["offsets"][code] = char_offset
+            elif kind == CORPUS_KIND_HEADING:
+                chapter["headings"].append(code.decode("ascii"))
+        for ch, p in parts.items():
+            index.chapters[ch] = MappedChapterDocs(ch, mm, p["erl"], p["anm"], p["intro"],
+                                                   p["positions"], p["offsets"], p["headings"])
+        index.version = _corpus_version(index.chapters)
+        index.stamps = corpus_source_stamps(cache_dir)
+        index.files = files
+        index.source = "mmap"
+        index.mapped_bytes = len(mm)
+        index.build_seconds = time.perf_counter() - t0
+        return index
+
+    @classmethod
+    def open(cls, cache_dir, bin_path):
+        """bazg_corpus.bin, falls vorhanden und aktuell – sonst Aufbau aus den Einzeldateien."""
+        if bin_path and os.path.exists(bin_path):
+            try:
+                return cls.load(bin_path, cache_dir)
+            except (ValueError, struct.error, OSError):
+                pass
+        return cls.build(cache_dir)
+
+    def write(self, path, source_mtime):
+        """Schreibt den Index als bazg_corpus.bin (temporär, dann atomar ersetzt)."""
+        blobs = bytearray()
+        table = []   # Byte-Offsets zunächst relativ zum Datenbereich
+        for ch in sorted(self.chapters):
+            docs = self.chapters[ch]
+            erl = docs.erl.encode("utf-8")
+            erl_start = len(blobs)
+            blobs.extend(erl)
+            anm = docs.anm.encode("utf-8")
+            table.append((ch, CORPUS_KIND_ERL, b"", erl_start, len(erl), 0))
+            table.append((ch, CORPUS_KIND_ANM, b"", len(blobs), len(anm), 0))
+            blobs.extend(anm)
+            table.append((ch, CORPUS_KIND_INTRO, b"", erl_start, len(docs.intro.encode("utf-8")), 0))
+            for code, section in docs.positions.items():
+                offset = docs.offsets[code]
+                table.append((ch, CORPUS_KIND_POSITION, code.encode("ascii"),
+                              erl_start + len(docs.erl[:offset].encode("utf-8")),
+                              len(section.encode("utf-8")), offset))
+            for code in docs.headings():
+                table.append((ch, CORPUS_KIND_HEADING, code.encode("ascii"), 0, 0, 0))
+
+        base = CORPUS_BIN_HEADER.size + CORPUS_BIN_ENTRY.size * len(table)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CORPUS_BIN_HEADER.pack(CORPUS_BIN_MAGIC, CORPUS_BIN_FORMAT, self.version.encode("ascii"),
+                                           self.files, len(self.chapters), len(table), source_mtime))
+            for ch, kind, code, start, length, char_offset in table:
+                f.write(CORPUS_BIN_ENTRY.pack(ch, kind, code, base + start, length, char_offset))
+            f.write(blobs)
+        os.replace(tmp_path, path)
+
+    def get(self, chapter):
+        try:
+            return self.chapters.get(int(chapter))
+        except (TypeError, ValueError):
+            return None
+
+    def versions(self, chapters):
+        """{"22": Version} für result["corpus_versions"]; fehlende Kapitel mit "" (zählt als Version)."""
+        return {str(ch): getattr(self.get(ch), "version", "") for ch in chapters}
+
+    def memory_bytes(self):
+        return sys.getsizeof(self.chapters) + sum(d.memory_bytes() for d in self.chapters.values())
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "source": self.source,
+            "files": self.files,
+            "chapters": len(self.chapters),
+            "positions": sum(len(d.positions) for d in self.chapters.values()),
+            "build_ms": round(self.build_seconds * 1000, 1),
+            "memory_bytes": self.memory_bytes(),
+            "mapped_bytes": self.mapped_bytes,
+        }
+
+
+def _read_corpus_file(cache_dir, filename):
+    path = os.path.join(cache_dir, filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+CORPUS = CorpusIndex.open(CACHE_DIR, CORPUS_BIN_PATH)
+
+
+def get_chapter_docs(chapter_nums):
+    """Liefert die ChapterDocs für ein oder mehrere Kapitel aus dem CORPUS (kein Disk-I/O).
+    Alle aus demselben Stand, auch wenn währenddessen ein Reload den CORPUS tauscht."""
+    if isinstance(chapter_nums, int):
+        chapter_nums = [chapter_nums]
+    corpus = CORPUS
+    result = {}
+    for ch_num in chapter_nums:
+        chapter_docs = corpus.get(ch_num)
+        if chapter_docs:
+            result[ch_num] = chapter_docs
+    return result
+
+
+# ── Positions-Retrieval (BM25 über die Erläuterungen je Position) ──
+RETRIEVAL_FOLD = (("ä", "a"), ("ö", "o"), ("ü", "u"), ("ß", "ss"), ("é", "e"), ("è", "e"), ("à", "a"))
+RETRIEVAL_WORD_RE = re.compile(r"[a-z]{3,}")
+RETRIEVAL_STOPWORDS = frozenset("""
+    und oder der die das des dem den ein eine einer eines einem einen mit ohne von vom zu zur zum
+    fur auf aus bei nach nicht auch als wie werden wird sind ist hierher gehoren gehort diese dieser
+    dieses jedoch sowie usw bzw sie sich noch nur unter uber durch andere anderen anderer
+""".split())
+RETRIEVAL_SUFFIXES = ("ungen", "ung", "en", "er", "es", "e", "n", "s")
+
+
+def _retrieval_word_terms(word):
+    stem = word
+    for suffix in RETRIEVAL_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            stem = word[:-len(suffix)]
+            break
+    if len(word) < 7:
+        return (stem,)
+    return (stem,) + tuple("#" + word[i:i + 4] for i in range(len(word) - 3))
+
+
+_RETRIEVAL_WORD_CACHE = {}
+
+
+def retrieval_terms(text):
+    """Suchterme: Kleinschreibung, Umlaute gefaltet, einfaches Stemming; lange Wörter
+    zusätzlich als 4-Gramme, damit Komposita (Apfelsaft ↔ Fruchtsaft) sich treffen."""
+    text = text.lower()
+    for char, folded in RETRIEVAL_FOLD:   # str.replace ist hier deutlich schneller als translate
+        text = text.replace(char, folded)
+    terms = []
+    cache = _RETRIEVAL_WORD_CACHE
+    for word in RETRIEVAL_WORD_RE.findall(text):
+        word_terms = cache.get(word)
+        if word_terms is None:
+            word_terms = () if word in RETRIEVAL_STOPWORDS else _retrieval_word_terms(word)
+            if len(cache) < 200000:
+                cache[word] = word_terms
+        terms.extend(word_terms)
+    return terms
+
+
+class PositionIndex:
+    """BM25-Index über die Positionsabschnitte aller erl_XX-Dateien.
+
+    Ein Dokument = ein Positionsabschnitt (z.B. 0406 "Käse und Quark"); die
+    Überschrift zählt HEADING_BOOST-fach. Die Termgewichte werden beim Aufbau
+    vorberechnet, eine Abfrage summiert nur noch idf × Gewicht über die Postings.
+    """
+    K1 = 1.2
+    B = 0.75
+    HEADING_BOOST = 3
+
+    def __init__(self):
+        self.docs = []        # Dokument-Nr. → (Kapitel, Position)
+        self.headings = []    # Dokument-Nr. → Überschriftszeile
+        self.postings = {}    # Term → [(Dokument-Nr., BM25-Gewicht)]
+        self.idf = {}
+        self.build_seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, corpus):
+        index = cls()
+        t0 = time.perf_counter()
+        counts = []
+        for ch in sorted(corpus.chapters):
+            chapter_docs = corpus.chapters[ch]
+            for code in chapter_docs.headings():
+                section = chapter_docs.positions.get(code)
+                if not section:
+                    continue
+                heading = section.strip().split("\n\n")[0]
+                tf = Counter(retrieval_terms(section) + retrieval_terms(heading) * cls.HEADING_BOOST)
+                index.docs.append((ch, code))
+                index.headings.append(" ".join(heading.split()))
+                counts.append(tf)
+
+        lengths = [sum(tf.values()) for tf in counts]
+        avg_length = sum(lengths) / len(lengths) if lengths else 1.0
+        for doc, tf in enumerate(counts):
+            norm = cls.K1 * (1 - cls.B + cls.B * lengths[doc] / avg_length)
+            for term, f in tf.items():
+                index.postings.setdefault(term, []).append((doc, f * (cls.K1 + 1) / (f + norm)))
+        n = len(index.docs)
+        for term, plist in index.postings.items():
+            index.idf[term] = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        index.build_seconds = time.perf_counter() - t0
+        return index
+
+    def rank(self, text, chapters, k=3):
+        """Beste k Positionen je Kapitel: {Kapitel: [(Position, Score), ...]} (absteigend)."""
+        t0 = time.perf_counter()
+        wanted = set(chapters)
+        scores = {}
+        for term in set(retrieval_terms(text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, weight in self.postings[term]:
+                if self.docs[doc][0] in wanted:
+                    scores[doc] = scores.get(doc, 0.0) + idf * weight
+        ranked = {ch: [] for ch in chapters}
+        for doc, score in sorted(scores.items(), key=lambda item: -item[1]):
+            ch, code = self.docs[doc]
+            if len(ranked[ch]) < k:
+                ranked[ch].append((code, score))
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - t0
+        return ranked
+
+    def overview(self, chapter):
+        """Überschriften aller Positionen eines Kapitels (Fallback ohne Treffer)."""
+        return [h for (ch, _), h in zip(self.docs, self.headings) if ch == chapter]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self.docs),
+                "terms": len(self.postings),
+                "build_ms": round(self.build_seconds * 1000, 1),
+                "queries": self.queries,
+                "avg_query_us": round(self.query_seconds / self.queries * 1e6, 1) if self.queries else 0.0,
+            }
+
+
+POSITION_INDEX = PositionIndex.build(CORPUS)
+
+
+class CorpusReloader:
+    """Übernimmt geänderte erl/anm-Dateien aus bazg_cache im laufenden Betrieb.
+
+    reload() liest nur die betroffenen Kapitel neu (CorpusIndex.reload) und baut danach den
+    BM25-Index komplett neu – dessen Gewichte hängen an der mittleren Dokumentlänge und der
+    idf über alle Kapitel. Beides geschieht neben den laufenden Anfragen; getauscht werden
+    nur die Referenzen (erst POSITION_INDEX, dann CORPUS), eine Anfrage arbeitet mit dem
+    Stand, den sie gelesen hat. Ein Hintergrund-Thread pro Prozess prüft alle interval
+    Sekunden die Dateien (mtime, Grösse); gestartet beim ersten Cache-Lookup, wie der
+    Schreib-Thread des RESULT_STORE.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()      # ein Reload zur Zeit (Watcher und /admin/corpus/reload)
+        self._stats_lock = threading.Lock()
+        self._watcher_pid = None
+        self.checks = 0
+        self.reloads = 0
+        self.errors = 0
+        self.stale_hits = 0
+        self.last = None
+
+    def reload(self):
+        """Geänderte Kapitel übernehmen; gibt die Kapitel mit neuer Version zurück ([] = unverändert)."""
+        global CORPUS, POSITION_INDEX
+        with self._lock:
+            t0 = time.perf_counter()
+            corpus, changed = CORPUS.reload()
+            with self._stats_lock:
+                self.checks += 1
+            if corpus is CORPUS:
+                return []
+            position_index = PositionIndex.build(corpus) if changed else POSITION_INDEX
+            POSITION_INDEX = position_index
+            CORPUS = corpus
+            with self._stats_lock:
+                self.reloads += 1
+                self.last = {"at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "chapters": changed,
+                             "ms": round((time.perf_counter() - t0) * 1000, 1)}
+            return changed
+
+    def count_stale(self):
+        with self._stats_lock:
+            self.stale_hits += 1
+
+    def ensure_watcher(self):
+        if self.interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._stats_lock:
+            if self._watcher_pid != os.getpid():   # nach fork() läuft der Thread des Masters nicht mit
+                self._watcher_pid = os.getpid()
+                threading.Thread(target=self._watch_loop, name="corpus-watcher", daemon=True).start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reload()
+            except Exception:
+                with self._stats_lock:
+                    self.errors += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "watch_interval": self.interval,
+                "watching": self._watcher_pid == os.getpid(),
+                "checks": self.checks,
+                "reloads": self.reloads,
+                "errors": self.errors,
+                "stale_hits": self.stale_hits,
+                "last": self.last,
+            }
+
+
+CORPUS_RELOADER = CorpusReloader(CORPUS_WATCH_INTERVAL)
+
+
+def retrieval_query(product_query, product_info):
+    """Suchtext für das Positions-Retrieval: Anfrage + OFF-/Web-Produktdaten."""
+    parts = [product_query]
+    if product_info:
+        parts += [product_info.get(field) or "" for field in ("name", "categories", "ingredients", "description")]
+    return " ".join(parts)
+
+
 # ── Chapter detection ──
 CHAPTER_KEYWORDS = {
     1:  ['lebende tiere', 'schlachtvieh', 'rind', 'schwein', 'geflügel'],
@@ -521,6 +2698,81 @@ WHITE_CHOC_INDICATORS = {
 }
 
 
+class KeywordMatcher:
+    """Aho-Corasick-Automat: findet alle Schlüsselwörter in einem einzigen Durchlauf.
+
+    Jedes Schlüsselwort trägt Tags (Kapitelnummer oder Indikator-Name); scan() liefert
+    die gefundenen Wörter, die Kapitel-Scores und die gesetzten Indikatoren.
+    """
+
+    def __init__(self, tagged_keywords):
+        self.tags = {}        # Schlüsselwort → Liste der Tags (mit Vielfachheit)
+        for keyword, tag in tagged_keywords:
+            self.tags.setdefault(keyword, []).append(tag)
+
+        # Trie aufbauen
+        goto = [{}]
+        self.output = [()]    # Zustand → Schlüsselwörter, die hier enden
+        for keyword in self.tags:
+            state = 0
+            for char in keyword:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    self.output.append(())
+                state = nxt
+            self.output[state] += (keyword,)
+
+        # Fehlerfunktion per Breitensuche, direkt zur vollständigen Übergangstabelle
+        # aufgelöst: im Suchlauf ist damit jedes Zeichen genau ein Dictionary-Lookup.
+        fail = [0] * len(goto)
+        self.delta = [None] * len(goto)
+        self.delta[0] = dict(goto[0])
+        queue = list(goto[0].values())
+        for state in queue:
+            row = dict(self.delta[fail[state]])
+            row.update(goto[state])
+            self.delta[state] = row
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                fail[nxt] = self.delta[fail[state]].get(char, 0)
+                self.output[nxt] += self.output[fail[nxt]]
+
+    def find(self, text):
+        """Menge aller Schlüsselwörter, die als Teilstring in text vorkommen."""
+        delta, output = self.delta, self.output
+        found = set()
+        state = 0
+        for char in text:
+            state = delta[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def scan(self, text):
+        """Gibt (found, scores, flags) zurück: Kapitel-Scores und Indikator-Tags."""
+        found = self.find(text)
+        scores = {}
+        flags = set()
+        for keyword in found:
+            for tag in self.tags[keyword]:
+                if isinstance(tag, int):
+                    scores[tag] = scores.get(tag, 0) + 1
+                else:
+                    flags.add(tag)
+        return found, scores, flags
+
+
+KEYWORD_MATCHER = KeywordMatcher(
+    [(kw, ch) for ch, keywords in CHAPTER_KEYWORDS.items() for kw in keywords]
+    + [(kw, "juice") for kw in JUICE_INDICATORS]
+    + [(kw, "drink") for kw in DRINK_INDICATORS]
+    + [(kw, "white_choc") for kw in WHITE_CHOC_INDICATORS]
+)
+
+
 def detect_chapters(query, product_info):
     """
     Bestimmt das primäre Kapitel und ob ein zweites Kapitel geprüft werden muss.
@@ -534,25 +2786,21 @@ def detect_chapters(query, product_info):
             product_info.get('ingredients', '')
         ).lower()
 
+    # Ein Durchlauf über den Text liefert Kapitel-Scores und alle Indikatoren
+    _, scores, flags = KEYWORD_MATCHER.scan(text)
+
     # Spezialfall: Weisse Schokolade → IMMER Kap. 17 (keine Kakaomasse!)
     # Auch Verbundprodukte: Reiswaffel/Keks mit weisser Schokolade → Kap. 17
-    if any(kw in text for kw in WHITE_CHOC_INDICATORS):
+    if "white_choc" in flags:
         return 17, [19]  # Kap. 17 primär, Kap. 19 (Backwaren/Waffeln) als Vergleich
 
     # Spezialfall Getränke: Kap. 20 vs 22 unterscheiden
-    has_juice = any(kw in text for kw in JUICE_INDICATORS)
-    has_drink = any(kw in text for kw in DRINK_INDICATORS)
+    has_juice = "juice" in flags
+    has_drink = "drink" in flags
 
     # Flüssigkeitsmenge (z.B. "1L", "500ml") in der Anfrage → könnte Getränk sein
     has_liquid_volume = bool(LIQUID_VOLUME_RE.search(query))
 
-    # Score-basierte Kapitelbestimmung
-    scores = {}
-    for ch, keywords in CHAPTER_KEYWORDS.items():
-        score = sum(1 for kw in keywords if kw in text)
-        if score > 0:
-            scores[ch] = score
-
     primary = None
     extra = []
 
@@ -584,24 +2832,35 @@ def detect_chapters(query, product_info):
     return primary, extra
 
 
-def guess_chapter_llm(query, product_info):
-    """LLM-basierte Kapitelbestimmung als Fallback."""
+def _product_hint(product_info):
+    """Zutaten und Kategorien aus OFF für die kurzen Vorauswahl-Prompts."""
+    if not product_info:
+        return ""
+    return (
+        f"\nZutaten/Material: {product_info.get('ingredients', '')[:300]}"
+        f"\nKategorien: {product_info.get('categories', '')}"
+    )
+
+
+def _guess_chapter_messages(query, product_info):
+    ingredients_hint = _product_hint(product_info)
+    return [
+        {"role": "system", "content": (
+            "Bestimme das Kapitel (1-97) des Schweizer Zolltarifs für dieses Produkt. "
+            "WICHTIG: Reiner Fruchtsaft = Kapitel 20 (Nr. 2009). "
+            "Softdrinks/Limonaden/aromatisierte Getränke = Kapitel 22. "
+            "Antworte als JSON: {\"chapter\": 22, \"reason\": \"...\", \"also_check\": [20]}"
+        )},
+        {"role": "user", "content": f"Produkt: {query}{ingredients_hint}"}
+    ]
+
+
+def guess_chapter_llm(query, product_info, deadline=None):
+    """LLM-basierte Kapitelbestimmung als Fallback (höchstens GUESS_CHAPTER_TIMEOUT)."""
     try:
-        ingredients_hint = ""
-        if product_info:
-            ingredients_hint = (
-                f"\nZutaten/Material: {product_info.get('ingredients', '')[:300]}"
-                f"\nKategorien: {product_info.get('categories', '')}"
-            )
-        ch_result = call_groq([
-            {"role": "system", "content": (
-                "Bestimme das Kapitel (1-97) des Schweizer Zolltarifs für dieses Produkt. "
-                "WICHTIG: Reiner Fruchtsaft = Kapitel 20 (Nr. 2009). "
-                "Softdrinks/Limonaden/aromatisierte Getränke = Kapitel 22. "
-                "Antworte als JSON: {\"chapter\": 22, \"reason\": \"...\", \"also_check\": [20]}"
-            )},
-            {"role": "user", "content": f"Produkt: {query}{ingredients_hint}"}
-        ], max_tokens=300)
+        timeout = deadline.timeout(GUESS_CHAPTER_TIMEOUT) if deadline else GUESS_CHAPTER_TIMEOUT
+        ch_result = call_groq(_guess_chapter_messages(query, product_info), max_tokens=300,
+                              deadline=Deadline(timeout), purpose="guess_chapter")
         primary = ch_result.get("chapter", 22)
         extra = ch_result.get("also_check", [])
         return primary, extra
@@ -609,6 +2868,76 @@ def guess_chapter_llm(query, product_info):
         return 22, []
 
 
+def classification_model():
+    """Modell-Teil des Ergebnis-Schlüssels: zweistufige Ergebnisse getrennt von einstufigen."""
+    return f"{SHORTLIST_MODEL}+{GROQ_MODEL}" if CLASSIFY_MODE == "two_stage" else GROQ_MODEL
+
+
+def shortlist_chapters(query, product_info, primary, extra):
+    """Kapitel für die Titelliste: erkannte Kapitel, aufgefüllt mit den besten BM25-Kapiteln."""
+    chapters = [ch for ch in [primary, *extra] if ch is not None and CORPUS.get(ch)][:SHORTLIST_CHAPTERS]
+    if len(chapters) < SHORTLIST_CHAPTERS:
+        ranked = POSITION_INDEX.rank(retrieval_query(query, product_info), sorted(CORPUS.chapters), k=1)
+        best = sorted(((hits[0][1], ch) for ch, hits in ranked.items() if hits), reverse=True)
+        for _, ch in best:
+            if ch not in chapters:
+                chapters.append(ch)
+            if len(chapters) >= SHORTLIST_CHAPTERS:
+                break
+    return chapters
+
+
+def _shortlist_messages(query, product_info, chapters):
+    lines = []
+    for ch in chapters:
+        lines.append(f"Kapitel {ch}:")
+        lines += [heading[:SHORTLIST_HEADING_CHARS] for heading in POSITION_INDEX.overview(ch)]
+    return [
+        {"role": "system", "content": (
+            "Du reihst Produkte in den Schweizer Zolltarif ein. Wähle aus der Liste 1 bis "
+            f"{SHORTLIST_MAX_POSITIONS} in Frage kommende 4-stellige Positionen, die wahrscheinlichste zuerst. "
+            "Nur Positionen aus der Liste. Reiner Fruchtsaft = Nr. 2009, "
+            "Softdrinks/aromatisierte Getränke = Nr. 2202. "
+            "Antworte als JSON: {\"positions\": [\"2202\", \"2009\"], \"reason\": \"...\"}"
+        )},
+        {"role": "user", "content": (f"Produkt: {query}{_product_hint(product_info)}\n\n"
+                                     "Positionen:\n" + "\n".join(lines))},
+    ]
+
+
+def parse_shortlist(result, chapters):
+    """Antwort der Vorauswahl prüfen: nur Positionen aus der Liste, Kapitel = das der ersten.
+    Gibt (Kapitel, [Positionen]) oder None zurück."""
+    if not isinstance(result, dict) or not isinstance(result.get("positions"), list):
+        return None
+    wanted = set(chapters)
+    known = {code for ch, code in POSITION_INDEX.docs if ch in wanted}
+    positions = []
+    for code in result["positions"]:
+        code = re.sub(r"\D", "", str(code))[:4]
+        if code in known and code not in positions:
+            positions.append(code)
+    if not positions:
+        return None
+    positions = positions[:SHORTLIST_MAX_POSITIONS]
+    return int(positions[0][:2]), positions
+
+
+def shortlist_positions(query, product_info, primary, extra, deadline=None):
+    """Erste Stufe: SHORTLIST_MODEL wählt aus den Positionstiteln bis zu 3 Positionen.
+    None bei Fehler oder unbrauchbarer Antwort – dann läuft die Anfrage einstufig weiter."""
+    chapters = shortlist_chapters(query, product_info, primary, extra)
+    if not chapters:
+        return None
+    try:
+        timeout = deadline.timeout(SHORTLIST_TIMEOUT) if deadline else SHORTLIST_TIMEOUT
+        result = _call_groq_model(SHORTLIST_MODEL, _shortlist_messages(query, product_info, chapters),
+                                  max_tokens=200, temperature=0, deadline=Deadline(timeout), purpose="shortlist")
+    except Exception:
+        return None
+    return parse_shortlist(result, chapters)
+
+
 # ── Classification Prompt ──
 CLASSIFY_PROMPT = """Du bist ein zertifizierter Schweizer Zolltarif-Experte beim BAZG (Bundesamt für Zoll und Grenzsicherheit).
 Deine Aufgabe: das unten beschriebene Produkt korrekt in den Schweizerischen Gebrauchstarif einreihen.
@@ -617,8 +2946,6 @@ Deine Aufgabe: das unten beschriebene Produkt korrekt in den Schweizerischen Geb
 
 {docs_section}
 
-{product_section}
-
 ═══ PFLICHTABLAUF – FOLGE DIESEN SCHRITTEN EXAKT ═══
 
 SCHRITT 1 – PRODUKTIDENTIFIKATION:
@@ -692,106 +3019,230 @@ Antworte AUSSCHLIESSLICH als JSON (kein weiterer Text):
   "notes": "Hinweise auf fehlende Infos oder Grenzfälle",
   "keywords": ["...", "..."],
   "bazg_docs_used": true
-}}"""
+}}
+
+{product_section}"""
+
+# Zweite Stufe der zweistufigen Einreihung: die Positionen sind vorausgewählt, Schritte 1–3
+# schrumpfen auf die Wahl zwischen ihnen; Schritte 4–6 wie CLASSIFY_PROMPT, Ausgabe mit denselben Feldern, kompakt
+SUBPOSITION_PROMPT = """Du bist ein zertifizierter Schweizer Zolltarif-Experte beim BAZG (Bundesamt für Zoll und Grenzsicherheit).
+Eine Vorauswahl hat die in Frage kommenden Positionen bestimmt; ihre Erläuterungen stehen unten.
+Deine Aufgabe: die zutreffende Position wählen und die Unterposition (Tarifnummer) bestimmen.
+
+{av_section}
+
+{docs_section}
+
+═══ PFLICHTABLAUF – FOLGE DIESEN SCHRITTEN EXAKT ═══
+
+SCHRITT 1–3 – POSITION AUS DER VORAUSWAHL:
+Beschreibe das Produkt kurz. Prüfe die Anmerkungen auf Ausschlüsse und wähle nach dem Wortlaut (AV 1, sonst AV 3)
+die zutreffende der oben aufgeführten Positionen. Passt keine, begründe es in "notes" und setze "confidence": "low".
+
+""" + CLASSIFY_PROMPT[CLASSIFY_PROMPT.index("SCHRITT 4 –"):CLASSIFY_PROMPT.index("═══ AUSGABE ═══")] + """═══ AUSGABE ═══
+Antworte AUSSCHLIESSLICH als JSON (kein weiterer Text), Felder wie folgt:
+{{
+  "product_identified": "...", "product_description": "...", "material": "...", "category": "...",
+  "chapter": <Zahl>, "chapter_name": "...", "position": "XXXX", "position_name": "...",
+  "tariff_number": "XXXX.XXXX", "tariff_description": "vollständiger Wortlaut der Unterposition",
+  "decision_path": [{{"step": 1, "title": "Produktidentifikation", "detail": "..."}},
+    {{"step": 2, "title": "AV 1 – Kapitel/Position", "detail": "..."}},
+    {{"step": 3, "title": "AV 2/3 (falls angewandt)", "detail": "..."}},
+    {{"step": 4, "title": "AV 6 + CHV 1 – Unterposition", "detail": "..."}},
+    {{"step": 5, "title": "Massgebende Rechtsgrundlage", "detail": "Wörtliches Zitat: '...'"}},
+    {{"step": 6, "title": "MWST und Zoll", "detail": "..."}}],
+  "legal_notes_consulted": ["..."], "erlaeuterungen_zitat": "...", "duty_info": "...",
+  "mwst_rate": "X.X%", "mwst_category": "...", "confidence": "high|medium|low", "confidence_reason": "...",
+  "notes": "...", "keywords": ["..."], "bazg_docs_used": true
+}}
+
+{product_section}
+"""
+
+# AV ohne die Regeln für unvollständige Waren, Gemische, Verpackungen und ohne Zollansätze
+SUBPOSITION_AV_TEXT = "\n\n".join(block for block in AV_TEXT.split("\n\n")
+                                  if not block.startswith(("AV 2", "AV 4", "AV 5", "═══ ZOLLANSÄTZE")))
+
+# Statischer Prompt-Präfix (Rahmen + AV + Dokumente) pro Kapitel-/Positions-Kombination
+PROMPT_PREFIX_CACHE = TTLCache(PROMPT_PREFIX_CACHE_SIZE, 24 * 3600)
 
 
 def build_prompt(av_text, docs, chapter, extra_chapters, product_data_str):
-    """
-    Baut den Klassifikations-Prompt auf.
-    Token-Budget (Groq Free Tier: 6000 TPM):
-      - AV-Text:       ~500 tokens  (2000 chars)
-      - Prompt-Frame:  ~500 tokens  (2000 chars)
-      - Produktdaten:  ~200 tokens  ( 800 chars)
-      - Primär-ERL:   ~2000 tokens  (8000 chars)
-      - Primär-ANM:   ~1000 tokens  (4000 chars)
-      - Extra-ERL:     ~600 tokens  (2400 chars)  [nur die Vergleichs-Position]
-      - Response:      ~1200 tokens
-      ─────────────────────────────────────────
-      TOTAL:          ~6000 tokens  ✓
-    """
-    doc_parts = []
-    primary_ch = str(chapter).zfill(2)
-
-    # Für jedes Kapitel die wichtigste/komplexeste Position für die Extraktion.
-    # Die erste Position (XX01) ist oft einfaches Wasser/Basisware –
-    # die zweite/dritte enthält die Erläuterungen und Tabellen.
-    CHAPTER_MAIN_POSITION = {
-        4:  "0401",  # Milch
-        8:  "0811",  # Früchte tiefgekühlt (viele Unternummern)
-        17: "1701",  # Zucker
-        18: "1806",  # Schokolade
-        19: "1905",  # Backwaren/Biscuits
-        20: "2009",  # Fruchtsäfte
-        21: "2106",  # Lebensmittelzubereitungen
-        22: "2202",  # Getränke (NICHT 2201=reines Wasser)
-        33: "3304",  # Kosmetik
-        39: "3926",  # Kunststoffwaren
-        61: "6109",  # T-Shirts etc.
-        62: "6203",  # Herrenbekleidung
-        84: "8471",  # Computer
-        85: "8517",  # Telefone/Smartphones
-        87: "8703",  # Pkw
-        94: "9403",  # Möbel
-        95: "9503",  # Spielzeug
-    }
-    primary_position = CHAPTER_MAIN_POSITION.get(chapter, str(chapter * 100 + 1))
+    """Klassifikations-Prompt als String (siehe assemble_prompt)."""
+    return assemble_prompt(av_text, docs, chapter, extra_chapters, product_data_str)[0]
 
-    erl_primary = docs.get(f"erl_{primary_ch}")
-    anm_primary = docs.get(f"anm_{primary_ch}")
 
-    if erl_primary:
-        erl_trimmed = extract_position_section(
-            erl_primary,
-            target_position=primary_position,
-            intro_chars=800,
-            max_section=4000
-        )
-        doc_parts.append(f"═══ OFFIZIELLE ERLÄUTERUNGEN – KAPITEL {chapter} (Auszug) ═══\n{erl_trimmed}")
+def _position_text(chapter_docs, position, intro_chars):
+    """Kapiteleinleitung + Positionsabschnitt; ohne Retrieval-Treffer die Positionsübersicht."""
+    intro = chapter_docs.intro[:intro_chars].strip()
+    if position:
+        body = chapter_docs.positions.get(position, "")[:16000].strip()   # Reload: Position kann fehlen
     else:
-        doc_parts.append(
-            f"═══ OFFIZIELLE ERLÄUTERUNGEN – KAPITEL {chapter} ═══\n"
-            f"[Nicht im Cache. Klassifiziere nach AV und Fachwissen.]"
-        )
+        body = "Positionen dieses Kapitels:\n" + "\n".join(POSITION_INDEX.overview(chapter_docs.chapter))
+    return f"{intro}\n\n{body}" if intro else body
 
-    if anm_primary:
-        doc_parts.append(
-            f"═══ OFFIZIELLE ANMERKUNGEN – KAPITEL {chapter} ═══\n{anm_primary[:2000]}"
-        )
 
-    # Extra-Kapitel: nur die direkt konkurrierende Position extrahieren
-    # z.B. für Kap 22 → erl_20 mit Position 2009
-    EXTRA_POSITIONS = {
-        20: "2009",   # Fruchtsäfte
-        22: "2202",   # Getränke
-        21: "2106",   # Lebensmittelzubereitungen
-        19: "1901",   # Backwaren
-        4:  "0401",   # Milcherzeugnisse
+def select_positions(docs, chapter, extra_chapters, query):
+    """Welche Positionsabschnitte in den Prompt kommen (BM25 über POSITION_INDEX).
+
+    Gibt (primary, competitors, ranked) zurück: primary = bester Treffer im Primärkapitel
+    (oder None), competitors = [(Kapitel, Position oder None)] nach Score absteigend –
+    weitere Treffer im Primärkapitel (mind. 30 % des besten) und der beste Treffer je
+    Extra-Kapitel.
+    """
+    chapters = [chapter] + [c for c in extra_chapters if c != chapter]
+    ranked = POSITION_INDEX.rank(query, chapters, k=PROMPT_POSITIONS_K)
+
+    primary_docs = docs.get(chapter)
+    primary_hits = ranked.get(chapter, []) if primary_docs and primary_docs.has_erl else []
+    primary = primary_hits[0][0] if primary_hits else None
+
+    competitors = []
+    if primary_hits:
+        best = primary_hits[0][1]
+        competitors += [(score, chapter, code) for code, score in primary_hits[1:] if score >= 0.3 * best]
+    for extra_ch in chapters[1:]:
+        extra_docs = docs.get(extra_ch)
+        if extra_docs and extra_docs.has_erl:
+            hits = ranked.get(extra_ch)
+            competitors.append((hits[0][1], extra_ch, hits[0][0]) if hits else (0.0, extra_ch, None))
+    competitors.sort(key=lambda c: -c[0])
+    return primary, [(ch, code) for _, ch, code in competitors], ranked
+
+
+def build_prompt_prefix(av_text, docs, chapter, primary, competitors, budget, template=CLASSIFY_PROMPT,
+                        caps=None):
+    """
+    Statischer Teil des Prompts (Rahmen + AV + Dokumente) innerhalb des Token-Budgets.
+
+    Abzüglich Rahmen und der festen Produktdaten-Reserve wird das Budget in
+    Prioritätsreihenfolge verteilt:
+      1. AV-Text
+      2. Anmerkungen Primärkapitel        (erster Durchgang bis PROMPT_NOTES_TOKENS)
+      3. Erläuterungen Primärposition    (erster Durchgang bis PROMPT_PRIMARY_TOKENS)
+      4. Konkurrierende Positionen       (erster Durchgang je bis PROMPT_EXTRA_TOKENS)
+    Bleibt Budget übrig, bekommen gekürzte Abschnitte in derselben Reihenfolge mehr.
+
+    Hängt nur von Kapitel und ausgewählten Positionen ab, nicht von der Anfrage –
+    assemble_prompt cached das Ergebnis und hängt nur noch die Produktdaten an.
+    caps = (Anmerkungen, Primärposition, je konkurrierende Position) ersetzt die
+    PROMPT_*_TOKENS-Obergrenzen des ersten Durchgangs (zweite Stufe).
+    Gibt (prefix, report) zurück.
+    """
+    estimator = TOKEN_ESTIMATOR
+    notes_cap, primary_cap, extra_cap = caps or (PROMPT_NOTES_TOKENS, PROMPT_PRIMARY_TOKENS, PROMPT_EXTRA_TOKENS)
+
+    # Kandidaten in Prioritätsreihenfolge; "order" = Reihenfolge im Prompt.
+    # Die Zeichen-Obergrenzen begrenzen nur den Schätzaufwand, gekürzt wird nach Tokens.
+    sections = [{"name": "av", "text": av_text, "cap": budget, "order": 0}]
+
+    primary_docs = docs.get(chapter)
+    if primary_docs and primary_docs.has_anm:
+        sections.append({
+            "name": "notes", "cap": notes_cap, "order": 2,
+            "text": f"═══ OFFIZIELLE ANMERKUNGEN – KAPITEL {chapter} ═══\n{primary_docs.anm[:16000]}",
+        })
+    if primary_docs and primary_docs.has_erl:
+        text = (f"═══ OFFIZIELLE ERLÄUTERUNGEN – KAPITEL {chapter} (Auszug) ═══\n"
+                f"{_position_text(primary_docs, primary, intro_chars=800)}")
+        sections.append({"name": f"primary_{primary or chapter}", "text": text,
+                         "cap": primary_cap, "order": 1})
+    else:
+        sections.append({"name": "primary", "cap": primary_cap, "order": 1, "text": (
+            f"═══ OFFIZIELLE ERLÄUTERUNGEN – KAPITEL {chapter} ═══\n"
+            f"[Nicht im Cache. Klassifiziere nach AV und Fachwissen.]")})
+
+    for i, (ch, code) in enumerate(competitors):
+        if ch == chapter:
+            title = f"═══ ERLÄUTERUNGEN KAPITEL {ch} – Position {code} ═══\n"
+            body = _position_text(docs[ch], code, intro_chars=0)
+        else:
+            title = (f"═══ VERGLEICH: ERLÄUTERUNGEN KAPITEL {ch}" + (f" – Position {code}" if code else "") + " ═══\n"
+                     "[WICHTIG: Prüfe zuerst ob das Produkt hier einzureihen ist!]\n")
+            body = _position_text(docs[ch], code, intro_chars=300)
+        sections.append({"name": f"extra_{code or ch}", "text": title + body,
+                         "cap": extra_cap, "order": 3 + i})
+
+    frame_tokens = estimator.count(template.format(av_section="", docs_section="", product_section=""))
+    remaining = max(0, budget - frame_tokens - PROMPT_PRODUCT_TOKENS)
+
+    # Erster Durchgang mit Obergrenzen, zweiter verteilt den Rest in derselben Reihenfolge
+    for s in sections:
+        s["tokens"] = estimator.count(s["text"])
+        s["alloc"] = min(s["tokens"], s["cap"], remaining)
+        remaining -= s["alloc"]
+    for s in sections:
+        extra = min(s["tokens"] - s["alloc"], remaining)
+        s["alloc"] += extra
+        remaining -= extra
+
+    truncated = []
+    for s in sections:
+        if s["alloc"] < s["tokens"]:
+            truncated.append(s["name"])
+            # Reste unter 50 Tokens sind nur noch Überschrift – ganz weglassen
+            s["text"] = estimator.truncate(s["text"], s["alloc"]) if s["alloc"] >= 50 else ""
+
+    docs_section = '\n\n'.join(s["text"] for s in sorted(sections[1:], key=lambda s: s["order"]) if s["text"])
+    # {product_section} steht am Ende der Vorlage: alles davor ist der statische Präfix
+    prefix = template.format(av_section=sections[0]["text"], docs_section=docs_section, product_section="")
+    report = {
+        "prefix_tokens": estimator.count(prefix),
+        "sections": {s["name"]: s["alloc"] if s["text"] else 0 for s in sections},
+        "truncated": truncated,
     }
-    for extra_ch in extra_chapters:
-        extra_str = str(extra_ch).zfill(2)
-        erl_extra = docs.get(f"erl_{extra_str}")
-        if erl_extra:
-            target_pos = EXTRA_POSITIONS.get(extra_ch, str(extra_ch * 100 + 1))
-            extra_section = extract_position_section(
-                erl_extra,
-                target_position=target_pos,
-                intro_chars=300,
-                max_section=1500
-            )
-            doc_parts.append(
-                f"═══ VERGLEICH: ERLÄUTERUNGEN KAPITEL {extra_ch} – Position {target_pos} ═══\n"
-                f"[WICHTIG: Prüfe zuerst ob das Produkt hier einzureihen ist!]\n"
-                f"{extra_section}"
-            )
+    return prefix, report
 
-    docs_section = '\n\n'.join(doc_parts)
-    product_section = f"═══ PRODUKTDATEN ═══\n{product_data_str}"
 
-    return CLASSIFY_PROMPT.format(
-        av_section=av_text,
-        docs_section=docs_section,
-        product_section=product_section
-    )
+def assemble_prompt(av_text, docs, chapter, extra_chapters, product_data_str, budget=None, query=None,
+                    shortlist=None, template=CLASSIFY_PROMPT, caps=None):
+    """
+    Klassifikations-Prompt innerhalb von PROMPT_TOKEN_BUDGET (geschätzte Tokens).
+
+    Die Positionsauswahl (select_positions, gegen query bzw. product_data_str) läuft pro
+    Anfrage; der statische Präfix (build_prompt_prefix) wird pro Kombination aus Kapitel
+    und Positionen gecacht und ist damit byte-identisch über Anfragen hinweg (Groq-
+    Prompt-Caching). Pro Anfrage kommen nur die Produktdaten dazu.
+
+    Mit shortlist (Positionen aus der Vorauswahl, beste zuerst) entfällt das Retrieval:
+    die erste ist die Primärposition, die übrigen sind die konkurrierenden.
+
+    Gibt (prompt, report) zurück; report enthält Budget, geschätzte Prompt-Tokens,
+    die Tokens pro Abschnitt und die Retrieval-Treffer.
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    if shortlist:
+        primary, competitors = shortlist[0], [(int(code[:2]), code) for code in shortlist[1:]]
+        ranked = {}
+        for code in shortlist:
+            ranked.setdefault(int(code[:2]), []).append((code, None))
+    else:
+        primary, competitors, ranked = select_positions(docs, chapter, extra_chapters, query or product_data_str)
+
+    # Kalibrierfaktor nur grob im Schlüssel: der Präfix bleibt stabil, bis sich die
+    # Schätzung deutlich verschiebt; Kapitel-Versionen, damit ein Reload nur betroffene Präfixe ersetzt
+    versions = tuple((ch, d.version) for ch, d in sorted(docs.items()))
+    key = (versions, hash(av_text), hash(template), caps, chapter, primary, tuple(competitors), budget,
+           round(TOKEN_ESTIMATOR.factor, 1))
+    cached = PROMPT_PREFIX_CACHE.get(key)
+    prefix_cached = cached is not None
+    if not prefix_cached:
+        cached = build_prompt_prefix(av_text, docs, chapter, primary, competitors, budget, template, caps)
+        PROMPT_PREFIX_CACHE.set(key, cached)
+    prefix, prefix_report = cached
+
+    product_section = TOKEN_ESTIMATOR.truncate(f"═══ PRODUKTDATEN ═══\n{product_data_str}", PROMPT_PRODUCT_TOKENS)
+    product_tokens = TOKEN_ESTIMATOR.count(product_section)
+    report = {
+        "budget": budget,
+        "prompt_tokens": prefix_report["prefix_tokens"] + product_tokens,
+        "prefix_tokens": prefix_report["prefix_tokens"],
+        "prefix_cached": prefix_cached,
+        "sections": dict(prefix_report["sections"], product=product_tokens),
+        "truncated": prefix_report["truncated"],
+        "positions": {ch: [code for code, _ in hits] for ch, hits in ranked.items()},
+    }
+    return prefix + product_section, report
 
 
 def _apply_mwst(result):
@@ -816,28 +3267,724 @@ def _apply_mwst(result):
     # Kap. 25–97: leave LLM value (mostly 8.1% for industrial goods, but some exceptions)
 
 
-def classify_product(product_query):
-    """Hauptpipeline für die Tarifierung."""
-
-    # ── Schritt 1: Produktdaten ermitteln ──
-    # OFF quick search: single attempt, 3s timeout (no retries/fallbacks).
-    # Budget: OFF 3s + Groq 22s (SIGALRM) + overhead 2s = 27s < Render's 30s.
-    data_source = "none"
-    product_info = off_quick_search(product_query)
+# ── Fast Path ──
+# Kuratierte Regeln für Produkte, deren Tarifnummer schon aus dem Produkttyp eindeutig folgt.
+# Eine Regel greift nur, wenn
+#   - match auf Anfrage + Produktname + Kategorien + Menge trifft,
+#   - context (falls gesetzt) dort ein Getränk belegt (Volumen, Flasche, Dose …),
+#   - exclude dort nichts findet (Aromen, Zusätze, Alkohol, Zubehör …),
+#   - exclude_ingredients nicht auf die OFF-Zutaten trifft,
+#   - confirm_categories (falls gesetzt) auf die OFF-Kategorien trifft – ohne Produktdaten
+#     greift die Regel also nie, die Anfrage allein ("Haribo Cola …") reicht nicht,
+#   - detect_chapters kein anderes Kapitel als primär liefert (Schlüsselwörter + Indikatoren).
+# Alles andere – auch jeder Zweifel – geht an das LLM.
+FAST_PATH_DRINK_CONTEXT = (r"\b\d+(?:[.,]\d+)?\s*(?:ml|cl|dl|l|lt|liter|litre)\b|"
+                           r"\b(?:flaschen?|dosen?|pet|can|bottle|magnum|piccolo|sixpack|harass)\b")
+FAST_PATH_BEVERAGE_CATEGORIES = r"beverage|getränk|boisson|bevand|drink|water|wasser|eaux?\b|soda|wine|wein|vin\b|liqueur|likör|spirit"
+FAST_PATH_RULES = [
+    {
+        "id": "mineralwasser",
+        "match": r"\b(?:natürliches )?(?:mineral|tafel|quell)wasser\b|\bmineral water\b|\beau min[ée]rale\b",
+        "exclude": r"geschmack|aroma|flavou?r|zitron|lemon|limette|lime|pfirsich|apfel|beere|orange|frucht|"
+                   r"zucker|sirup|süss|tee|cola|saft|vitamin|energy|isoton|mix|bier|wein",
+        "exclude_ingredients": r"zucker|süss|aroma|saft|extrakt|zitronensäure|sirup|fruktose|glukose",
+        "confirm_categories": FAST_PATH_BEVERAGE_CATEGORIES,
+        "chapter": 22,
+        "chapter_name": "Getränke, alkoholhaltige Flüssigkeiten und Essig",
+        "position": "2201",
+        "position_name": "Wasser, einschliesslich natürliches oder künstliches Mineralwasser und mit "
+                         "Kohlensäure versetztes Wasser, weder mit Zusatz von Zucker oder anderen Süssstoffen "
+                         "noch aromatisiert; Eis und Schnee",
+        "tariff_number": "2201.1000",
+        "tariff_description": "Mineralwasser und mit Kohlensäure versetztes Wasser",
+        "category": "Getränk – Wasser",
+        "material": "Wasser (natürliches Mineralwasser), ohne Zusatz von Zucker oder Aromastoffen",
+        "reason": "Mineralwasser ohne Zusatz von Zucker/Süssstoffen und nicht aromatisiert → Nr. 2201 "
+                  "(mit Zusätzen oder Aroma wäre es Nr. 2202).",
+    },
+    {
+        "id": "softdrink",
+        "match": r"\b(?:coca[- ]?cola|pepsi|cola|limonade|softdrink|tonic water|ginger ale|fanta|sprite)\b",
+        "context": FAST_PATH_DRINK_CONTEXT,
+        "exclude": r"bier|radler|panach|shandy|rum|whisk|vodka|wodka|gin\b|alkohol|% ?vol|saft|sirup|pulver|"
+                   r"brause|konzentrat|bonbon|gummi|glace|eis\b|lutscher|kaugummi|aroma|schokolade|kuchen|"
+                   r"glas|flasche leer|kiste leer|fläschchen|haribo|balm|frizzante|perlwein",
+        "exclude_ingredients": r"saft|fruchtmark|milch|alkohol",
+        "confirm_categories": FAST_PATH_BEVERAGE_CATEGORIES,
+        "chapter": 22,
+        "chapter_name": "Getränke, alkoholhaltige Flüssigkeiten und Essig",
+        "position": "2202",
+        "position_name": "Wasser, einschliesslich Mineralwasser und mit Kohlensäure versetztes Wasser, mit "
+                         "Zusatz von Zucker oder anderen Süssstoffen oder aromatisiert, und andere "
+                         "nichtalkoholische Getränke, ausgenommen Frucht- oder Gemüsesäfte der Nr. 2009",
+        "tariff_number": "2202.1000",
+        "tariff_description": "Wasser, einschliesslich Mineralwasser und mit Kohlensäure versetztes Wasser, "
+                              "mit Zusatz von Zucker oder anderen Süssstoffen oder aromatisiert",
+        "category": "Getränk – Erfrischungsgetränk",
+        "material": "Wasser, Zucker oder Süssstoffe, Aromastoffe, Kohlensäure",
+        "reason": "Aromatisiertes/gesüsstes Wasser ohne Saftanteil → 2202.1000 (aromatisiertes Tafelgetränk; "
+                  "tiefere Unterpositionen 2202.99 setzen einen Saftgehalt voraus).",
+    },
+    {
+        "id": "schaumwein",
+        "match": r"\b(?:schaumwein|sekt|champagner|champagne|prosecco|cava|crémant|cremant|spumante)\b",
+        "context": FAST_PATH_DRINK_CONTEXT,
+        "exclude": r"alkoholfrei|ohne alkohol|0[.,]0|entalkoholisiert|essig|schokolade|trüffel|praline|"
+                   r"glas|gläser|kühler|flöte|kelch|senf|sorbet|bonbon|frizzante|perlwein|fläschchen|haribo|balm",
+        "exclude_ingredients": r"",
+        "confirm_categories": FAST_PATH_BEVERAGE_CATEGORIES,
+        "chapter": 22,
+        "chapter_name": "Getränke, alkoholhaltige Flüssigkeiten und Essig",
+        "position": "2204",
+        "position_name": "Wein aus frischen Weintrauben, einschliesslich mit Alkohol angereicherter Wein; "
+                         "Traubenmost, ausgenommen solcher der Nr. 2009",
+        "tariff_number": "2204.1000",
+        "tariff_description": "Schaumwein",
+        "category": "Getränk – alkoholhaltig (Schaumwein)",
+        "material": "Wein aus frischen Weintrauben, Kohlensäure aus Gärung",
+        "reason": "Schaumwein aus frischen Weintrauben → Unterposition 2204.1000.",
+    },
+    {
+        "id": "likoer",
+        "match": r"\b(?:likör|liqueur|liquore|kräuterlikör|eierlikör)\b",
+        "exclude": r"praline|schokolade|trüffel|bohnen|kuchen|torte|glas|gläser|bonbon|glace|eis\b|füllung",
+        "exclude_ingredients": r"",
+        "confirm_categories": FAST_PATH_BEVERAGE_CATEGORIES,
+        "chapter": 22,
+        "chapter_name": "Getränke, alkoholhaltige Flüssigkeiten und Essig",
+        "position": "2208",
+        "position_name": "Ethylalkohol mit einem Alkoholgehalt von weniger als 80 % vol, unvergällt; "
+                         "Branntwein, Likör und andere Spirituosen",
+        "tariff_number": "2208.7000",
+        "tariff_description": "Likör",
+        "category": "Getränk – Spirituose (Likör)",
+        "material": "Ethylalkohol, Zucker (> 50 g/l), Aromen",
+        "reason": "Likör (Spirituose mit mehr als 50 g Zucker je Liter) → Unterposition 2208.7000.",
+    },
+    {
+        "id": "orangen",
+        "match": r"^\s*(?:frische |bio[- ])?(?:orangen?|blutorangen?|navel[- ]?orangen?)(?: aus \w+)?\s*"
+                 r"(?:\d+(?:[.,]\d+)?\s*(?:kg|g|stk|stück))?\s*$",
+        "exclude": r"saft|nektar|limo|schokolade|konfitüre|marmelade|getrocknet|sirup|aroma|öl|tee|schale",
+        "exclude_ingredients": r"",
+        "chapter": 8,
+        "chapter_name": "Geniessbare Früchte und Nüsse; Schalen von Zitrusfrüchten oder von Melonen",
+        "position": "0805",
+        "position_name": "Zitrusfrüchte, frisch oder getrocknet",
+        "tariff_number": "0805.1000",
+        "tariff_description": "Orangen",
+        "category": "Frische Früchte",
+        "material": "Orangen, frisch",
+        "reason": "Frische Orangen (Zitrusfrüchte) → Unterposition 0805.1000.",
+    },
+]
+for _rule in FAST_PATH_RULES:
+    _rule["match_re"] = re.compile(_rule["match"])
+    _rule["exclude_re"] = re.compile(_rule["exclude"])
+    _rule["exclude_ingredients_re"] = re.compile(_rule["exclude_ingredients"]) if _rule["exclude_ingredients"] else None
+    _rule["context_re"] = re.compile(_rule["context"]) if _rule.get("context") else None
+    _rule["confirm_categories_re"] = re.compile(_rule["confirm_categories"]) if _rule.get("confirm_categories") else None
+
+
+class FastPathStats:
+    """Zähler für /stats: wie viel des (ungecachten) Verkehrs der Fast Path beantwortet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.answered = 0
+        self.rules = {}
+
+    def record(self, result):
+        """Einmal pro ungecachter Klassifikation: result = Fast-Path-Ergebnis oder None."""
+        with self._lock:
+            self.checked += 1
+            if result:
+                rule_id = result["fast_path_rule"]
+                self.answered += 1
+                self.rules[rule_id] = self.rules.get(rule_id, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": FAST_PATH_ENABLED,
+                "rules": len(FAST_PATH_RULES),
+                "checked": self.checked,
+                "answered": self.answered,
+                "coverage": round(self.answered / self.checked, 3) if self.checked else 0.0,
+                "by_rule": dict(self.rules),
+            }
+
+
+FAST_PATH_STATS = FastPathStats()
+
+
+def match_fast_path_rule(product_query, product_info=None):
+    """Erste Regel aus FAST_PATH_RULES, die eindeutig greift, sonst None."""
+    text = product_query.lower()
+    ingredients = categories = ""
     if product_info:
-        data_source = "off"
+        categories = (product_info.get("categories") or "").lower()
+        text += " " + f"{product_info.get('name', '')} {categories} {product_info.get('quantity') or ''}".lower()
+        ingredients = (product_info.get("ingredients") or "").lower()
+    primary = detected = None
+    for rule in FAST_PATH_RULES:
+        if not rule["match_re"].search(text) or rule["exclude_re"].search(text):
+            continue
+        if rule["context_re"] and not rule["context_re"].search(text):
+            continue
+        if rule["confirm_categories_re"] and not rule["confirm_categories_re"].search(categories):
+            continue
+        if ingredients and rule["exclude_ingredients_re"] and rule["exclude_ingredients_re"].search(ingredients):
+            continue
+        if not detected:
+            primary, _ = detect_chapters(product_query, product_info)
+            detected = True
+        if primary in (None, rule["chapter"]):
+            return rule
+    return None
 
-    # ── Schritt 2: Kapitel(n) bestimmen ──
-    primary_chapter, extra_chapters = detect_chapters(product_query, product_info)
 
-    if primary_chapter is None:
-        primary_chapter, extra_chapters = guess_chapter_llm(product_query, product_info)
+def fast_path_result(rule, product_query, product_info=None):
+    """Vollständiges Ergebnis im /classify-Schema für eine Fast-Path-Regel."""
+    chapter_docs = CORPUS.get(rule["chapter"])
+    section = chapter_docs.positions.get(rule["position"], "") if chapter_docs else ""
+    heading = " ".join(section.strip().split("\n\n")[0].split())
+    name = (product_info or {}).get("name") or product_query
+    brand = (product_info or {}).get("brand")
+    return {
+        "product_identified": f"{name} ({brand})" if brand else name,
+        "product_description": f"{name} – {rule['category']}",
+        "material": rule["material"],
+        "category": rule["category"],
+        "chapter": rule["chapter"],
+        "chapter_name": rule["chapter_name"],
+        "position": rule["position"],
+        "position_name": rule["position_name"],
+        "tariff_number": rule["tariff_number"],
+        "tariff_description": rule["tariff_description"],
+        "decision_path": [
+            {"step": 1, "title": "Produktidentifikation", "detail": f"{name}: {rule['category']}."},
+            {"step": 2, "title": "AV 1 – Kapitel/Position",
+             "detail": f"Kapitel {rule['chapter']}, Position {rule['position']} nach dem Wortlaut: "
+                       f"{rule['position_name']}."},
+            {"step": 3, "title": "AV 2/3 (falls angewandt)", "detail": "Nicht angewandt, AV 1 reicht."},
+            {"step": 4, "title": "AV 6 + CHV 1 – Unterposition", "detail": rule["reason"]},
+            {"step": 5, "title": "Massgebende Rechtsgrundlage",
+             "detail": f"Wörtliches Zitat: '{heading}' [Quelle: Erläuterungen Kap. {rule['chapter']}]"
+             if heading else f"Wortlaut der Position {rule['position']}."},
+            {"step": 6, "title": "MWST und Zoll", "detail": "MWST gemäss Tarifnummer (deterministisch)."},
+        ],
+        "legal_notes_consulted": [],
+        "erlaeuterungen_zitat": heading,
+        "erl_excerpt": section.strip()[:1500],
+        "duty_info": "Nicht ermittelt (regelbasierte Einreihung) – Zollansatz gemäss Tares",
+        "confidence": "high",
+        "confidence_reason": f"Regelbasierte Einreihung (Regel '{rule['id']}'): Produkttyp eindeutig, "
+                             f"keine widersprechenden Merkmale, Kapitelerkennung übereinstimmend.",
+        "notes": "",
+        "keywords": [rule["id"]],
+        "answered_by": "fast_path",
+        "fast_path_rule": rule["id"],
+    }
 
-    # ── Schritt 3: BAZG-Dokumente laden ──
-    all_chapters = [primary_chapter] + [c for c in extra_chapters if c != primary_chapter]
-    docs = get_chapter_docs(all_chapters)
 
-    # ── Schritt 4: Produktdaten-String aufbauen ──
+def fast_path_classify(product_query, product_info=None):
+    """Regelbasierte Einreihung ohne LLM; None, wenn keine Regel eindeutig greift."""
+    if not FAST_PATH_ENABLED:
+        return None
+    rule = match_fast_path_rule(product_query, product_info)
+    return fast_path_result(rule, product_query, product_info) if rule else None
+
+
+RESULT_CACHE = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+# Faltung für Ähnlichkeitsvergleich: Umlaute und ihre Umschreibung (ä/ae → a) fallen zusammen
+SIMILARITY_FOLD = (("ä", "a"), ("ö", "o"), ("ü", "u"), ("ae", "a"), ("oe", "o"), ("ue", "u"),
+                   ("ß", "ss"), ("é", "e"), ("è", "e"), ("ê", "e"), ("à", "a"), ("ç", "c"))
+SIMILARITY_TOKEN_RE = re.compile(r"[0-9]+(?:\.[0-9]+)?[a-z]*|[a-z]+")
+SIMILARITY_VOLUME_RE = re.compile(r"([0-9]+(?:[.,][0-9]+)?)\s*([a-z]+)", re.IGNORECASE)
+SIMILARITY_VOLUME_ML = {"ml": 1, "cl": 10, "dl": 100, "l": 1000, "liter": 1000}
+SIMILARITY_WEIGHT_RE = re.compile(r"\b([0-9]+(?:[.,][0-9]+)?)\s*(kg|g)\b", re.IGNORECASE)
+
+
+def _volume_ml(match):
+    """LIQUID_VOLUME_RE-Treffer → einheitlich in ml ("0,5 l", "50cl", "500 ml" → "500ml")."""
+    number, unit = SIMILARITY_VOLUME_RE.match(match.group(0)).groups()
+    ml = float(number.replace(",", ".")) * SIMILARITY_VOLUME_ML[unit.lower()]
+    return f" {ml:g}ml "
+
+
+def _weight_g(match):
+    grams = float(match.group(1).replace(",", ".")) * (1000 if match.group(2).lower() == "kg" else 1)
+    return f" {grams:g}g "
+
+
+def similarity_tokens(text):
+    """Sortierte, eindeutige Tokens: Kleinschreibung, Umlaute gefaltet, Volumen in ml, Gewichte in g."""
+    text = SIMILARITY_WEIGHT_RE.sub(_weight_g, LIQUID_VOLUME_RE.sub(_volume_ml, text.lower()))
+    for char, folded in SIMILARITY_FOLD:
+        text = text.replace(char, folded)
+    return tuple(sorted(set(SIMILARITY_TOKEN_RE.findall(text.replace(",", ".")))))
+
+
+def _token_grams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _word_grams(tokens):
+    """Trigramme der Wörter; Zahlen/Mengen zählen nicht zur Ähnlichkeit (sie müssen exakt passen)."""
+    return set().union(*(_token_grams(t) for t in tokens if not t[0].isdigit()))
+
+
+def _jaccard(a, b):
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if a or b else 0.0
+
+
+class SimilarQueryIndex:
+    """Trigramm-Index über bereits klassifizierte Anfragen und OFF-Produktnamen.
+
+    Jede Anfrage wird auf ihre Token-Menge reduziert (similarity_tokens) – Wortreihenfolge,
+    Gross-/Kleinschreibung, Umlaut-Schreibweise und Volumenangabe spielen dann keine Rolle.
+    Gleiche Token-Menge ist ein exakter Treffer; sonst wird über eine Trigramm-Postingliste
+    der ähnlichste Eintrag mit Jaccard >= threshold gesucht. Damit "Cola Zero" nicht auf
+    "Cola" fällt, muss zusätzlich jedes Wort einen ähnlichen Partner auf der Gegenseite
+    haben (Tippfehler ja, zusätzliche Wörter nein) und die Zahlen müssen übereinstimmen.
+    Einträge verweisen nur auf den RESULT_CACHE-Schlüssel; ist das Ergebnis dort
+    verdrängt oder abgelaufen, gilt der Treffer als Fehltreffer.
+    """
+
+    TOKEN_MIN_SIMILARITY = 0.5
+
+    def __init__(self, maxsize, threshold):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries = OrderedDict()  # Signatur -> {"tokens", "grams", "key", "query"}
+        self._postings = {}            # Trigramm -> set(Signatur)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.rejected = 0
+        self.lookup_seconds = 0.0
+
+    def add(self, text, key, query=None):
+        tokens = similarity_tokens(text)
+        if not tokens:
+            return
+        signature = " ".join(tokens)
+        grams = _word_grams(tokens)
+        with self._lock:
+            if signature in self._entries:
+                self._drop(signature)
+            self._entries[signature] = {"tokens": tokens, "grams": grams, "key": key, "query": query or text}
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(signature)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, signature):
+        entry = self._entries.pop(signature)
+        for gram in entry["grams"]:
+            bucket = self._postings.get(gram)
+            if bucket is not None:
+                bucket.discard(signature)
+                if not bucket:
+                    del self._postings[gram]
+
+    def _compatible(self, tokens, other):
+        """Zahlen identisch, jedes Wort hat einen ähnlichen Partner (in beide Richtungen)."""
+        if [t for t in tokens if t[0].isdigit()] != [t for t in other if t[0].isdigit()]:
+            return False
+        words = [(t, _token_grams(t)) for t in tokens if not t[0].isdigit()]
+        other_words = [(t, _token_grams(t)) for t in other if not t[0].isdigit()]
+        for side, against in ((words, other_words), (other_words, words)):
+            for token, grams in side:
+                if not any(token == o or _jaccard(grams, og) >= self.TOKEN_MIN_SIMILARITY
+                           for o, og in against):
+                    return False
+        return True
+
+    def lookup(self, text, scope):
+        """Bester Eintrag für text, dessen Schlüssel mit scope (Modell, Korpus-Version) endet.
+
+        Gibt {"key", "query", "similarity"} oder None zurück.
+        """
+        t0 = time.perf_counter()
+        tokens = similarity_tokens(text)
+        match = None
+        with self._lock:
+            self.lookups += 1
+            signature = " ".join(tokens)
+            entry = self._entries.get(signature)
+            if entry is not None and entry["key"][2:] == scope:
+                self.exact_hits += 1
+                match = {"key": entry["key"], "query": entry["query"], "similarity": 1.0}
+            elif grams := _word_grams(tokens):
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._postings.get(gram, ()))
+                # Jaccard >= t setzt mindestens t·|grams| gemeinsame Trigramme voraus
+                min_shared = self.threshold * len(grams)
+                scored = []
+                for candidate, count in shared.items():
+                    if count < min_shared:
+                        continue
+                    entry = self._entries[candidate]
+                    score = count / (len(grams) + len(entry["grams"]) - count)
+                    if score >= self.threshold and entry["key"][2:] == scope:
+                        scored.append((score, candidate))
+                for score, candidate in sorted(scored, reverse=True):
+                    entry = self._entries[candidate]
+                    if self._compatible(tokens, entry["tokens"]):
+                        self.fuzzy_hits += 1
+                        match = {"key": entry["key"], "query": entry["query"], "similarity": round(score, 3)}
+                        break
+                    self.rejected += 1
+            self.lookup_seconds += time.perf_counter() - t0
+        return match
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": FUZZY_CACHE_ENABLED,
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "rejected": self.rejected,
+                "avg_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+            }
+
+
+SIMILAR_QUERIES = SimilarQueryIndex(FUZZY_CACHE_SIZE, FUZZY_CACHE_THRESHOLD)
+
+
+class ResultStore:
+    """Persistenter Ergebnis-Speicher (SQLite im WAL-Modus), geteilt von allen Workern.
+
+    Schlüssel wie beim RESULT_CACHE: (normalisierte Anfrage, EAN, Modell); dazu die
+    Kapitel-Versionen des Ergebnisses (corpus_versions), gegen die _cached_result prüft.
+    Gelesen wird über eine Verbindung pro Thread (im WAL-Modus blockieren Leser den
+    Schreiber nicht). Geschrieben wird nur von einem Hintergrund-Thread pro Prozess, der
+    die Queue in Batches zu je einer Transaktion leert; die Anfrage wartet nie auf die
+    Platte. Mit synchronous=NORMAL wird erst beim Checkpoint ge-fsync-t – ein Absturz
+    kostet höchstens die letzten Batches, die Datenbank bleibt konsistent.
+    """
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+        query TEXT NOT NULL, ean TEXT NOT NULL, model TEXT NOT NULL, corpus_versions TEXT NOT NULL,
+        result TEXT NOT NULL, created REAL NOT NULL,
+        PRIMARY KEY (query, ean, model)) WITHOUT ROWID"""
+
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.enabled = bool(path)
+        self._local = threading.local()   # sqlite3-Verbindungen sind pro Thread (und Prozess)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(RESULT_STORE_QUEUE_SIZE)
+        self._writer_pid = None
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        if self.enabled:
+            try:
+                conn = self._connect()
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute(self.SCHEMA)
+                conn.close()
+            except sqlite3.Error:
+                self.enabled = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _conn(self):
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:   # nach fork() keine Verbindung des Masters erben
+            self._local.conn = self._connect()
+            self._local.pid = pid
+        return self._local.conn
+
+    def get(self, key):
+        """Gespeichertes Ergebnis (nicht älter als max_age) oder None."""
+        if not self.enabled:
+            return None
+        try:
+            conn = self._conn()
+            t0 = time.perf_counter()
+            row = conn.execute(
+                "SELECT result FROM results WHERE query = ? AND ean = ? AND model = ?"
+                " AND created >= ?", (*key, time.time() - self.max_age)).fetchone()
+            result = json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError):
+            t0, result = time.perf_counter(), None
+        with self._lock:
+            self.lookups += 1
+            self.hits += 1 if result is not None else 0
+            self.lookup_seconds += time.perf_counter() - t0
+        return result
+
+    def put(self, key, result):
+        """Reiht ein Ergebnis zum Schreiben ein; bei voller Queue wird es verworfen (zählt dropped)."""
+        if not self.enabled:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((key, result, time.time()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout=5):
+        """Wartet, bis alles bisher Eingereihte geschrieben ist (Export, Prozessende)."""
+        if not self.enabled or self._writer_pid != os.getpid():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return
+        with self._lock:
+            if self._writer_pid != pid:
+                self._queue = queue.Queue(RESULT_STORE_QUEUE_SIZE)   # Queue des Masters ist nach fork() unbrauchbar
+                self._writer_pid = pid
+                threading.Thread(target=self._write_loop, name="result-store-writer", daemon=True).start()
+
+    def _write_loop(self):
+        conn = self._connect()
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            flush_at = time.monotonic() + RESULT_STORE_FLUSH_INTERVAL
+            while len(batch) < RESULT_STORE_BATCH_SIZE and not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(pending.get(timeout=max(0.0, flush_at - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._write(conn, [item for item in batch if not isinstance(item, threading.Event)])
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, conn, items):
+        if not items:
+            return
+        t0 = time.perf_counter()
+        rows = [(*key, json.dumps(result.get("corpus_versions") or {}, sort_keys=True),
+                 json.dumps(result, ensure_ascii=False), created) for key, result, created in items]
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+            written, errors = len(rows), 0
+        except sqlite3.Error:
+            written, errors = 0, len(rows)
+        with self._lock:
+            self.written += written
+            self.errors += errors
+            self.batches += 1
+            self.write_seconds += time.perf_counter() - t0
+
+    @staticmethod
+    def _where(model=None, older_than=None):
+        clauses, params = [], []
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if older_than is not None:
+            clauses.append("created < ?")
+            params.append(time.time() - older_than)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def export(self, model=None, limit=None):
+        """Einträge (älteste zuerst) als Dicts – für /admin/results."""
+        where, params = self._where(model=model)
+        sql = f"SELECT query, ean, model, corpus_versions, created, result FROM results{where} ORDER BY created"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        conn = self._connect()
+        try:
+            for query, ean, model, versions, created, result in conn.execute(sql, params):
+                yield {"query": query, "ean": ean, "model": model, "corpus_versions": json.loads(versions),
+                       "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created)),
+                       "result": json.loads(result)}
+        finally:
+            conn.close()
+
+    def prune(self, older_than=None, stale_for=None):
+        """Löscht Einträge älter als older_than Sekunden und/oder – mit stale_for=Modell – alle
+        anderer Modelle oder mit veralteten Kapitel-Versionen (beide Kriterien: nur Einträge, die
+        beide erfüllen). Gibt die Anzahl gelöschter Zeilen zurück."""
+        if older_than is None and not stale_for:
+            return 0
+        where, params = self._where(older_than=older_than)
+        conn = self._connect()
+        try:
+            with conn:
+                if not stale_for:
+                    deleted = conn.execute(f"DELETE FROM results{where}", params).rowcount
+                else:
+                    # Kapitel-Versionen stecken als JSON in der Zeile – in Python prüfen
+                    rows = conn.execute(f"SELECT query, ean, model, corpus_versions FROM results{where}",
+                                        params).fetchall()
+                    stale = [(query, ean, model) for query, ean, model, versions in rows
+                             if model != stale_for or not corpus_versions_current(json.loads(versions))]
+                    conn.executemany("DELETE FROM results WHERE query = ? AND ean = ? AND model = ?", stale)
+                    deleted = len(stale)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        return deleted
+
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        try:
+            rows = self._conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.Error:
+            rows = None
+        size = sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal")
+                   if os.path.exists(self.path + suffix))
+        return {
+            "enabled": True,
+            "rows": rows,
+            "size_bytes": size,
+            "max_age": self.max_age,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "avg_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "batches": self.batches,
+            "avg_batch_ms": round(self.write_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+        }
+
+
+RESULT_STORE = ResultStore(RESULT_STORE_PATH, RESULT_STORE_MAX_AGE)
+atexit.register(RESULT_STORE.flush)
+
+
+def result_cache_key(product_query):
+    """Schlüssel: normalisierte Anfrage, EAN (bei Barcode-Anfragen), Modell. Den Korpus-Stand
+    prüft _cached_result über result["corpus_versions"] – pro Kapitel statt pro Korpus."""
+    digits = re.sub(r'\D', '', product_query)
+    ean = digits if len(digits) >= 8 else ""
+    return (normalize_query(product_query), ean, classification_model())
+
+
+def corpus_versions_current(versions):
+    """True, wenn alle Kapitel eines Ergebnisses ({"22": Version}) noch im aktuellen Stand
+    des CORPUS vorliegen; Ergebnisse ohne Versionen gelten als veraltet."""
+    return bool(versions) and versions == CORPUS.versions(versions)
+
+
+def _current(cached, stale):
+    """cached, falls seine Kapitel nicht seit dem Caching neu geladen wurden – sonst None
+    (veraltete Treffer kommen in die Liste stale)."""
+    if cached is None or corpus_versions_current(cached.get("corpus_versions")):
+        return cached
+    stale.append(cached)
+    return None
+
+
+def _cached_result(key):
+    """Kopie des gecachten Ergebnisses (mit cache_hit=True) oder None.
+
+    Fehlt der Schlüssel im RESULT_CACHE, wird im persistenten RESULT_STORE nachgesehen
+    (Treffer wärmen den Prozess-Cache). Ohne exakten Treffer wird (nicht bei
+    Barcode-Anfragen) im SimilarQueryIndex nach einer gleichwertigen Anfrage gesucht; der
+    Treffer steht dann in cache_match. Ergebnisse, deren Kapitel seit dem Caching neu
+    geladen wurden (corpus_versions), zählen als Fehlschlag und werden überschrieben.
+    """
+    CORPUS_RELOADER.ensure_watcher()
+    stale = []
+    cached = _current(RESULT_CACHE.get(key), stale)
+    if cached is None:
+        cached = _current(RESULT_STORE.get(key), stale)
+        if cached is not None:
+            _remember_result(key, cached)
+    match = None
+    if cached is None and FUZZY_CACHE_ENABLED and not key[1]:
+        match = SIMILAR_QUERIES.lookup(key[0], key[2:])
+        if match:
+            cached = _current(RESULT_CACHE.get(match["key"]), stale)
+    if cached is None:
+        if stale:
+            CORPUS_RELOADER.count_stale()
+        return None
+    result = copy.deepcopy(cached)
+    result["cache_hit"] = True
+    if match:
+        result["cache_match"] = {"query": match["query"], "similarity": match["similarity"]}
+    return result
+
+
+def _remember_result(key, result):
+    """Ergebnis in den RESULT_CACHE legen (ohne Kopie – wird danach nicht mehr verändert).
+
+    Anfrage und – falls vorhanden – OFF-Produktname (Marke + Name) kommen in den
+    SimilarQueryIndex, damit spätere Schreibvarianten das Ergebnis wiederfinden.
+    """
+    RESULT_CACHE.set(key, result)
+    if FUZZY_CACHE_ENABLED:
+        if not key[1]:
+            SIMILAR_QUERIES.add(key[0], key)
+        off_product = result.get("_off_product") or {}
+        if off_product.get("name"):
+            SIMILAR_QUERIES.add(f"{off_product.get('brand', '')} {off_product['name']}", key,
+                                query=off_product["name"])
+
+
+def _store_result(key, result):
+    """Nur erfolgreiche Ergebnisse cachen (nie RateLimitError/Fehler): im Prozess und persistent.
+    Antworten des Hedge-Modells nicht – der Schlüssel steht für GROQ_MODEL."""
+    if "error" not in result and result.get("model", GROQ_MODEL) == GROQ_MODEL:
+        stored = copy.deepcopy(result)
+        _remember_result(key, stored)
+        RESULT_STORE.put(key, stored)
+    result["cache_hit"] = False
+
+
+def classify_product(product_query, deadline=None):
+    """Tarifierung mit vorgeschaltetem Ergebnis-Cache (nur erfolgreiche Ergebnisse)."""
+    key = result_cache_key(product_query)
+    with span("cache"):
+        result = _cached_result(key)
+    if result is None:
+        result = _classify_uncached(product_query, deadline or Deadline(REQUEST_DEADLINE))
+        _store_result(key, result)
+    return result
+
+
+def build_product_data_str(product_query, product_info, data_source):
+    """Produktdaten-Abschnitt des Prompts (mit oder ohne OFF-/Web-Daten)."""
     if product_info:
         source_label = (
             "Open Food Facts (offizielle Produktdaten)"
@@ -845,7 +3992,7 @@ def classify_product(product_query):
             else "Web-Suche (automatisch recherchiert)"
         )
         desc_line = f"Beschreibung: {product_info['description']}\n" if product_info.get("description") else ""
-        product_data_str = (
+        return (
             f"Anfrage: {product_query}\n"
             f"Produktname: {product_info.get('name', product_query)}\n"
             f"Marke: {product_info.get('brand', 'unbekannt')}\n"
@@ -856,34 +4003,37 @@ def classify_product(product_query):
             f"EAN: {product_info.get('ean', 'unbekannt')}\n"
             f"Datenquelle: {source_label}"
         )
-    else:
-        product_data_str = (
-            f"Anfrage: {product_query}\n"
-            f"HINWEIS: Keine Produktdaten gefunden. Zusammensetzung und genaue Produktart unbekannt.\n"
-            f"→ confidence auf 'low' oder 'medium' setzen und fehlende Informationen benennen.\n"
-            f"→ WICHTIG: Ohne Zusammensetzungsdaten NUR bis zur eindeutig bestimmbaren Unterposition einreihen!\n"
-            f"   Bei 2202: STOPP bei 2202.1000. Bei 2009: STOPP bei 2009.XYYY (Fruchtart bestimmt erste Stelle).\n"
-            f"   Keine spekulativen Sub-Positionen die %-Angaben erfordern."
-        )
+    return (
+        f"Anfrage: {product_query}\n"
+        f"HINWEIS: Keine Produktdaten gefunden. Zusammensetzung und genaue Produktart unbekannt.\n"
+        f"→ confidence auf 'low' oder 'medium' setzen und fehlende Informationen benennen.\n"
+        f"→ WICHTIG: Ohne Zusammensetzungsdaten NUR bis zur eindeutig bestimmbaren Unterposition einreihen!\n"
+        f"   Bei 2202: STOPP bei 2202.1000. Bei 2009: STOPP bei 2009.XYYY (Fruchtart bestimmt erste Stelle).\n"
+        f"   Keine spekulativen Sub-Positionen die %-Angaben erfordern."
+    )
 
-    # ── Schritt 5: Prompt aufbauen und LLM aufrufen ──
-    prompt = build_prompt(AV_TEXT, docs, primary_chapter, extra_chapters, product_data_str)
 
-    try:
-        result = call_groq([
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": (
-                f"Tarifiere folgendes Produkt nach Schweizer Zolltarif:\n{product_query}\n\n"
-                f"WICHTIG: Folge dem Pflichtablauf (Schritte 1-6). "
-                f"Zitiere die massgebenden Erläuterungen wörtlich. "
-                f"Prüfe zuerst die Kapitel-Anmerkungen auf Ausschlüsse."
-            )}
-        ], max_tokens=1000)
-    except RateLimitError as e:
-        return {"error": str(e), "rate_limited": True, "retry_after": 60}
-    except Exception as e:
-        return {"error": f"LLM-Einreihung fehlgeschlagen: {e}"}
+def classification_messages(prompt, product_query):
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": (
+            f"Tarifiere folgendes Produkt nach Schweizer Zolltarif:\n{product_query}\n\n"
+            f"WICHTIG: Folge dem Pflichtablauf (Schritte 1-6). "
+            f"Zitiere die massgebenden Erläuterungen wörtlich. "
+            f"Prüfe zuerst die Kapitel-Anmerkungen auf Ausschlüsse."
+        )}
+    ]
+
+
+def llm_error_result(e):
+    """Fehlerergebnis für einen fehlgeschlagenen Klassifikations-Aufruf."""
+    if isinstance(e, RateLimitError):
+        return {"error": str(e), "rate_limited": True, "retry_after": e.retry_after}
+    return {"error": f"LLM-Einreihung fehlgeschlagen: {e}"}
 
+
+def finalize_result(result, data_source, all_chapters, product_info, prompt_report=None):
+    """MWST-Korrektur und Metadaten – gemeinsamer Abschluss aller Pipelines."""
     # ── MWST deterministisch korrigieren (LLM vergisst oft Kap.-22-Regel) ──
     _apply_mwst(result)
 
@@ -893,6 +4043,19 @@ def classify_product(product_query):
     result["off_data_used"] = data_source == "off"
     result["web_search_used"] = data_source == "web"
     result["chapters_loaded"] = all_chapters
+    # Stand der verwendeten Kapitel – nach einem Korpus-Reload werden nur betroffene Ergebnisse verworfen
+    result["corpus_versions"] = (prompt_report or {}).get("corpus_versions") or CORPUS.versions(all_chapters)
+    result.setdefault("answered_by", "llm")
+    if result["answered_by"] == "llm":
+        result.setdefault("model", GROQ_MODEL)
+    if prompt_report:
+        result["prompt_tokens"] = prompt_report["prompt_tokens"]
+        if prompt_report.get("shortlist"):
+            result["shortlist"] = prompt_report["shortlist"]
+    calls = REQUEST_USAGE.get()
+    if calls:
+        result["usage"] = summarize_usage(calls)
+        GROQ_USAGE.record_request(result.get("chapter") or all_chapters[0], calls)
     if product_info:
         result["_off_product"] = {
             "name": product_info.get("name", ""),
@@ -900,17 +4063,366 @@ def classify_product(product_query):
             "ean": product_info.get("ean", ""),
             "source": product_info.get("source", "")
         }
-
     return result
 
 
+def _classify_uncached(product_query, deadline):
+    """Hauptpipeline für die Tarifierung."""
+    with collect_usage():  # Groq-Verbrauch → result["usage"]
+        # ── Schritt 1: Produktdaten ermitteln ──
+        # Alle Quellen parallel (OFF-Barcode/-Textvarianten, optional Web-Suche), OFF max. ENRICH_BUDGET (3s).
+        # Budget: REQUEST_DEADLINE (27s) < Render's 30s; was die Anreicherung nicht braucht, bekommt das LLM.
+        data_source = "none"
+        product_info = None
+        # Fast Path zuerst auf der reinen Anfrage (spart dann auch den OFF-Lookup)
+        with span("fast_path"):
+            fast = fast_path_classify(product_query)
+        if fast is None:
+            with span("off_lookup"):
+                product_info = enrich_product(product_query, deadline)
+            if product_info:
+                data_source = enrichment_data_source(product_info)
+                with span("fast_path"):
+                    fast = fast_path_classify(product_query, product_info)
+        FAST_PATH_STATS.record(fast)
+        if fast:
+            return finalize_result(fast, data_source, [fast["chapter"]], product_info)
+
+        # ── Schritte 2–4: Kapitel, Dokumente, Prompt ──
+        with span("chapters"):
+            primary_chapter, extra_chapters = detect_chapters(product_query, product_info)
+        shortlist = None
+        if CLASSIFY_MODE == "two_stage":
+            with span("shortlist"):
+                shortlist = shortlist_positions(product_query, product_info, primary_chapter, extra_chapters,
+                                                deadline)
+        if primary_chapter is None and shortlist is None:
+            with span("chapter_llm"):
+                primary_chapter, extra_chapters = guess_chapter_llm(product_query, product_info, deadline)
+        all_chapters, prompt, prompt_report = prepare_prompt(
+            product_query, product_info, data_source, primary_chapter, extra_chapters, shortlist)
+
+        # ── Schritt 5: LLM aufrufen ──
+        try:
+            with span("llm"):
+                result = call_groq(classification_messages(prompt, product_query), max_tokens=1000,
+                                   deadline=deadline, validate=is_valid_classification)
+        except Exception as e:
+            return llm_error_result(e)
+
+        return finalize_result(result, data_source, all_chapters, product_info, prompt_report)
+
+
+def prepare_prompt(product_query, product_info, data_source, primary_chapter, extra_chapters, shortlist=None):
+    """BAZG-Dokumente laden, Produktdaten-String und Prompt aufbauen (alle Pipelines).
+
+    Mit shortlist ((Kapitel, [Positionen]) aus shortlist_positions) wird der kompakte
+    Prompt der zweiten Stufe gebaut; Kapitel und Positionen kommen dann aus der Vorauswahl.
+    Gibt (all_chapters, prompt, prompt_report) zurück."""
+    positions = None
+    if shortlist:
+        primary_chapter, positions = shortlist
+        extra_chapters = sorted({int(code[:2]) for code in positions} - {primary_chapter})
+    all_chapters = [primary_chapter] + [c for c in extra_chapters if c != primary_chapter]
+    with span("docs"):
+        docs = get_chapter_docs(all_chapters)
+    with span("prompt"):
+        product_data_str = build_product_data_str(product_query, product_info, data_source)
+        if positions:
+            prompt, prompt_report = assemble_prompt(SUBPOSITION_AV_TEXT, docs, primary_chapter, extra_chapters,
+                                                    product_data_str, budget=TWO_STAGE_PROMPT_BUDGET,
+                                                    shortlist=positions, template=SUBPOSITION_PROMPT,
+                                                    caps=(SUBPOSITION_NOTES_TOKENS, SUBPOSITION_POSITION_TOKENS,
+                                                          SUBPOSITION_POSITION_TOKENS))
+            prompt_report["shortlist"] = positions
+        else:
+            prompt, prompt_report = assemble_prompt(AV_TEXT, docs, primary_chapter, extra_chapters, product_data_str,
+                                                    query=retrieval_query(product_query, product_info))
+    prompt_report["corpus_versions"] = {str(ch): docs[ch].version if ch in docs else "" for ch in all_chapters}
+    return all_chapters, prompt, prompt_report
+
+
+# ── Streaming-Klassifizierung (/classify/stream) ──
+def classify_events(product_query, deadline):
+    """Pipeline als Ereignisfolge für /classify/stream: Generator über (event, data).
+
+    off → chapters → token (LLM-Ausgabe, gestreamt) → result. result enthält dasselbe
+    Ergebnis wie /classify (validiertes JSON, MWST-Korrektur, Metadaten) und wird
+    ebenfalls im Ergebnis-Cache abgelegt; bei Cache-Treffer kommt nur result.
+    """
+    key = result_cache_key(product_query)
+    with span("cache"):
+        result = _cached_result(key)
+    if result is not None:
+        yield "result", result
+        return
+
+    with collect_usage():
+        data_source = "none"
+        product_info = None
+        with span("fast_path"):
+            fast = fast_path_classify(product_query)
+        if fast is None:
+            with span("off_lookup"):
+                product_info = enrich_product(product_query, deadline)
+            if product_info:
+                data_source = enrichment_data_source(product_info)
+                with span("fast_path"):
+                    fast = fast_path_classify(product_query, product_info)
+            yield "off", {"found": product_info is not None,
+                          "product": {k: product_info.get(k, "") for k in ("name", "brand", "ean", "source")}
+                          if product_info else None}
+        FAST_PATH_STATS.record(fast)
+        if fast:
+            yield "chapters", {"chapter": fast["chapter"], "chapters_loaded": [fast["chapter"]],
+                               "method": "fast_path"}
+            result = finalize_result(fast, data_source, [fast["chapter"]], product_info)
+            _store_result(key, result)
+            yield "result", result
+            return
+
+        with span("chapters"):
+            primary_chapter, extra_chapters = detect_chapters(product_query, product_info)
+        detected = primary_chapter is not None
+        shortlist = None
+        if CLASSIFY_MODE == "two_stage":
+            with span("shortlist"):
+                shortlist = shortlist_positions(product_query, product_info, primary_chapter, extra_chapters,
+                                                deadline)
+        if not detected and shortlist is None:
+            with span("chapter_llm"):
+                primary_chapter, extra_chapters = guess_chapter_llm(product_query, product_info, deadline)
+        all_chapters, prompt, prompt_report = prepare_prompt(
+            product_query, product_info, data_source, primary_chapter, extra_chapters, shortlist)
+        yield "chapters", {"chapter": all_chapters[0], "chapters_loaded": all_chapters,
+                           "method": "shortlist" if shortlist else "keywords" if detected else "llm",
+                           "prompt_tokens": prompt_report["prompt_tokens"],
+                           **({"shortlist": shortlist[1]} if shortlist else {})}
+
+        parts = []
+        try:
+            with span("llm"):
+                for delta in stream_groq(classification_messages(prompt, product_query), max_tokens=1000,
+                                         deadline=deadline):
+                    parts.append(delta)
+                    yield "token", {"text": delta}
+            result = finalize_result(_extract_json("".join(parts)), data_source, all_chapters,
+                                     product_info, prompt_report)
+        except Exception as e:
+            result = llm_error_result(e)
+        _store_result(key, result)
+        yield "result", result
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {app.json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def classify_sse_stream(product_query, deadline):
+    """Generator für /classify/stream: Server-Sent Events inkl. HTTP-Status im result."""
+    # Sofort ein erstes Ereignis → Time-to-first-byte unabhängig von OFF/Groq
+    yield _sse("start", {"product": product_query})
+    try:
+        for event, data in classify_events(product_query, deadline):
+            if event == "result":
+                payload, status = classify_response(data)
+                yield _sse("result" if status == 200 else "error", dict(payload, status=status))
+            else:
+                yield _sse(event, data)
+    except Exception as e:
+        payload, status = internal_error_response(e)
+        yield _sse("error", dict(payload, status=status))
+
+
+# ── Batch-Klassifizierung ──
+def _classify_with_backoff(product_query):
+    """classify_product, bei Rate-Limit nach retry_after erneut (Batches dürfen warten)."""
+    REQUEST_ROUTE.set("/classify/batch")  # Worker-Thread: Route für die Verbrauchsstatistik
+    for attempt in range(BATCH_RATE_LIMIT_RETRIES + 1):
+        result = classify_product(product_query)
+        if not result.get("rate_limited") or attempt == BATCH_RATE_LIMIT_RETRIES:
+            return result
+        time.sleep(result.get("retry_after", 60))
+
+
+def _ndjson(obj):
+    return app.json.dumps(obj, separators=(",", ":")) + "\n"
+
+
+def classify_batch_stream(queries):
+    """Generator für /classify/batch: eine NDJSON-Zeile pro Eingabe, sobald sie fertig ist.
+
+    Identische Anfragen (normalisiert) werden nur einmal klassifiziert; höchstens
+    BATCH_CONCURRENCY Pipelines laufen gleichzeitig. Die erste Zeile kommt sofort,
+    danach bei längerem Warten Heartbeat-Zeilen ohne "index".
+    """
+    groups = OrderedDict()   # normalisierte Anfrage → (Anfrage, [Indizes])
+    empty = []
+    for i, query in enumerate(queries):
+        if not query.strip():
+            empty.append(i)
+            continue
+        groups.setdefault(normalize_query(query), (query.strip(), []))[1].append(i)
+
+    yield _ndjson({"accepted": len(queries), "unique": len(groups)})
+    for i in empty:
+        yield _ndjson({"index": i, "status": 400, "result": {"error": "Kein Produkt angegeben"}})
+
+    pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+    try:
+        futures = {pool.submit(_classify_with_backoff, query): indices for query, indices in groups.values()}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=BATCH_HEARTBEAT, return_when=FIRST_COMPLETED)
+            if not done:
+                yield _ndjson({"heartbeat": True, "pending": len(pending)})
+                continue
+            for future in done:
+                try:
+                    payload, status = classify_response(future.result())
+                except Exception as e:
+                    payload, status = internal_error_response(e)
+                for i in futures[future]:
+                    yield _ndjson({"index": i, "status": status, "result": payload})
+    finally:
+        # Client weg → noch nicht gestartete Klassifizierungen verwerfen
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 # ── Flask Routes ──
 
+@app.before_request
+def _start_request_timing():
+    g.request_t0 = time.perf_counter()
+    g.request_timings = []
+    g.request_timings_token = REQUEST_TIMINGS.set(g.request_timings)
+    REQUEST_ROUTE.set(request.url_rule.rule if request.url_rule else None)
+
+
+@app.after_request
+def _finish_request_timing(response):
+    """Server-Timing-Header und Histogramm tarif_request_seconds.
+
+    Bei gestreamten Antworten (/classify/stream, /classify/batch) stehen hier erst die
+    Spans bis zum Beginn der Antwort fest; die Histogramme erfassen trotzdem alles.
+    """
+    t0 = g.pop("request_t0", None)
+    if t0 is None:
+        return response
+    elapsed = time.perf_counter() - t0
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    METRICS.observe("tarif_request_seconds", (("route", route),), elapsed)
+    response.headers["Server-Timing"] = server_timing_header(g.request_timings, elapsed)
+    return response
+
+
+@app.teardown_request
+def _reset_request_timing(exc):
+    token = g.pop("request_timings_token", None)
+    if token is not None:
+        try:
+            REQUEST_TIMINGS.reset(token)
+        except ValueError:  # anderer Kontext (z.B. Teardown nach gestreamter Antwort)
+            REQUEST_TIMINGS.set(None)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "ok", "service": "Tarifierungstool Backend", "version": "1ab8664"})
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Laufzeit-Kennzahlen (Korpus-Index, Caches, ...)."""
+    return jsonify({
+        "corpus": CORPUS.stats(),
+        "result_cache": RESULT_CACHE.stats(),
+        "similar_queries": SIMILAR_QUERIES.stats(),
+        "result_store": RESULT_STORE.stats(),
+        "enrichment_cache": ENRICH_CACHE.stats(),
+        "enrichment_fanout": ENRICH_FANOUT.stats(),
+        "off_index": OFF_INDEX.stats(),
+        "http_pools": {origin: pool.stats() for origin, pool in HTTP_POOLS.items()},
+        "async_http_pools": {origin: pool.stats() for origin, pool in ASYNC_HTTP_POOLS.items()},
+        "groq_limiter": {model: limiter.stats() for model, limiter in GROQ_LIMITERS.items()},
+        "groq_usage": GROQ_USAGE.stats(),
+        "groq_hedging": GROQ_HEDGER.stats(),
+        "token_estimator": TOKEN_ESTIMATOR.stats(),
+        "position_index": POSITION_INDEX.stats(),
+        "corpus_reload": CORPUS_RELOADER.stats(),
+        "prompt_prefix_cache": PROMPT_PREFIX_CACHE.stats(),
+        "fast_path": FAST_PATH_STATS.stats(),
+    })
+
+
+@app.route('/usage', methods=['GET'])
+def usage():
+    """Groq-Verbrauch: rollierende TPM/RPM pro Modell, Summen pro Modell, Zweck, Route, Kapitel."""
+    return jsonify(GROQ_USAGE.report())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus-Histogramme: Anfragen, Pipeline-Stufen, Upstream-Aufrufe."""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+def admin_authorized():
+    """/admin/* nur mit "Authorization: Bearer <ADMIN_TOKEN>"; ohne ADMIN_TOKEN gesperrt."""
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+@app.route('/admin/results', methods=['GET'])
+def admin_export_results():
+    """Export des Ergebnis-Speichers als NDJSON (?model=…&limit=…)."""
+    if not admin_authorized():
+        return jsonify({"error": "Nicht autorisiert"}), 401
+    if not RESULT_STORE.enabled:
+        return jsonify({"error": "Ergebnis-Speicher nicht aktiv (RESULT_STORE_PATH)"}), 404
+    limit = request.args.get("limit", "")
+    if limit and not limit.isdigit():
+        return jsonify({"error": "limit muss eine positive Zahl sein"}), 400
+    RESULT_STORE.flush()
+    rows = RESULT_STORE.export(model=request.args.get("model"), limit=int(limit) if limit else None)
+    return Response((json.dumps(row, ensure_ascii=False) + "\n" for row in rows), mimetype="application/x-ndjson")
+
+
+@app.route('/admin/results/prune', methods=['POST'])
+def admin_prune_results():
+    """Einträge löschen: {"older_than_days": 30} und/oder {"stale": true} (anderes Modell als
+    das laufende oder Kapitel, die seither neu geladen wurden)."""
+    if not admin_authorized():
+        return jsonify({"error": "Nicht autorisiert"}), 401
+    if not RESULT_STORE.enabled:
+        return jsonify({"error": "Ergebnis-Speicher nicht aktiv (RESULT_STORE_PATH)"}), 404
+    data = request.get_json(silent=True) or {}
+    days = data.get("older_than_days")
+    stale = data.get("stale") is True
+    if days is not None and (isinstance(days, bool) or not isinstance(days, (int, float)) or days < 0):
+        return jsonify({"error": "older_than_days muss eine Zahl >= 0 sein"}), 400
+    if days is None and not stale:
+        return jsonify({"error": 'Kein Kriterium angegeben ("older_than_days" und/oder "stale": true)'}), 400
+    RESULT_STORE.flush()
+    deleted = RESULT_STORE.prune(older_than=days * 86400 if days is not None else None,
+                                 stale_for=classification_model() if stale else None)
+    return jsonify({"deleted": deleted, "result_store": RESULT_STORE.stats()})
+
+
+@app.route('/admin/corpus/reload', methods=['POST'])
+def admin_reload_corpus():
+    """Geänderte erl/anm-Dateien sofort übernehmen (nur dieser Worker; die übrigen beim
+    nächsten Durchlauf ihres Watchers, CORPUS_WATCH_INTERVAL)."""
+    if not admin_authorized():
+        return jsonify({"error": "Nicht autorisiert"}), 401
+    try:
+        changed = CORPUS_RELOADER.reload()
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"Reload fehlgeschlagen: {e}"}), 500
+    return jsonify({"changed_chapters": changed, "corpus": CORPUS.stats(),
+                    "corpus_reload": CORPUS_RELOADER.stats()})
+
+
 @app.route('/ping', methods=['GET', 'POST'])
 def ping():
     import sys
@@ -926,7 +4438,7 @@ def test_groq():
         try:
             _call_groq_model(GROQ_MODEL, [
                 {"role": "user", "content": 'Antworte: {"ok": true}'}
-            ], max_tokens=tokens, temperature=0)
+            ], max_tokens=tokens, temperature=0, purpose="test")
             results[f"tiny_prompt_tokens_{tokens}"] = "ok"
         except urllib.error.HTTPError as e:
             results[f"tiny_prompt_tokens_{tokens}"] = f"HTTPError {e.code}"
@@ -938,7 +4450,7 @@ def test_groq():
         _call_groq_model(GROQ_MODEL, [
             {"role": "system", "content": big_sys},
             {"role": "user", "content": 'Antworte: {"ok": true}'}
-        ], max_tokens=2000, temperature=0)
+        ], max_tokens=2000, temperature=0, purpose="test")
         results["large_prompt_2000"] = "ok"
     except urllib.error.HTTPError as e:
         results["large_prompt_2000"] = f"HTTPError {e.code}"
@@ -947,33 +4459,81 @@ def test_groq():
     return jsonify(results)
 
 
-@app.route('/classify', methods=['POST'])
-def classify():
-    try:
-        if not GROQ_API_KEY:
-            return jsonify({"error": "GROQ_API_KEY nicht konfiguriert"}), 500
+def parse_classify_request(data):
+    """Validiert den /classify-Body. Gibt (product_query, None) oder (None, (payload, status)) zurück."""
+    if not GROQ_API_KEY:
+        return None, ({"error": "GROQ_API_KEY nicht konfiguriert"}, 500)
+    if not data or not data.get("product", "").strip():
+        return None, ({"error": "Kein Produkt angegeben"}, 400)
+    return data["product"].strip(), None
 
-        data = request.get_json()
-        if not data or not data.get("product", "").strip():
-            return jsonify({"error": "Kein Produkt angegeben"}), 400
 
-        product_query = data["product"].strip()
-        result = classify_product(product_query)
+def classify_response(result):
+    """(payload, status) für ein classify_product-Ergebnis."""
+    if not isinstance(result, dict):
+        return {"error": f"Unerwarteter Ergebnistyp: {type(result)}"}, 500
+    if result.get("rate_limited"):
+        return result, 429
+    if "error" in result:
+        return result, 500
+    return result, 200
+
 
-        if not isinstance(result, dict):
-            return jsonify({"error": f"Unerwarteter Ergebnistyp: {type(result)}"}), 500
+def internal_error_response(e):
+    import traceback
+    tb = traceback.format_exc()
+    return {"error": f"Interner Fehler: {type(e).__name__}: {e}", "traceback": tb}, 500
 
-        if result.get("rate_limited"):
-            return jsonify(result), 429
 
-        if "error" in result:
-            return jsonify(result), 500
+@app.route('/classify', methods=['POST'])
+def classify():
+    # Zeitbudget beginnt bei Annahme der Anfrage
+    deadline = Deadline(REQUEST_DEADLINE)
+    try:
+        product_query, error = parse_classify_request(request.get_json())
+        if error:
+            return jsonify(error[0]), error[1]
 
-        return jsonify(result)
+        payload, status = classify_response(classify_product(product_query, deadline))
+        return jsonify(payload), status
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        return jsonify({"error": f"Interner Fehler: {type(e).__name__}: {e}", "traceback": tb}), 500
+        payload, status = internal_error_response(e)
+        return jsonify(payload), status
+
+
+@app.route('/classify/stream', methods=['GET', 'POST'])
+def classify_stream():
+    """Wie /classify, aber als Server-Sent Events (start, off, chapters, token…, result|error).
+    GET ?product=... für EventSource im Browser, POST mit demselben Body wie /classify."""
+    deadline = Deadline(REQUEST_DEADLINE)
+    data = request.args if request.method == 'GET' else request.get_json(silent=True)
+    product_query, error = parse_classify_request(data)
+    if error:
+        return jsonify(error[0]), error[1]
+    return Response(classify_sse_stream(product_query, deadline), mimetype="text/event-stream",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """Batch-Tarifierung: {"products": ["...", {"product": "..."}, ...]} → NDJSON-Stream."""
+    if not GROQ_API_KEY:
+        return jsonify({"error": "GROQ_API_KEY nicht konfiguriert"}), 500
+    data = request.get_json(silent=True) or {}
+    products = data.get("products") if isinstance(data, dict) else None
+    if not isinstance(products, list) or not products:
+        return jsonify({"error": 'Keine Produkte angegeben ("products": [...])'}), 400
+    if len(products) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Zu viele Produkte ({len(products)} > {BATCH_MAX_ITEMS})"}), 400
+
+    queries = []
+    for p in products:
+        if isinstance(p, dict):
+            p = p.get("product", "")
+        queries.append(p if isinstance(p, str) else "")
+
+    return Response(classify_batch_stream(queries), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Tarifierungstool Backend – ASGI-Einstiegspunkt (asyncio).
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+POST /classify läuft nativ asynchron: OFF-Lookups und Groq-Aufrufe warten auf dem
+Event-Loop statt einen Worker zu blockieren, ein Prozess hält so viele parallele
+Klassifizierungen. Alle anderen Routen (/health, /stats, ...) gehen unverändert an die
+Flask-App (WSGI im eigenen Threadpool, ASGI_WSGI_THREADS). Antworten haben dieselbe JSON-Struktur wie unter gunicorn.
+"""
+import asyncio, http.client, io, json, os, ssl, time, urllib.error, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as backend
+
+
+# ── Async HTTP-Client mit Verbindungspool ──
+class AsyncHTTPPool:
+    """Keep-Alive-Verbindungspool für einen Upstream-Host auf dem Event-Loop (HTTP/1.1).
+
+    Gegenstück zu app.HTTPPool; der Timeout gilt für den gesamten Request.
+    """
+
+    def __init__(self, scheme, host, port, maxsize=backend.HTTP_POOL_SIZE, ssl_context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.ssl_context = ssl_context
+        self._idle = []
+        self.opened = 0
+        self.reused = 0
+        self.requests = 0
+        self.discarded = 0
+
+    async def _acquire(self):
+        self.requests += 1
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            self.reused += 1
+            return reader, writer, True
+        self.opened += 1
+        if self.scheme == "https":
+            context = self.ssl_context or ssl.create_default_context()
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, ssl=context, server_hostname=self.host)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    def _release(self, reader, writer):
+        if len(self._idle) < self.maxsize:
+            self._idle.append((reader, writer))
+        else:
+            self.discarded += 1
+            writer.close()
+
+    def _host_header(self):
+        default_port = 443 if self.scheme == "https" else 80
+        return self.host if self.port == default_port else f"{self.host}:{self.port}"
+
+    async def _exchange(self, reader, writer, method, path, body, headers):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self._host_header()}", "Accept-Encoding: identity"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+        raw_headers = b""
+        while True:
+            line = await reader.readline()
+            raw_headers += line
+            if line in (b"\r\n", b"\n", b""):
+                break
+        resp_headers = http.client.parse_headers(io.BytesIO(raw_headers))
+
+        if resp_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif resp_headers.get("Content-Length") is not None:
+            data = await reader.readexactly(int(resp_headers["Content-Length"]))
+        else:
+            data = await reader.read()
+
+        keep_alive = (version == "HTTP/1.1"
+                      and resp_headers.get("Connection", "").lower() != "close"
+                      and not reader.at_eof())
+        return backend.PooledResponse(int(status), reason, resp_headers, data), keep_alive
+
+    async def request(self, method, path, body=None, headers=None, timeout=10):
+        async with asyncio.timeout(timeout):
+            for attempt in range(2):
+                reader, writer, reused = await self._acquire()
+                try:
+                    resp, keep_alive = await self._exchange(reader, writer, method, path, body, headers)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                        asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    # Auch bei Timeout/Cancel: halb gelesene Verbindung nie zurückgeben
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._release(reader, writer)
+                else:
+                    writer.close()
+                return resp
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "opened": self.opened,
+            "reused": self.reused,
+            "idle": len(self._idle),
+            "maxsize": self.maxsize,
+            "discarded": self.discarded,
+        }
+
+
+ASYNC_HTTP_POOLS = backend.ASYNC_HTTP_POOLS
+
+
+def get_async_http_pool(url):
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    origin = f"{parts.scheme}://{parts.hostname}:{port}"
+    pool = ASYNC_HTTP_POOLS.get(origin)
+    if pool is None:
+        pool = ASYNC_HTTP_POOLS[origin] = AsyncHTTPPool(parts.scheme, parts.hostname, port)
+    return pool
+
+
+async def async_http_request(url, data=None, headers=None, timeout=10, method=None):
+    """Async-Gegenstück zu app.http_request (HTTP-Status >= 400 → urllib.error.HTTPError)."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    method = method or ("POST" if data is not None else "GET")
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        resp = await get_async_http_pool(url).request(method, path, body=data, headers=headers, timeout=timeout)
+        status = resp.status
+    finally:
+        backend.observe_upstream(url, status, time.perf_counter() - t0)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(resp.data))
+    return resp
+
+
+# ── Open Food Facts (async) ──
+async def off_by_barcode_async(ean, timeout=2):
+    product = backend.OFF_INDEX.get(ean)
+    if product:
+        return product
+
+    async def fetch():
+        resp = await async_http_request(backend._off_barcode_url(ean),
+                                        headers={"User-Agent": "Tarifierungstool/4.0"}, timeout=timeout)
+        return backend._parse_off_barcode(resp.json(), ean)
+
+    return await backend.ENRICH_CACHE.lookup_async("off_barcode", ean, fetch, backend.ENRICH_TTL_BARCODE)
+
+
+async def off_search_async(query, timeout=2):
+    async def fetch():
+        resp = await async_http_request(backend._off_search_url(query),
+                                        headers={"User-Agent": "Tarifierungstool/4.0"}, timeout=timeout)
+        return backend._parse_off_search(resp.json())
+
+    return await backend.ENRICH_CACHE.lookup_async(
+        "off_search", backend.normalize_query(query), fetch, backend.ENRICH_TTL_TEXT)
+
+
+async def web_search_async(query, timeout):
+    """Web-Suche im Threadpool (kein async-Client für Groq Compound); Cancel schliesst den Socket."""
+    cancel = backend.Cancellation()
+    try:
+        return await asyncio.to_thread(backend.web_search_product, query, timeout, cancel)
+    except asyncio.CancelledError:
+        cancel.cancel()
+        raise
+
+
+def _enrichment_fetch(source, arg, timeout):
+    if source == "off_barcode":
+        return off_by_barcode_async(arg, timeout=min(timeout, 2))
+    if source == "off_search":
+        return off_search_async(arg, timeout=timeout)
+    return web_search_async(arg, timeout)
+
+
+async def enrich_product_async(query, deadline=None):
+    """Async-Gegenstück zu app.EnrichmentFanout.enrich: offene Quellen werden per cancel() beendet."""
+    try:
+        sources = [(source, arg, backend.enrichment_budget(source, deadline))
+                   for source, arg in backend.enrichment_sources(query)]
+    except TimeoutError:
+        return None
+    t0 = time.monotonic()
+    end = t0 + max(budget for _, _, budget in sources)
+    running = {asyncio.ensure_future(_enrichment_fetch(source, arg, budget)): (rank, source)
+               for rank, (source, arg, budget) in enumerate(sources)}
+    best = None   # (Qualität, -Rang, Quelle, Produkt)
+    try:
+        while running and not (best and best[0] >= backend.ENRICH_GOOD_QUALITY):
+            done, _ = await asyncio.wait(running, timeout=max(0.0, end - time.monotonic()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                rank, source = running.pop(task)
+                try:
+                    product = task.result()
+                except Exception:
+                    continue
+                quality = backend.enrichment_quality(product)
+                if quality and (best is None or (quality, -rank) > best[:2]):
+                    best = (quality, -rank, source, product)
+    finally:
+        for task in running:
+            task.cancel()
+    backend.ENRICH_FANOUT.record(best[2] if best else None,
+                                 bool(running) and best is not None and best[0] >= backend.ENRICH_GOOD_QUALITY,
+                                 len(running), time.monotonic() - t0, time.monotonic() >= end)
+    return best[3] if best else None
+
+
+# ── Groq (async) ──
+async def _call_groq_model_async(model, messages, max_tokens, temperature, deadline=None, purpose="classify",
+                                 max_wait=None):
+    """Single Groq API call; total cap = what is left of the request deadline."""
+    payload, headers = backend._groq_request(model, messages, max_tokens, temperature)
+    deadline = deadline or backend.Deadline(backend.GROQ_TIMEOUT)
+    limiter = backend.groq_limiter(model)
+    prompt_tokens = backend.estimate_prompt_tokens(messages)
+    cost = prompt_tokens + max_tokens
+    try:
+        with backend.span("groq_queue"):
+            await limiter.acquire_async(cost, backend._limiter_max_wait(deadline) if max_wait is None else max_wait)
+    except asyncio.CancelledError:   # Rennen entschieden, während der Aufruf noch in der Queue wartete
+        limiter.settle(cost, usage={"total_tokens": 0})
+        raise
+    timeout = deadline.timeout()
+    t0 = time.perf_counter()
+    try:
+        resp = await async_http_request(backend.GROQ_URL, data=payload, headers=headers, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        limiter.settle(cost, headers=e.headers, rate_limited=backend._is_rate_limit_error(e))
+        raise
+    except asyncio.CancelledError:
+        backend._book_cancelled_call(limiter, cost, model, purpose, prompt_tokens)
+        raise
+    except TimeoutError as e:
+        backend._book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise TimeoutError(f"Groq-Anfrage nach {timeout:.0f}s abgebrochen (Render-Limit)")
+    except Exception as e:
+        backend._book_failed_call(limiter, cost, model, purpose, prompt_tokens, e)
+        raise
+    backend.GROQ_HEDGER.observe(model, time.perf_counter() - t0)
+    data = resp.json()
+    limiter.settle(cost, usage=data.get("usage"), headers=resp.headers)
+    backend.TOKEN_ESTIMATOR.observe(messages, data.get("usage"))
+    backend.GROQ_USAGE.record(model, purpose, data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
+    return backend._extract_json(content)
+
+
+async def _call_groq_hedged_async(messages, max_tokens, temperature, deadline, purpose, validate):
+    """Async-Gegenstück zu app.GroqHedger.call: der Verlierer-Task wird per cancel() beendet."""
+    hedger = backend.GROQ_HEDGER
+    primary = backend.GROQ_MODEL
+    deadline = deadline or backend.Deadline(backend.GROQ_TIMEOUT)
+    if not hedger.model or hedger.model == primary:
+        try:
+            result = await _call_groq_model_async(primary, messages, max_tokens, temperature, deadline, purpose)
+        except Exception as e:
+            return hedger.finish(None, {primary: e}, False, 0)
+        return hedger.finish((primary, result), {}, False, 0)
+
+    running = {asyncio.ensure_future(
+        _call_groq_model_async(primary, messages, max_tokens, temperature, deadline, purpose)): primary}
+    hedge_at = time.monotonic() + hedger.delay(primary)
+    hedge_pending, hedged = True, False
+    winner, invalid, errors = None, None, {}
+    try:
+        while running and winner is None and not backend._is_rate_limited(errors.get(primary)):
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_pending else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    errors[model] = e
+                    continue
+                if winner is None and validate(result):
+                    winner = (model, result)
+                elif invalid is None:
+                    invalid = (model, result)
+            if primary in errors:
+                hedge_pending = False   # früher Fehler ist keine Langsamkeit
+            if winner is None and hedge_pending and time.monotonic() >= hedge_at:
+                hedge_pending = False
+                if deadline.remaining() > backend.GROQ_MIN_CALL_SECONDS:
+                    hedged = True
+                    running[asyncio.ensure_future(_call_groq_model_async(
+                        hedger.model, messages, max_tokens, temperature, deadline, "hedge", max_wait=0))] = hedger.model
+    finally:
+        for task in running:
+            task.cancel()
+    if backend._is_rate_limited(errors.get(primary)):
+        return hedger.finish(None, errors, hedged, len(running))
+    return hedger.finish(winner or invalid, errors, hedged, len(running))
+
+
+async def call_groq_async(messages, max_tokens=2000, temperature=0.1, deadline=None, purpose="classify",
+                          validate=None):
+    try:
+        if validate is not None:
+            return await _call_groq_hedged_async(messages, max_tokens, temperature, deadline, purpose, validate)
+        return await _call_groq_model_async(backend.GROQ_MODEL, messages, max_tokens, temperature, deadline,
+                                            purpose)
+    except urllib.error.HTTPError as e:
+        raise backend._groq_http_error(e)
+
+
+async def guess_chapter_llm_async(query, product_info, deadline=None):
+    try:
+        timeout = deadline.timeout(backend.GUESS_CHAPTER_TIMEOUT) if deadline else backend.GUESS_CHAPTER_TIMEOUT
+        ch_result = await call_groq_async(backend._guess_chapter_messages(query, product_info), max_tokens=300,
+                                          deadline=backend.Deadline(timeout), purpose="guess_chapter")
+        return ch_result.get("chapter", 22), ch_result.get("also_check", [])
+    except Exception:
+        return 22, []
+
+
+async def shortlist_positions_async(query, product_info, primary, extra, deadline=None):
+    chapters = backend.shortlist_chapters(query, product_info, primary, extra)
+    if not chapters:
+        return None
+    try:
+        timeout = deadline.timeout(backend.SHORTLIST_TIMEOUT) if deadline else backend.SHORTLIST_TIMEOUT
+        result = await _call_groq_model_async(backend.SHORTLIST_MODEL,
+                                              backend._shortlist_messages(query, product_info, chapters),
+                                              max_tokens=200, temperature=0, deadline=backend.Deadline(timeout),
+                                              purpose="shortlist")
+    except Exception:
+        return None
+    return backend.parse_shortlist(result, chapters)
+
+
+# ── Pipeline (async) ──
+async def classify_product_async(product_query, deadline=None):
+    """Async-Variante von app.classify_product (teilt Ergebnis-Cache und Pipeline-Schritte)."""
+    key = backend.result_cache_key(product_query)
+    with backend.span("cache"):
+        # SQLite-Lookup (RESULT_STORE) und ggf. Start des Korpus-Watchers nicht auf dem Event-Loop
+        result = await asyncio.to_thread(backend._cached_result, key)
+    if result is None:
+        result = await _classify_uncached_async(product_query, deadline or backend.Deadline(backend.REQUEST_DEADLINE))
+        backend._store_result(key, result)
+    return result
+
+
+async def _classify_uncached_async(product_query, deadline):
+    with backend.collect_usage():
+        data_source = "none"
+        product_info = None
+        with backend.span("fast_path"):
+            fast = backend.fast_path_classify(product_query)
+        if fast is None:
+            with backend.span("off_lookup"):
+                product_info = await enrich_product_async(product_query, deadline)
+            if product_info:
+                data_source = backend.enrichment_data_source(product_info)
+                with backend.span("fast_path"):
+                    fast = backend.fast_path_classify(product_query, product_info)
+        backend.FAST_PATH_STATS.record(fast)
+        if fast:
+            return backend.finalize_result(fast, data_source, [fast["chapter"]], product_info)
+
+        with backend.span("chapters"):
+            primary_chapter, extra_chapters = backend.detect_chapters(product_query, product_info)
+        shortlist = None
+        if backend.CLASSIFY_MODE == "two_stage":
+            with backend.span("shortlist"):
+                shortlist = await shortlist_positions_async(product_query, product_info, primary_chapter,
+                                                            extra_chapters, deadline)
+        if primary_chapter is None and shortlist is None:
+            with backend.span("chapter_llm"):
+                primary_chapter, extra_chapters = await guess_chapter_llm_async(product_query, product_info, deadline)
+
+        # BM25 und Prompt-Aufbau blockieren, also im Thread (Kontext mit Spans wird mitkopiert)
+        all_chapters, prompt, prompt_report = await asyncio.to_thread(
+            backend.prepare_prompt, product_query, product_info, data_source, primary_chapter, extra_chapters,
+            shortlist)
+
+        try:
+            with backend.span("llm"):
+                result = await call_groq_async(backend.classification_messages(prompt, product_query),
+                                               max_tokens=1000, deadline=deadline,
+                                               validate=backend.is_valid_classification)
+        except Exception as e:
+            return backend.llm_error_result(e)
+
+        return backend.finalize_result(result, data_source, all_chapters, product_info, prompt_report)
+
+
+# ── ASGI-App ──
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, payload, status, extra_headers=()):
+    # Gleiche Serialisierung wie Flask jsonify()
+    body = (backend.app.json.dumps(payload, separators=(",", ":")) + "\n").encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*"),
+        *extra_headers,
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def classify(scope, receive, send):
+    deadline = backend.Deadline(backend.REQUEST_DEADLINE)
+    t0 = time.perf_counter()
+    timings = []
+    backend.REQUEST_TIMINGS.set(timings)  # eigener Kontext pro ASGI-Task
+    backend.REQUEST_ROUTE.set("/classify")
+
+    def timing_headers():
+        elapsed = time.perf_counter() - t0
+        backend.METRICS.observe("tarif_request_seconds", (("route", "/classify"),), elapsed)
+        return [(b"server-timing", backend.server_timing_header(timings, elapsed).encode())]
+
+    try:
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except ValueError:
+            data = None
+        product_query, error = backend.parse_classify_request(data if isinstance(data, dict) else None)
+        if error:
+            return await _send_json(send, *error, timing_headers())
+        payload, status = backend.classify_response(await classify_product_async(product_query, deadline))
+        await _send_json(send, payload, status, timing_headers())
+    except Exception as e:
+        await _send_json(send, *backend.internal_error_response(e), timing_headers())
+
+
+ASYNC_ROUTES = {
+    ("POST", "/classify"): classify,
+}
+
+# Threads für die Flask-Routen; lange Streams/Batches belegen je einen
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "32"))
+WSGI_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class _ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref führt die WSGI-App mit thread_sensitive=True aus: alle Flask-Routen teilen sich
+    # einen Thread, ein langer /classify/stream oder /classify/batch blockiert dann /health
+    async def run_wsgi_app(self, body):
+        await sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False,
+                            executor=WSGI_EXECUTOR)(self, body)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi, bei dem jede Anfrage in einem eigenen Thread aus WSGI_EXECUTOR läuft."""
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_asgi = ThreadedWsgiToAsgi(backend.app)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for pool in ASYNC_HTTP_POOLS.values():
+                    pool.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    handler = ASYNC_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler:
+        return await handler(scope, receive, send)
+    return await flask_asgi(scope, receive, send)
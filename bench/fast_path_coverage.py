@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Misst, welchen Anteil eines Query-Logs der regelbasierte Fast Path beantworten würde.
+
+Eingabe: eine Anfrage pro Zeile (Text) oder NDJSON mit {"product": "..."}. Geprüft wird
+nur die Anfrage selbst (ohne OFF-Lookup), also eine untere Schranke für den Live-Betrieb –
+Getränkeregeln brauchen OFF-Kategorien und greifen hier nie.
+
+    python bench/fast_path_coverage.py queries.txt [--show-misses 20]
+"""
+import argparse, json, os, sys, time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import FAST_PATH_RULES, fast_path_classify  # noqa: E402
+
+
+def read_queries(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    line = json.loads(line).get("product", "")
+                except json.JSONDecodeError:
+                    pass
+            if line:
+                yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast-Path-Abdeckung auf einem Query-Log")
+    parser.add_argument("log", help="Query-Log (Text oder NDJSON)")
+    parser.add_argument("--show-misses", type=int, default=0, metavar="N",
+                        help="die N häufigsten nicht abgedeckten Anfragen ausgeben")
+    args = parser.parse_args()
+
+    queries = list(read_queries(args.log))
+    by_rule = Counter()
+    misses = Counter()
+    t0 = time.perf_counter()
+    for query in queries:
+        result = fast_path_classify(query)
+        if result:
+            by_rule[result["fast_path_rule"]] += 1
+        else:
+            misses[query.lower()] += 1
+    elapsed = time.perf_counter() - t0
+
+    answered = sum(by_rule.values())
+    print(json.dumps({
+        "queries": len(queries),
+        "answered": answered,
+        "coverage": round(answered / len(queries), 3) if queries else 0.0,
+        "by_rule": {rule["id"]: by_rule[rule["id"]] for rule in FAST_PATH_RULES},
+        "avg_us": round(elapsed / len(queries) * 1e6, 1) if queries else 0.0,
+    }, ensure_ascii=False))
+    for query, count in misses.most_common(args.show_misses):
+        print(f"{count:6d}  {query}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Lasttest für /classify gegen lokale Groq-/OFF-Stand-ins (kein echtes Groq-Kontingent).
+
+    python bench/load_test.py                                  # alle Szenarien
+    python bench/load_test.py --scenario gthread --concurrency 20 --requests 200
+    python bench/load_test.py --save bench/baseline.json       # neue Baseline schreiben
+    python bench/load_test.py --compare bench/baseline.json    # gegen Baseline vergleichen
+
+Pro Szenario wird der Server (Modus aus serving_modes.MODES) mit abgeschaltetem
+Ergebnis-Cache und Fast Path gestartet, /classify mit fester Parallelität angesteuert und
+ausgegeben: Latenz p50/p95/p99/max, Anfragen pro Sekunde, Statuscodes sowie eine
+Aufschlüsselung pro Anfrage in OFF, Groq (Bedienzeit der Stand-ins), Wartezeit im
+Groq-Limiter und den Rest (App: Kapitel, Retrieval, Prompt, JSON). Zusätzlich werden die
+Server-Timing-Header der Antworten pro Stufe gemittelt (server_timing_ms).
+"""
+import argparse, json, os, sys, time, urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serving_modes import MODES, PIPELINE_ENV, serve
+from stubs import StubServer
+
+SCENARIOS = {
+    "gthread": {"mode": "gthread (gunicorn, 1 worker, 8 threads)", "concurrency": 8, "requests": 80,
+                "groq_latency": 1.0, "off_latency": 0.1, "jitter": 0.3, "rate_limit_ratio": 0.0},
+    "asgi": {"mode": "asgi (uvicorn)", "concurrency": 8, "requests": 80,
+             "groq_latency": 1.0, "off_latency": 0.1, "jitter": 0.3, "rate_limit_ratio": 0.0},
+    "gthread-429": {"mode": "gthread (gunicorn, 1 worker, 8 threads)", "concurrency": 8, "requests": 80,
+                    "groq_latency": 1.0, "off_latency": 0.1, "jitter": 0.3, "rate_limit_ratio": 0.1},
+    # 10 % der Aufrufe des Primärmodells hängen 10 s; mit und ohne Hedging auf das schnelle Modell
+    "gthread-tail": {"mode": "gthread (gunicorn, 1 worker, 8 threads)", "concurrency": 8, "requests": 80,
+                     "groq_latency": 1.0, "off_latency": 0.1, "jitter": 0.3, "rate_limit_ratio": 0.0,
+                     "tail_ratio": 0.1, "tail_latency": 10.0, "env": {"GROQ_HEDGE_MODEL": ""}},
+    "gthread-tail-hedge": {"mode": "gthread (gunicorn, 1 worker, 8 threads)", "concurrency": 8, "requests": 80,
+                           "groq_latency": 1.0, "off_latency": 0.1, "jitter": 0.3, "rate_limit_ratio": 0.0,
+                           "tail_ratio": 0.1, "tail_latency": 10.0, "hedge_latency": 0.4,
+                           "env": {"GROQ_HEDGE_MODEL": "llama-3.1-8b-instant"}},
+}
+
+# Gemischte Anfragen über mehrere Kapitel (Kapitel per Schlüsselwort erkannt, kein Fallback-Aufruf)
+QUERIES = [
+    "Apfelsaft naturtrüb 1l", "Milchschokolade 100g", "Gruyère AOP 250g", "Spaghetti 500g",
+    "Eistee Pfirsich 1.5l", "Olivenöl extra vergine", "Kaffee Bohnen 500g", "Rotwein Rioja 75cl",
+    "Tomatenmark 200g", "Honig 500g", "Basmati Reis 1kg", "Butter 250g",
+]
+
+RATE_LIMIT_RETRY_AFTER = 1  # Sekunden; kurz, damit der Limiter die Sperre im Test wieder aufhebt
+
+
+def _classify(base, product):
+    t0 = time.perf_counter()
+    req = urllib.request.Request(base + "/classify", data=json.dumps({"product": product}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            resp.read()
+            status, headers = resp.status, resp.headers
+    except urllib.error.HTTPError as e:
+        e.read()
+        status, headers = e.code, e.headers
+    return time.perf_counter() - t0, status, _parse_server_timing(headers.get("Server-Timing", ""))
+
+
+def _parse_server_timing(value):
+    """'off_lookup;dur=52.1, llm;dur=990.0' → {"off_lookup": 52.1, "llm": 990.0}"""
+    spans = {}
+    for part in value.split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.startswith("dur="):
+            spans[name] = float(params[4:])
+    return spans
+
+
+def _limiter_wait_seconds(base):
+    """Summierte Wartezeit im Groq-Limiter (alle Modelle) laut /stats."""
+    with urllib.request.urlopen(base + "/stats", timeout=10) as resp:
+        limiters = json.loads(resp.read()).get("groq_limiter", {})
+    return sum(s["waits"] * s["avg_wait_ms"] / 1000 for s in limiters.values())
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_scenario(scenario):
+    env = {**os.environ, **PIPELINE_ENV, **scenario.get("env", {})}
+    model_latency = {}
+    if scenario.get("hedge_latency") and env.get("GROQ_HEDGE_MODEL"):
+        model_latency[env["GROQ_HEDGE_MODEL"]] = scenario["hedge_latency"]
+    stub = StubServer(scenario["groq_latency"], scenario["off_latency"], jitter=scenario["jitter"],
+                      rate_limit_ratio=scenario["rate_limit_ratio"], retry_after=RATE_LIMIT_RETRY_AFTER,
+                      seed=1, model_latency=model_latency, tail_ratio=scenario.get("tail_ratio", 0.0),
+                      tail_latency=scenario.get("tail_latency", 0.0)).start()
+    env.update(stub.env())
+    try:
+        with serve(MODES[scenario["mode"]], env) as base:
+            _classify(base, "Aufwärmen")
+            stub.reset()
+            wait_before = _limiter_wait_seconds(base)
+            requests = scenario["requests"]
+            with ThreadPoolExecutor(scenario["concurrency"]) as pool:
+                t0 = time.perf_counter()
+                futures = [pool.submit(_classify, base, f"{QUERIES[i % len(QUERIES)]} #{i}")
+                           for i in range(requests)]
+                results = [f.result() for f in futures]
+                elapsed = time.perf_counter() - t0
+            queue_seconds = _limiter_wait_seconds(base) - wait_before
+        upstream = stub.stats()
+    finally:
+        stub.stop()
+
+    latencies = sorted(latency for latency, _, _ in results)
+    statuses = {}
+    server_timing = {}
+    for _, status, spans in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        for name, ms in spans.items():
+            server_timing[name] = server_timing.get(name, 0.0) + ms
+
+    def per_request_ms(*endpoints):
+        return round(sum(upstream.get(e, {}).get("seconds", 0.0) for e in endpoints) / requests * 1000, 1)
+
+    mean_ms = sum(latencies) / requests * 1000
+    stages = {
+        "off_ms": per_request_ms("off_search", "off_product"),
+        "groq_ms": per_request_ms("groq", "groq_429"),
+        "groq_queue_ms": round(queue_seconds / requests * 1000, 1),
+    }
+    stages["app_ms"] = round(max(0.0, mean_ms - sum(stages.values())), 1)
+    return {
+        "mode": scenario["mode"],
+        "concurrency": scenario["concurrency"],
+        "requests": requests,
+        "seconds": round(elapsed, 2),
+        "rps": round(requests / elapsed, 2),
+        "status": statuses,
+        "latency_ms": {
+            "mean": round(mean_ms, 1),
+            "p50": round(_percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1),
+        },
+        "stages": stages,
+        "server_timing_ms": {name: round(ms / requests, 1) for name, ms in server_timing.items()},
+        "upstream": {name: entry["calls"] for name, entry in sorted(upstream.items())},
+    }
+
+
+def compare(result, baseline):
+    """Relative Abweichung gegenüber der Baseline für RPS und Latenz-Perzentile."""
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+    return {
+        "rps": delta(result["rps"], baseline["rps"]),
+        **{p: delta(result["latency_ms"][p], baseline["latency_ms"][p]) for p in ("p50", "p95", "p99")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Szenario (mehrfach möglich; Standard: alle)")
+    parser.add_argument("--concurrency", type=int, help="Parallelität für alle Szenarien überschreiben")
+    parser.add_argument("--requests", type=int, help="Anzahl Anfragen für alle Szenarien überschreiben")
+    parser.add_argument("--save", metavar="FILE", help="Ergebnisse als Baseline (JSON) speichern")
+    parser.add_argument("--compare", metavar="FILE", help="gegen gespeicherte Baseline vergleichen")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {name: entry["result"] for name, entry in json.load(f)["scenarios"].items()}
+
+    results, configs = {}, {}
+    for name in args.scenario or SCENARIOS:
+        scenario = dict(SCENARIOS[name])
+        if args.concurrency:
+            scenario["concurrency"] = args.concurrency
+        if args.requests:
+            scenario["requests"] = args.requests
+        configs[name] = scenario
+        results[name] = run_scenario(scenario)
+        print(name, json.dumps(results[name], ensure_ascii=False))
+        if name in baseline:
+            print("  vs. Baseline", json.dumps(compare(results[name], baseline[name])))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "recorded_at": time.strftime("%Y-%m-%d"),
+                "python": sys.version.split()[0],
+                "cpus": os.cpu_count(),
+                "scenarios": {name: {**configs[name], "result": result}
+                              for name, result in results.items()},
+            }, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Vergleicht den Durchsatz von /classify: gunicorn sync, gunicorn gthread (Procfile) und ASGI (uvicorn).
+
+    python bench/serving_modes.py --concurrency 20 --requests 60 --groq-latency 2
+
+Groq/OFF werden durch bench/stubs.py ersetzt; Ergebnis-Cache, ähnliche Anfragen und
+Fast Path sind abgeschaltet, damit jede Anfrage die volle Pipeline durchläuft. Zusätzlich wird gemessen, wie lange
+/health unter Last braucht.
+"""
+import argparse, json, os, socket, subprocess, sys, time, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "sync (gunicorn, 1 worker)": ["gunicorn", "app:app", "--workers", "1", "--timeout", "120", "--bind"],
+    "gthread (gunicorn, 1 worker, 8 threads)": ["gunicorn", "app:app", "--workers", "1", "--worker-class", "gthread",
+                                                "--threads", "8", "--timeout", "120", "--bind"],
+    "asgi (uvicorn)": ["uvicorn", "asgi:app", "--log-level", "warning", "--bind"],
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base + "/health", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server unter {base} nicht erreichbar")
+
+
+# Jede Anfrage geht durch OFF-Lookup, Prompt und Groq-Aufruf
+PIPELINE_ENV = {"RESULT_CACHE_SIZE": "0", "RESULT_STORE_PATH": "", "FUZZY_CACHE_ENABLED": "0",
+                "FAST_PATH_ENABLED": "0"}
+
+
+@contextmanager
+def serve(cmd, env):
+    """Startet den Server-Befehl aus MODES auf einem freien Port; liefert die Basis-URL."""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    if cmd[0] == "uvicorn":
+        cmd = cmd[:-1] + ["--host", "127.0.0.1", "--port", str(port)]
+    else:
+        cmd = cmd + [f"127.0.0.1:{port}"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(base)
+        yield base
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _post(base, product):
+    t0 = time.perf_counter()
+    req = urllib.request.Request(base + "/classify", data=json.dumps({"product": product}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        resp.read()
+    return time.perf_counter() - t0
+
+
+def _health(base):
+    t0 = time.perf_counter()
+    urllib.request.urlopen(base + "/health", timeout=300).read()
+    return time.perf_counter() - t0
+
+
+def run_mode(cmd, env, concurrency, requests):
+    with serve(cmd, env) as base:
+        with ThreadPoolExecutor(concurrency + 1) as pool:
+            t0 = time.perf_counter()
+            futures = [pool.submit(_post, base, f"Stub Cola {i} 0.5l") for i in range(requests)]
+            time.sleep(0.5)
+            health = pool.submit(_health, base).result()
+            latencies = sorted(f.result() for f in futures)
+            elapsed = time.perf_counter() - t0
+        return {
+            "requests": requests,
+            "seconds": round(elapsed, 2),
+            "rps": round(requests / elapsed, 2),
+            "p50_s": round(latencies[len(latencies) // 2], 2),
+            "max_s": round(latencies[-1], 2),
+            "health_under_load_s": round(health, 3),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--groq-latency", type=float, default=2.0)
+    parser.add_argument("--off-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub = StubServer(args.groq_latency, args.off_latency).start()
+    env = {**os.environ, **stub.env(), **PIPELINE_ENV}
+    try:
+        for name, cmd in MODES.items():
+            print(name, json.dumps(run_mode(cmd, env, args.concurrency, args.requests)))
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
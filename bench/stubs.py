@@ -0,0 +1,209 @@
+"""
+Lokale Stand-ins für Groq (chat/completions) und Open Food Facts für Lasttests.
+
+Starten einen ThreadingHTTPServer auf 127.0.0.1 mit konfigurierbarer Latenz (optional mit
+Streuung, Ausreissern und Latenz pro Modell), eingestreuten 429-Antworten und
+usage-Angaben wie bei Groq; die App wird per
+GROQ_URL / OFF_BASE_URL darauf umgeleitet. Es wird kein echtes Groq-Kontingent verbraucht.
+stats() liefert Aufrufe und Bedienzeit pro Endpunkt für die Stufen-Aufschlüsselung
+(Groq zusätzlich pro Modell als "groq:<modell>", abgebrochene Aufrufe als "groq_cancelled"
+bzw. "off_cancelled").
+"""
+import json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CLASSIFICATION = {
+    "product_identified": "Stub-Produkt",
+    "product_description": "Stub",
+    "material": "Wasser, Zucker",
+    "category": "Getränk",
+    "chapter": 22,
+    "chapter_name": "Getränke",
+    "position": "2202",
+    "position_name": "Wasser, mit Zusatz von Zucker",
+    "tariff_number": "2202.1000",
+    "tariff_description": "Wasser, mit Zusatz von Zucker",
+    "decision_path": [],
+    "mwst_rate": "8.1%",
+    "confidence": "high",
+}
+
+# Antwort auf die Vorauswahl der zweistufigen Einreihung (Systemprompt verlangt "positions")
+SHORTLIST = {"positions": ["2202", "2009"], "reason": "Stub"}
+
+OFF_PRODUCT = {
+    "product_name": "Stub Cola",
+    "brands": "Stub",
+    "ingredients_text": "Zutaten: Wasser, Zucker, Kohlensäure",
+    "categories": "Getränke, Limonaden",
+    "quantity": "500 ml",
+    "code": "7610000000001",
+}
+
+
+class StubServer:
+    """Groq- und OFF-Stand-in in einem Server (Pfade wie die echten Endpunkte)."""
+
+    def __init__(self, groq_latency=1.0, off_latency=0.2, jitter=0.0, rate_limit_ratio=0.0,
+                 retry_after=1, completion_tokens=150, seed=None, model_latency=None,
+                 tail_ratio=0.0, tail_latency=0.0):
+        self.groq_latency = groq_latency
+        self.model_latency = model_latency or {}  # Modell → Latenz (statt groq_latency)
+        self.tail_ratio = tail_ratio              # Anteil der Groq-Aufrufe mit tail_latency
+        self.tail_latency = tail_latency
+        self.off_latency = off_latency
+        self.jitter = jitter                      # ±Anteil der Latenz, gleichverteilt
+        self.rate_limit_ratio = rate_limit_ratio  # Anteil der Groq-Aufrufe mit 429
+        self.retry_after = retry_after
+        self.completion_tokens = completion_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                t0 = time.perf_counter()
+                time.sleep(stub._latency(stub.off_latency))
+                barcode = self.path.startswith("/api/v2/product/")
+                try:
+                    self._send(200, {"status": 1, "product": OFF_PRODUCT} if barcode else {"products": [OFF_PRODUCT]})
+                except (BrokenPipeError, ConnectionResetError):   # Anreicherung schon entschieden
+                    self.close_connection = True
+                    stub._record("off_cancelled", t0)
+                    return
+                stub._record("off_product" if barcode else "off_search", t0)
+
+            def _send_stream(self, content, usage):
+                # Groq-Format: SSE-Chunks mit choices[0].delta, usage im letzten Chunk unter x_groq;
+                # erstes Token nach 20 % der Latenz, der Rest verteilt
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+                latency = stub._latency(stub.groq_latency)
+                time.sleep(latency * 0.2)
+                events = [{"choices": [{"index": 0, "delta": {"content": piece}}]} for piece in pieces]
+                events.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                               "x_groq": {"usage": usage}})
+                for i, event in enumerate(events):
+                    if i:
+                        time.sleep(latency * 0.8 / len(events))
+                    data = f"data: {json.dumps(event)}\n\n".encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(done), done))
+
+            def _send_rate_limited(self):
+                body = json.dumps({"error": {"message": "Rate limit reached (stub)",
+                                             "type": "tokens", "code": "rate_limit_exceeded"}}).encode()
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Retry-After", str(stub.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                t0 = time.perf_counter()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stub._roll(stub.rate_limit_ratio):
+                    self._send_rate_limited()
+                    stub._record("groq_429", t0)
+                    return
+                prompt_tokens = len(body) // 4
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": stub.completion_tokens,
+                         "total_tokens": prompt_tokens + stub.completion_tokens}
+                request = json.loads(body)
+                if request.get("stream"):
+                    self._send_stream(json.dumps(CLASSIFICATION), usage)
+                    stub._record("groq", t0, usage)
+                    return
+                model = request.get("model", "")
+                messages = request.get("messages") or [{}]
+                answer = SHORTLIST if '"positions"' in messages[0].get("content", "") else CLASSIFICATION
+                tail = model not in stub.model_latency and stub._roll(stub.tail_ratio)
+                time.sleep(stub.tail_latency if tail else stub._latency(stub.model_latency.get(model, stub.groq_latency)))
+                try:
+                    self._send(200, {
+                        "choices": [{"message": {"role": "assistant", "content": json.dumps(answer)}}],
+                        "usage": usage,
+                    })
+                except (BrokenPipeError, ConnectionResetError):   # Client hat abgebrochen (Hedging)
+                    self.close_connection = True
+                    stub._record("groq_cancelled", t0)
+                    return
+                stub._record("groq", t0, usage)
+                stub._record(f"groq:{model}", t0, usage)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _latency(self, base):
+        if not self.jitter:
+            return base
+        with self._lock:
+            return max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _roll(self, ratio):
+        if not ratio:
+            return False
+        with self._lock:
+            return self._random.random() < ratio
+
+    def _record(self, endpoint, t0, usage=None):
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            entry = self._stats.setdefault(endpoint, {"calls": 0, "seconds": 0.0, "tokens": 0})
+            entry["calls"] += 1
+            entry["seconds"] += elapsed
+            if usage:
+                entry["tokens"] += usage["total_tokens"]
+
+    def stats(self):
+        """Aufrufe, Bedienzeit (s) und Tokens pro Endpunkt seit dem Start bzw. reset()."""
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def env(self):
+        """Umgebungsvariablen, die die App auf diesen Stand-in umleiten."""
+        return {
+            "GROQ_URL": f"{self.url}/openai/v1/chat/completions",
+            "OFF_BASE_URL": self.url,
+            "GROQ_API_KEY": "stub",
+            # Stand-in hat kein Kontingent: Limiter praktisch abschalten
+            "GROQ_TPM": "100000000",
+            "GROQ_RPM": "1000000",
+        }
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Vergleicht einstufige und zweistufige Einreihung (CLASSIFY_MODE) auf einem gelabelten Set.
+
+Eingabe: NDJSON mit {"product": "...", "position": "2202", "tariff": "2202.1000"}
+("tariff" nur, wo die Tarifnummer sicher ist). Pro Modus werden alle Produkte ohne
+Ergebnis-Cache und Fast Path klassifiziert und ausgegeben: Treffer auf Kapitel-, Positions-
+und Tarifnummer-Ebene, Prompt-Tokens des grossen Modells (GROQ_MODEL) und des kleinen
+(Vorauswahl, Kapitel-Fallback) pro Produkt sowie die Latenz.
+
+    python bench/two_stage_eval.py                                   # braucht GROQ_API_KEY
+    python bench/two_stage_eval.py bench/labeled_products.jsonl --show-misses
+    python bench/two_stage_eval.py --dry-run                         # offline, nur Prompt-Grösse
+
+--dry-run ruft kein Modell auf: die Vorauswahl wird durch die besten BM25-Positionen aus
+POSITION_INDEX ersetzt (schwächer als das Modell). Verglichen werden die geschätzten
+Prompt-Tokens beider Modi und ob die gelabelte Position in der Vorauswahl landet.
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving_modes import PIPELINE_ENV  # noqa: E402
+
+os.environ.update(PIPELINE_ENV)
+import app  # noqa: E402
+
+DEFAULT_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "labeled_products.jsonl")
+MODES = ("single", "two_stage")
+
+
+def read_set(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0
+
+
+def _score(rows, results):
+    """Treffer pro Ebene; Tarifnummer nur über die Zeilen mit "tariff"."""
+    chapter = position = tariff = tariff_total = 0
+    misses = []
+    for row, result in zip(rows, results):
+        got = str(result.get("tariff_number") or result.get("position") or "")
+        digits = got.replace(".", "")
+        chapter += digits[:2] == row["position"][:2]
+        position += digits[:4] == row["position"]
+        if row.get("tariff"):
+            tariff_total += 1
+            tariff += got == row["tariff"]
+        if digits[:4] != row["position"]:
+            misses.append({"product": row["product"], "expected": row["position"], "got": got or result.get("error"),
+                           "shortlist": result.get("shortlist")})
+    n = len(rows)
+    accuracy = {"chapter": round(chapter / n, 3), "position": round(position / n, 3),
+                "tariff": round(tariff / tariff_total, 3) if tariff_total else None}
+    return accuracy, misses
+
+
+def evaluate(rows, mode):
+    """Alle Produkte im Modus mode klassifizieren (ohne Cache); liefert Kennzahlen und Fehlgriffe."""
+    app.CLASSIFY_MODE = mode
+    results, latencies, big, small, errors = [], [], [], [], 0
+    for row in rows:
+        t0 = time.perf_counter()
+        result = app._classify_uncached(row["product"], app.Deadline(app.REQUEST_DEADLINE))
+        latencies.append(time.perf_counter() - t0)
+        results.append(result)
+        errors += "error" in result
+        calls = result.get("usage", {}).get("calls", [])
+        big.append(sum(c["prompt_tokens"] for c in calls if c["model"] == app.GROQ_MODEL))
+        small.append(sum(c["prompt_tokens"] for c in calls if c["model"] != app.GROQ_MODEL))
+    accuracy, misses = _score(rows, results)
+    n = len(rows)
+    return {
+        "mode": mode,
+        "products": n,
+        "errors": errors,
+        "accuracy": accuracy,
+        "big_model_prompt_tokens": round(sum(big) / n),
+        "small_model_prompt_tokens": round(sum(small) / n),
+        "latency_ms": {"p50": round(_median(latencies) * 1000), "max": round(max(latencies) * 1000)},
+    }, misses
+
+
+def dry_run(rows):
+    """Prompt-Grösse beider Modi ohne Modellaufruf; Vorauswahl = beste BM25-Positionen."""
+    single, two_stage, recall, fallback = [], [], 0, 0
+    for row in rows:
+        query = row["product"]
+        primary, extra = app.detect_chapters(query, None)
+        primary = primary if primary is not None else int(row["position"][:2])
+        _, _, report = app.prepare_prompt(query, None, "none", primary, extra)
+        single.append(report["prompt_tokens"])
+
+        chapters = app.shortlist_chapters(query, None, primary, extra)
+        ranked = app.POSITION_INDEX.rank(query, chapters, k=app.SHORTLIST_MAX_POSITIONS)
+        hits = sorted((hit for hits in ranked.values() for hit in hits), key=lambda hit: -hit[1])
+        shortlist = app.parse_shortlist({"positions": [code for code, _ in hits]}, chapters)
+        if shortlist is None:
+            fallback += 1
+            two_stage.append(report["prompt_tokens"])
+            continue
+        recall += row["position"] in shortlist[1]
+        _, _, report = app.prepare_prompt(query, None, "none", primary, extra, shortlist)
+        two_stage.append(report["prompt_tokens"])
+    n = len(rows)
+    return {
+        "products": n,
+        "single_prompt_tokens": round(sum(single) / n),
+        "two_stage_prompt_tokens": round(sum(two_stage) / n),
+        "reduction": f"{(1 - sum(two_stage) / sum(single)) * 100:.0f}%",
+        "bm25_shortlist_recall": round(recall / n, 3),
+        "no_shortlist": fallback,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Einstufige vs. zweistufige Einreihung auf einem gelabelten Set")
+    parser.add_argument("labels", nargs="?", default=DEFAULT_SET, help=f"NDJSON-Set (Standard: {DEFAULT_SET})")
+    parser.add_argument("--mode", action="append", choices=MODES, help="nur diesen Modus (mehrfach möglich)")
+    parser.add_argument("--dry-run", action="store_true", help="offline: nur Prompt-Tokens vergleichen")
+    parser.add_argument("--show-misses", action="store_true", help="falsch eingereihte Produkte ausgeben")
+    args = parser.parse_args()
+
+    rows = read_set(args.labels)
+    if args.dry_run:
+        print(json.dumps(dry_run(rows), ensure_ascii=False))
+        return
+    if not app.GROQ_API_KEY:
+        sys.exit("GROQ_API_KEY fehlt (oder --dry-run verwenden)")
+    for mode in args.mode or MODES:
+        summary, misses = evaluate(rows, mode)
+        print(json.dumps(summary, ensure_ascii=False))
+        if args.show_misses:
+            for miss in misses:
+                print("  ", json.dumps(miss, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
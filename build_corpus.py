@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Kompiliert bazg_cache/ (erl_XX.txt, anm_XX.txt) in eine Datei bazg_corpus.bin.
+
+Die App öffnet die Datei beim Start per mmap, statt 154 Einzeldateien zu lesen und zu
+zerlegen; die Texte liegen dann einmal im Page-Cache des OS und werden von allen
+Workern geteilt. Ist bazg_cache neuer als die Datei, liest die App wieder die
+Einzeldateien – nach jeder Änderung am Cache also neu bauen (z.B. im Build-Schritt):
+
+    python build_corpus.py
+    python build_corpus.py --output /tmp/bazg_corpus.bin --bench
+"""
+import argparse, json, os, subprocess, sys, time
+
+from app import CACHE_DIR, CORPUS_BIN_PATH, CorpusIndex, corpus_source_mtime
+
+# Misst in einem frischen Prozess: Import der App (inkl. Korpus, BM25-Index) und Speicher
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t0
+status = dict(line.split(":", 1) for line in open("/proc/self/status") if ":" in line)
+kb = lambda key: int(status.get(key, "0 kB").split()[0])
+print(json.dumps({"source": app.CORPUS.source, "corpus_ms": app.CORPUS.stats()["build_ms"],
+                  "import_ms": round(elapsed * 1000), "rss_kb": kb("VmRSS"),
+                  "rss_anon_kb": kb("RssAnon"), "rss_file_kb": kb("RssFile")}))
+"""
+
+
+def bench(bin_path, runs):
+    """Startzeit und RSS pro Worker: Einzeldateien vs. gemappter Korpus (Median über runs)."""
+    results = {}
+    for label, path in (("files", ""), ("mmap", bin_path)):
+        env = {**os.environ, "CORPUS_BIN_PATH": path}
+        samples = [json.loads(subprocess.check_output([sys.executable, "-c", PROBE], env=env,
+                                                      cwd=os.path.dirname(os.path.abspath(__file__))))
+                   for _ in range(runs)]
+        results[label] = {key: sorted(s[key] for s in samples)[runs // 2] if key != "source" else samples[0][key]
+                          for key in samples[0]}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bazg_cache → bazg_corpus.bin (mmap-fähiger Korpus)")
+    parser.add_argument("--output", default=CORPUS_BIN_PATH, help=f"Zieldatei (Standard: {CORPUS_BIN_PATH})")
+    parser.add_argument("--bench", type=int, nargs="?", const=5, default=0, metavar="RUNS",
+                        help="Startzeit und RSS mit/ohne Binärdatei vergleichen (Standard: 5 Läufe)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    _, source_mtime = corpus_source_mtime(CACHE_DIR)
+    corpus = CorpusIndex.build(CACHE_DIR)
+    corpus.write(args.output, source_mtime)
+    elapsed = time.perf_counter() - t0
+    size_mb = os.path.getsize(args.output) / 1e6
+    print(f"{corpus.files} Dateien, {len(corpus.chapters)} Kapitel, Version {corpus.version} "
+          f"in {elapsed:.2f}s → {args.output} ({size_mb:.1f} MB)")
+
+    if args.bench:
+        for label, result in bench(args.output, args.bench).items():
+            print(label, json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Importiert einen Open-Food-Facts-Export in den lokalen Barcode-Index (SQLite).
+
+Unterstützt den CSV-Export (tab-getrennt, z.B. en.openfoodfacts.org.products.csv[.gz])
+und den JSONL-Export (openfoodfacts-products.jsonl[.gz]). Gespeichert werden nur die
+Felder, die format_off_product() verwendet; Zutaten werden schon hier auf das
+deutsche "Zutaten:"-Segment gekürzt.
+
+    python import_off_dump.py en.openfoodfacts.org.products.csv.gz
+    python import_off_dump.py openfoodfacts-products.jsonl.gz --output off_index.sqlite --bench 100000
+"""
+import argparse, csv, gzip, json, os, random, sqlite3, sys, time
+
+from app import OFF_INDEX_PATH, OffBarcodeIndex, trim_ingredients
+
+BATCH_SIZE = 50000
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def iter_csv(path):
+    csv.field_size_limit(sys.maxsize)
+    with _open_text(path) as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            yield row
+
+
+def iter_jsonl(path):
+    with _open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_products(path):
+    """Liefert (ean, name, brands, ingredients, categories, quantity) pro Produkt."""
+    name = path[:-3] if path.endswith(".gz") else path
+    rows = iter_jsonl(path) if name.endswith((".jsonl", ".json", ".ndjson")) else iter_csv(path)
+    for p in rows:
+        ean = str(p.get("code") or "").strip()
+        if not ean.isdigit():
+            continue
+        brands = p.get("brands") or ""
+        categories = p.get("categories") or ""
+        # JSONL-Export kann Listen statt Strings enthalten
+        if isinstance(brands, list):
+            brands = ", ".join(brands)
+        if isinstance(categories, list):
+            categories = ", ".join(categories)
+        record = (
+            ean,
+            p.get("product_name") or "",
+            brands,
+            trim_ingredients(p.get("ingredients_text") or ""),
+            categories,
+            p.get("quantity") or "",
+        )
+        if any(record[1:]):
+            yield record
+
+
+def build_index(dump_path, output_path):
+    """Schreibt den Index in eine temporäre Datei und ersetzt output_path atomar."""
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("""CREATE TABLE products (
+        ean TEXT PRIMARY KEY, name TEXT, brands TEXT, ingredients TEXT,
+        categories TEXT, quantity TEXT) WITHOUT ROWID""")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    rows = 0
+    batch = []
+    for record in iter_products(dump_path):
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)", batch)
+            rows += len(batch)
+            batch = []
+            print(f"  {rows:,} Produkte ...", file=sys.stderr)
+    if batch:
+        conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)", batch)
+        rows += len(batch)
+
+    # Doppelte EANs im Export werden per INSERT OR REPLACE zusammengelegt
+    rows = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+        ("rows", str(rows)),
+        ("source", os.path.basename(dump_path)),
+        ("imported_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
+    ])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def bench(output_path, samples):
+    """Misst die Lookup-Latenz über OffBarcodeIndex (Treffer und Fehltreffer gemischt)."""
+    conn = sqlite3.connect(output_path)
+    eans = [r[0] for r in conn.execute(
+        "SELECT ean FROM products ORDER BY random() LIMIT ?", (samples,))]
+    conn.close()
+    eans += [str(random.randrange(10 ** 12, 10 ** 13)) for _ in range(len(eans) // 10)]
+    random.shuffle(eans)
+
+    index = OffBarcodeIndex(output_path)
+    timings = []
+    for ean in eans:
+        t0 = time.perf_counter()
+        index.get(ean)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+
+    def pct(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6
+
+    return {
+        "lookups": len(timings),
+        "hits": index.hits,
+        "p50_us": round(pct(0.50), 1),
+        "p95_us": round(pct(0.95), 1),
+        "p99_us": round(pct(0.99), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-Food-Facts-Export → lokaler Barcode-Index")
+    parser.add_argument("dump", help="CSV- oder JSONL-Export (optional .gz)")
+    parser.add_argument("--output", default=OFF_INDEX_PATH, help=f"Zieldatei (Standard: {OFF_INDEX_PATH})")
+    parser.add_argument("--bench", type=int, default=0, metavar="N",
+                        help="nach dem Import N zufällige Lookups messen")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    rows = build_index(args.dump, args.output)
+    elapsed = time.perf_counter() - t0
+    size_mb = os.path.getsize(args.output) / 1e6
+    print(f"{rows:,} Produkte in {elapsed:.1f}s importiert → {args.output} ({size_mb:.1f} MB)")
+
+    if args.bench:
+        print(json.dumps(bench(args.output, args.bench)))
+
+
+if __name__ == "__main__":
+    main()
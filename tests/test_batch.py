@@ -0,0 +1,93 @@
+"""Batch-Klassifizierung (/classify/batch): NDJSON-Zeilen, Deduplizierung, Rate-Limit-Backoff.
+
+classify_product wird ersetzt; geprüft werden Route und classify_batch_stream.
+
+    python -m unittest discover tests
+"""
+import json, os, sys, threading, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+
+class FakeClassifier:
+    """classify_product-Ersatz: pro Anfrage eine Liste von Ergebnissen (das letzte wiederholt sich)."""
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, query, deadline=None):
+        with self._lock:
+            self.calls.append(query)
+            attempt = self.calls.count(query) - 1
+        planned = self.results.get(query, [{"tariff_number": "2202.1000", "query": query}])
+        result = planned[min(attempt, len(planned) - 1)]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        patcher = mock.patch.object(app, "GROQ_API_KEY", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_batch(self, products, classifier):
+        with mock.patch.object(app, "classify_product", classifier), mock.patch.object(app.time, "sleep"):
+            resp = self.client.post("/classify/batch", json={"products": products})
+            lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        return resp, lines
+
+    def test_one_line_per_input(self):
+        products = ["Cola Zero 1.5l", {"product": "Rivella Rot 50cl"}, "  ", 42]
+        resp, lines = self.run_batch(products, FakeClassifier())
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertEqual(lines[0], {"accepted": 4, "unique": 2})
+        by_index = {line["index"]: line for line in lines[1:]}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3])
+        self.assertEqual((by_index[0]["status"], by_index[0]["result"]["query"]), (200, "Cola Zero 1.5l"))
+        self.assertEqual(by_index[1]["result"]["query"], "Rivella Rot 50cl")
+        self.assertEqual((by_index[2]["status"], by_index[3]["status"]), (400, 400))
+
+    def test_duplicates_are_classified_once(self):
+        classifier = FakeClassifier()
+        _, lines = self.run_batch(["Cola Zero 1.5l", "cola  zero 1.5L", "Cola Zero 1.5l"], classifier)
+        self.assertEqual(lines[0], {"accepted": 3, "unique": 1})
+        self.assertEqual(classifier.calls, ["Cola Zero 1.5l"])
+        self.assertEqual(sorted(line["index"] for line in lines[1:]), [0, 1, 2])
+
+    def test_rate_limit_is_retried(self):
+        limited = {"error": "Groq Rate Limit", "rate_limited": True, "retry_after": 3}
+        classifier = FakeClassifier({"Cola": [limited, {"tariff_number": "2202.1000"}]})
+        _, lines = self.run_batch(["Cola"], classifier)
+        self.assertEqual(classifier.calls, ["Cola", "Cola"])
+        self.assertEqual(lines[1]["status"], 200)
+
+    def test_rate_limit_gives_up_after_retries(self):
+        limited = {"error": "Groq Rate Limit", "rate_limited": True, "retry_after": 3}
+        classifier = FakeClassifier({"Cola": [limited]})
+        _, lines = self.run_batch(["Cola"], classifier)
+        self.assertEqual(len(classifier.calls), app.BATCH_RATE_LIMIT_RETRIES + 1)
+        self.assertEqual(lines[1]["status"], 429)
+
+    def test_failure_stays_on_its_line(self):
+        classifier = FakeClassifier({"Kaputt": [RuntimeError("kaputt")]})
+        _, lines = self.run_batch(["Kaputt", "Cola"], classifier)
+        status = {line["index"]: line["status"] for line in lines[1:]}
+        self.assertEqual(status, {0: 500, 1: 200})
+
+    def test_request_validation(self):
+        self.assertEqual(self.client.post("/classify/batch", json={}).status_code, 400)
+        with mock.patch.object(app, "BATCH_MAX_ITEMS", 2):
+            self.assertEqual(self.client.post("/classify/batch", json={"products": ["a", "b", "c"]}).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Korpus-Updates im laufenden Betrieb: CorpusReloader und Invalidierung pro Kapitel.
+
+Gearbeitet wird auf einer Kopie von bazg_cache (Kapitel 9 und 22) in einem Temp-Verzeichnis.
+
+    python -m unittest discover tests
+"""
+import os, shutil, sys, tempfile, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+FILES = ("erl_09.txt", "anm_09.txt", "erl_22.txt", "anm_22.txt")
+MODEL = "test-model"
+
+
+class CorpusReloadTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, "bazg_cache")
+        os.mkdir(self.cache_dir)
+        for name in FILES:
+            shutil.copy(os.path.join(app.CACHE_DIR, name), self.cache_dir)
+        corpus = app.CorpusIndex.build(self.cache_dir)
+        for name, value in (("CORPUS", corpus), ("POSITION_INDEX", app.PositionIndex.build(corpus))):
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.reloader = app.CorpusReloader(0)
+        self.store = app.ResultStore(os.path.join(tmp.name, "results.sqlite"), max_age=3600)
+        self.result_cache = app.TTLCache(16, 3600)
+        for name, value in (("RESULT_STORE", self.store), ("RESULT_CACHE", self.result_cache),
+                            ("CORPUS_RELOADER", self.reloader)):
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def edit(self, name, text):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_unchanged_files_keep_corpus(self):
+        corpus = app.CORPUS
+        self.assertEqual(self.reloader.reload(), [])
+        self.assertIs(app.CORPUS, corpus)
+        self.assertEqual(self.reloader.stats()["reloads"], 0)
+
+    def test_edit_bumps_only_that_chapter(self):
+        before, position_index = app.CORPUS, app.POSITION_INDEX
+        self.edit("erl_22.txt", "\n2209.  Speiseessig\n")
+        self.assertEqual(self.reloader.reload(), [22])
+        self.assertNotEqual(app.CORPUS.get(22).version, before.get(22).version)
+        self.assertIs(app.CORPUS.get(9), before.get(9))
+        self.assertNotEqual(app.CORPUS.version, before.version)
+        self.assertIsNot(app.POSITION_INDEX, position_index)   # BM25-Gewichte hängen am ganzen Korpus
+        self.assertEqual(self.reloader.stats()["last"]["chapters"], [22])
+
+    def test_deleted_chapter_loses_version(self):
+        for name in ("erl_09.txt", "anm_09.txt"):
+            os.remove(os.path.join(self.cache_dir, name))
+        self.assertEqual(self.reloader.reload(), [9])
+        self.assertIsNone(app.CORPUS.get(9))
+        self.assertEqual(app.CORPUS.versions([9]), {"9": ""})
+
+    def test_results_of_reloaded_chapter_are_stale(self):
+        keys = {ch: (f"produkt {ch}", f"7610000000{ch:03d}", MODEL) for ch in (9, 22)}
+        for ch, key in keys.items():
+            result = {"tariff_number": f"{ch:02d}01.1000", "corpus_versions": app.CORPUS.versions([ch])}
+            self.store.put(key, result)
+            self.result_cache.set(key, result)
+        self.assertTrue(self.store.flush())
+
+        self.edit("anm_22.txt", "\nNeue Anmerkung.\n")
+        self.assertEqual(self.reloader.reload(), [22])
+        self.assertIsNone(app._cached_result(keys[22]))
+        self.assertEqual(app._cached_result(keys[9])["tariff_number"], "0901.1000")
+        self.assertEqual(self.reloader.stats()["stale_hits"], 1)
+
+        # auch der persistente Speicher liefert den alten Stand nicht mehr aus
+        self.result_cache.clear()
+        self.assertIsNone(app._cached_result(keys[22]))
+        self.assertEqual(self.store.prune(stale_for=MODEL), 1)
+        self.assertEqual([row["query"] for row in self.store.export()], ["produkt 9"])
+
+
+if __name__ == "__main__":
+    unittest.main()
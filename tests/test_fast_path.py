@@ -0,0 +1,45 @@
+"""Regressionstests für den Fast Path: keine regelbasierte Antwort auf Nicht-Getränke.
+
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+SODA = {"name": "Coca-Cola Zero", "brand": "Coca-Cola", "categories": "Beverages, Carbonated drinks, Sodas",
+        "quantity": "1.5 l", "ingredients": "Wasser, Kohlensäure, Süssstoffe"}
+SPARKLING = {"name": "Prosecco Spumante", "categories": "Beverages, Alcoholic beverages, Wines, Sparkling wines",
+             "quantity": "75 cl", "ingredients": ""}
+
+
+class FastPathTest(unittest.TestCase):
+    def test_non_beverages_query_only(self):
+        for query in ("Haribo Cola Fläschchen", "Coca-Cola Lip Balm", "Prosecco Frizzante DOC"):
+            with self.subTest(query=query):
+                self.assertIsNone(app.fast_path_classify(query))
+
+    def test_non_beverages_with_product_data(self):
+        cases = [
+            ("Haribo Cola Fläschchen", {"name": "Cola Fläschchen", "categories": "Snacks, Confectioneries, Gummies",
+                                        "quantity": "200 g"}),
+            ("Coca-Cola Lip Balm", {"name": "Lip Balm Coca-Cola", "categories": "Cosmetics", "quantity": "4 g"}),
+            ("Prosecco Frizzante DOC", {**SPARKLING, "name": "Prosecco Frizzante"}),
+        ]
+        for query, product_info in cases:
+            with self.subTest(query=query):
+                self.assertIsNone(app.fast_path_classify(query, product_info))
+
+    def test_beverage_needs_product_data(self):
+        self.assertIsNone(app.fast_path_classify("Coca-Cola Zero 1.5l"))
+        self.assertEqual(app.fast_path_classify("Coca-Cola Zero 1.5l", SODA)["tariff_number"], "2202.1000")
+        self.assertEqual(app.fast_path_classify("Prosecco DOC Spumante", SPARKLING)["tariff_number"], "2204.1000")
+
+    def test_beverage_needs_drink_context(self):
+        self.assertIsNone(app.fast_path_classify("Coca-Cola Zero", {**SODA, "quantity": ""}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""Hedging (GroqHedger): Abbruch des Verlierers und Rate-Limits des Primärmodells.
+
+Groq wird über app.http_request ersetzt; Limiter, Usage-Buchung und Hedger laufen echt.
+
+    python -m unittest discover tests
+"""
+import asyncio, email.message, json, os, sys, threading, time, unittest, urllib.error
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+import asgi  # noqa: E402
+
+HEDGE_MODEL = "llama-3.1-8b-instant"
+MESSAGES = [{"role": "user", "content": "Cola 1.5l"}]
+
+
+class FakeResponse:
+    def __init__(self, tariff_number):
+        self.headers = {}
+        self._data = {"choices": [{"message": {"content": json.dumps({"tariff_number": tariff_number})}}],
+                      "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+
+    def json(self):
+        return self._data
+
+
+def rate_limited(url, retry_after="7"):
+    headers = email.message.Message()
+    headers["Retry-After"] = retry_after
+    return urllib.error.HTTPError(url, 429, "Too Many Requests", headers, None)
+
+
+class FakeGroq:
+    """http_request-Ersatz: pro Modell (Verzögerung, Antwort oder Exception-Fabrik)."""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.calls = []
+        self.cancelled = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url, data=None, headers=None, timeout=None, cancel=None):
+        model = json.loads(data)["model"]
+        with self._lock:
+            self.calls.append(model)
+        delay, outcome = self.plan[model]
+        end = time.monotonic() + delay
+        while time.monotonic() < end:
+            if cancel is not None and cancel.cancelled:
+                with self._lock:
+                    self.cancelled.append(model)
+                raise app.CancelledError()
+            time.sleep(0.005)
+        if callable(outcome):
+            raise outcome(url)
+        return FakeResponse(outcome)
+
+
+class GroqHedgingTest(unittest.TestCase):
+    def setUp(self):
+        self.hedger = app.GroqHedger(HEDGE_MODEL, 0.9, min_delay=0.05, default_delay=0.1)
+        patcher = mock.patch.object(app, "GROQ_HEDGER", self.hedger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.GROQ_LIMITERS.clear()
+
+    def run_hedged(self, plan):
+        fake = FakeGroq(plan)
+        with mock.patch.object(app, "http_request", fake):
+            try:
+                return fake, app.call_groq(MESSAGES, max_tokens=10, deadline=app.Deadline(27),
+                                           validate=app.is_valid_classification)
+            finally:
+                time.sleep(0.05)   # abgebrochene Aufrufe zu Ende laufen lassen
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        fake, result = self.run_hedged({app.GROQ_MODEL: (2.0, "2202.1000"), HEDGE_MODEL: (0.02, "2202.9000")})
+        self.assertEqual((result["model"], result["hedged"]), (HEDGE_MODEL, True))
+        self.assertEqual(fake.cancelled, [app.GROQ_MODEL])
+        stats = self.hedger.stats()
+        self.assertEqual((stats["hedged"], stats["cancelled"]), (1, 1))
+
+    def test_fast_primary_is_not_hedged(self):
+        fake, result = self.run_hedged({app.GROQ_MODEL: (0.0, "2202.1000"), HEDGE_MODEL: (0.0, "2202.9000")})
+        self.assertEqual((result["model"], result["hedged"]), (app.GROQ_MODEL, False))
+        self.assertEqual(fake.calls, [app.GROQ_MODEL])
+
+    def test_upstream_429_before_hedge_is_raised(self):
+        with self.assertRaises(app.RateLimitError) as ctx:
+            self.run_hedged({app.GROQ_MODEL: (0.0, rate_limited), HEDGE_MODEL: (0.0, "2202.9000")})
+        self.assertEqual(ctx.exception.retry_after, 7)
+
+    def test_upstream_429_after_hedge_started_is_raised(self):
+        fake = FakeGroq({app.GROQ_MODEL: (0.3, rate_limited), HEDGE_MODEL: (1.0, "2202.9000")})
+        with mock.patch.object(app, "http_request", fake), self.assertRaises(app.RateLimitError):
+            app.call_groq(MESSAGES, max_tokens=10, deadline=app.Deadline(27), validate=app.is_valid_classification)
+        time.sleep(0.05)
+        self.assertEqual(fake.calls, [app.GROQ_MODEL, HEDGE_MODEL])
+        self.assertEqual(fake.cancelled, [HEDGE_MODEL])
+        self.assertEqual(self.hedger.stats()["failed"], 1)
+
+    def test_limiter_rate_limit_is_raised(self):
+        fake = FakeGroq({app.GROQ_MODEL: (0.0, "2202.1000"), HEDGE_MODEL: (0.0, "2202.9000")})
+        limiter = app.groq_limiter(app.GROQ_MODEL)
+        with mock.patch.object(limiter, "reserve", side_effect=app.RateLimitError("voll", 12)), \
+                mock.patch.object(app, "http_request", fake), self.assertRaises(app.RateLimitError):
+            app.call_groq(MESSAGES, max_tokens=10, deadline=app.Deadline(27), validate=app.is_valid_classification)
+        self.assertEqual(fake.calls, [])
+
+    def test_early_failure_is_not_hedged(self):
+        with self.assertRaises(ValueError):
+            self.run_hedged({app.GROQ_MODEL: (0.0, lambda url: ValueError("kaputt")), HEDGE_MODEL: (0.0, "2202.9000")})
+        self.assertEqual(self.hedger.stats()["hedged"], 0)
+
+    def test_async_upstream_429_after_hedge_started_is_raised(self):
+        plan = {app.GROQ_MODEL: (0.3, rate_limited), HEDGE_MODEL: (1.0, "2202.9000")}
+        calls = []
+
+        async def fake(url, data=None, headers=None, timeout=None):
+            model = json.loads(data)["model"]
+            calls.append(model)
+            delay, outcome = plan[model]
+            await asyncio.sleep(delay)
+            if callable(outcome):
+                raise outcome(url)
+            return FakeResponse(outcome)
+
+        with mock.patch.object(asgi, "async_http_request", fake), self.assertRaises(app.RateLimitError):
+            asyncio.run(asgi.call_groq_async(MESSAGES, max_tokens=10, deadline=app.Deadline(27),
+                                             validate=app.is_valid_classification))
+        self.assertEqual(calls, [app.GROQ_MODEL, HEDGE_MODEL])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Token-Bucket (GroqRateLimiter): Reservierung, Abgleich und Abrechnung gescheiterter Aufrufe.
+
+    python -m unittest discover tests
+"""
+import email.message, os, sys, unittest, urllib.error
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Cola 1.5l"}]
+
+
+class GroqRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        # Refill abschalten: die Zeit steht, solange der Test es will
+        patcher = mock.patch.object(app.time, "monotonic", return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = app.GroqRateLimiter(tpm=6000, rpm=30)
+
+    def test_settle_replaces_estimate_with_actual_usage(self):
+        self.assertEqual(self.limiter.reserve(1000, max_wait=0), 0.0)
+        self.assertEqual(self.limiter.tokens, 5000)
+        self.limiter.settle(1000, usage={"total_tokens": 400})
+        self.assertEqual(self.limiter.tokens, 5600)
+        stats = self.limiter.stats()
+        self.assertEqual((stats["estimated_tokens"], stats["actual_tokens"]), (1000, 400))
+
+    def test_settle_without_usage_keeps_estimate(self):
+        self.limiter.reserve(1000, max_wait=0)
+        self.limiter.settle(1000)
+        self.assertEqual(self.limiter.tokens, 5000)
+
+    def test_debt_is_waited_off_or_rejected(self):
+        self.limiter.reserve(6000, max_wait=0)
+        self.assertAlmostEqual(self.limiter.reserve(600, max_wait=10), 6.0)   # 600 Tokens bei 100/s
+        with self.assertRaises(app.RateLimitError) as ctx:
+            self.limiter.reserve(600, max_wait=10)                             # bräuchte 12 s
+        self.assertEqual(ctx.exception.retry_after, 12)
+        self.assertEqual(self.limiter.tokens, -600)   # abgewiesene Reservierung bucht nichts
+
+    def test_groq_headers_are_authoritative(self):
+        self.limiter.reserve(1000, max_wait=0)
+        self.limiter.settle(1000, usage={"total_tokens": 1000},
+                            headers={"x-ratelimit-limit-tokens": "12000", "x-ratelimit-remaining-tokens": "2000"})
+        self.assertEqual((self.limiter.tpm, self.limiter.tokens), (12000, 2000))
+
+    def test_upstream_429_blocks_until_retry_after(self):
+        self.limiter.reserve(1000, max_wait=0)
+        self.limiter.settle(1000, headers={"retry-after": "7"}, rate_limited=True)
+        self.assertEqual(self.limiter.blocked_until, 1007.0)
+        self.assertEqual(self.limiter.tokens, 0.0)
+        with self.assertRaises(app.RateLimitError):
+            self.limiter.reserve(10, max_wait=5)
+
+
+class FailedCallAccountingTest(unittest.TestCase):
+    """Timeouts und Netzwerkfehler nach acquire() lassen keine offene Reservierung zurück."""
+
+    def setUp(self):
+        app.GROQ_LIMITERS.clear()
+        self.addCleanup(app.GROQ_LIMITERS.clear)
+        self.limiter = app.groq_limiter(app.GROQ_MODEL)
+        self.prompt_tokens = app.estimate_prompt_tokens(MESSAGES)
+
+    def call(self, error):
+        with mock.patch.object(app, "http_request", side_effect=error), self.assertRaises(type(error)):
+            app._call_groq_model(app.GROQ_MODEL, MESSAGES, 100, 0.1, deadline=app.Deadline(27))
+        return self.limiter.stats()
+
+    def test_timeout_books_prompt_estimate(self):
+        stats = self.call(TimeoutError("timed out"))
+        self.assertEqual(stats["actual_tokens"], self.prompt_tokens)
+
+    def test_connection_reset_books_prompt_estimate(self):
+        stats = self.call(ConnectionResetError("reset"))
+        self.assertEqual(stats["actual_tokens"], self.prompt_tokens)
+
+    def test_refused_connection_releases_reservation(self):
+        tokens = self.limiter.tokens
+        stats = self.call(ConnectionRefusedError("refused"))
+        self.assertEqual(stats["actual_tokens"], 0)
+        self.assertAlmostEqual(self.limiter.tokens, tokens, delta=1)
+
+    def test_http_error_is_settled_with_headers(self):
+        headers = email.message.Message()
+        headers["Retry-After"] = "3"
+        self.call(urllib.error.HTTPError(app.GROQ_URL, 429, "Too Many Requests", headers, None))
+        self.assertEqual(self.limiter.stats()["upstream_429"], 1)
+
+    def test_closed_stream_books_prompt_estimate(self):
+        class Stream:
+            headers = {}
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def iter_lines(self):
+                yield b'data: {"choices": [{"delta": {"content": "{"}}]}'
+                yield b'data: {"choices": [{"delta": {"content": "}"}}]}'
+
+        with mock.patch.object(app, "http_stream", return_value=Stream()):
+            stream = app._stream_groq_model(app.GROQ_MODEL, MESSAGES, 100, 0.1, deadline=app.Deadline(27))
+            self.assertEqual(next(stream), "{")
+            stream.close()   # Client trennt die SSE-Verbindung
+        self.assertEqual(self.limiter.stats()["actual_tokens"], self.prompt_tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
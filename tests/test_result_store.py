@@ -0,0 +1,86 @@
+"""Persistenter Ergebnis-Speicher (ResultStore): Schreiben, Lesen, Höchstalter, Export und prune.
+
+    python -m unittest discover tests
+"""
+import os, sqlite3, sys, tempfile, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+KEY = ("coca-cola zero 1.5l", "", "test-model")
+
+
+def classification(tariff_number="2202.1000"):
+    return {"tariff_number": tariff_number, "description": "Süssgetränk – kohlensäurehaltig",
+            "corpus_versions": app.CORPUS.versions([22])}
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "results.sqlite")
+        self.store = app.ResultStore(self.path, max_age=3600)
+
+    def test_round_trip(self):
+        self.assertTrue(self.store.enabled)
+        self.assertIsNone(self.store.get(KEY))
+        self.store.put(KEY, classification())
+        self.assertTrue(self.store.flush())
+        self.assertEqual(self.store.get(KEY), classification())
+        # ein zweiter Prozess (eigene Verbindung) sieht denselben Stand
+        self.assertEqual(app.ResultStore(self.path, max_age=3600).get(KEY), classification())
+        stats = self.store.stats()
+        self.assertEqual((stats["rows"], stats["written"], stats["lookups"], stats["hits"]), (1, 1, 2, 1))
+
+    def test_put_replaces_entry(self):
+        self.store.put(KEY, classification("2202.1000"))
+        self.store.put(KEY, classification("2202.9900"))
+        self.assertTrue(self.store.flush())
+        self.assertEqual(self.store.get(KEY)["tariff_number"], "2202.9900")
+        self.assertEqual(self.store.stats()["rows"], 1)
+
+    def test_key_includes_ean_and_model(self):
+        self.store.put(KEY, classification())
+        self.assertTrue(self.store.flush())
+        self.assertIsNone(self.store.get((KEY[0], "7610097111072", KEY[2])))
+        self.assertIsNone(self.store.get((*KEY[:2], "other-model")))
+
+    def test_entries_expire_after_max_age(self):
+        with mock.patch.object(app.time, "time", return_value=1_000_000.0):
+            self.store.put(KEY, classification())
+            self.assertTrue(self.store.flush())
+        with mock.patch.object(app.time, "time", return_value=1_000_000.0 + 3599):
+            self.assertIsNotNone(self.store.get(KEY))
+        with mock.patch.object(app.time, "time", return_value=1_000_000.0 + 3601):
+            self.assertIsNone(self.store.get(KEY))
+
+    def test_export_and_prune_by_age(self):
+        with mock.patch.object(app.time, "time", return_value=1_000_000.0):
+            self.store.put(("alt", "", "test-model"), classification())
+            self.assertTrue(self.store.flush())
+        self.store.put(KEY, classification())
+        self.assertTrue(self.store.flush())
+        exported = list(self.store.export(model="test-model"))
+        self.assertEqual([row["query"] for row in exported], ["alt", KEY[0]])
+        self.assertEqual(exported[1]["corpus_versions"], app.CORPUS.versions([22]))
+        self.assertEqual(self.store.prune(older_than=3600), 1)
+        self.assertEqual([row["query"] for row in self.store.export()], [KEY[0]])
+
+    def test_unusable_path_disables_store(self):
+        store = app.ResultStore(os.path.join(os.path.dirname(self.path), "fehlt", "results.sqlite"), 3600)
+        self.assertFalse(store.enabled)
+        store.put(KEY, classification())
+        self.assertIsNone(store.get(KEY))
+
+    def test_schema(self):
+        with sqlite3.connect(self.path) as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+        self.assertEqual(columns, ["query", "ean", "model", "corpus_versions", "result", "created"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Ähnliche Anfragen (SimilarQueryIndex): exakte und unscharfe Treffer, Schwelle und Abweisungen.
+
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+SCOPE = ("test-model",)
+QUERIES = ("Coca-Cola Zero 1.5l", "Rivella Rot 50cl", "Müller Milchreis Vanille")
+
+
+def make_index(threshold=0.8, maxsize=100):
+    index = app.SimilarQueryIndex(maxsize, threshold)
+    for query in QUERIES:
+        index.add(query, (app.normalize_query(query), "", *SCOPE))
+    return index
+
+
+class SimilarQueryIndexTest(unittest.TestCase):
+    def test_same_tokens_are_exact_hits(self):
+        index = make_index()
+        for query in ("zero coca cola 1.5 l", "Coca Cola Zero 1,5l", "Mueller Milchreis Vanille"):
+            with self.subTest(query=query):
+                match = index.lookup(query, SCOPE)
+                self.assertEqual(match["similarity"], 1.0)
+        self.assertEqual(index.stats()["exact_hits"], 3)
+
+    def test_typo_above_threshold_hits(self):
+        match = make_index().lookup("Muller Milchreis Vanile", SCOPE)
+        self.assertEqual(match["query"], "Müller Milchreis Vanille")
+        self.assertEqual(match["similarity"], 0.909)
+
+    def test_threshold_decides(self):
+        # "Rivela" statt "Rivella": Jaccard 0.727
+        self.assertIsNotNone(make_index(threshold=0.7).lookup("Rivela rot 50cl", SCOPE))
+        self.assertIsNone(make_index(threshold=0.8).lookup("Rivela rot 50cl", SCOPE))
+        self.assertIsNone(make_index(threshold=0.95).lookup("Muller Milchreis Vanile", SCOPE))
+
+    def test_different_numbers_miss(self):
+        self.assertIsNone(make_index(threshold=0.0).lookup("Coca-Cola Zero 0.5l", SCOPE))
+
+    def test_missing_or_extra_words_are_rejected(self):
+        index = make_index(threshold=0.0)
+        for query in ("Milchreis Vanille", "Müller Milchreis Vanille Zimt", "Cola Zero 1.5l"):
+            with self.subTest(query=query):
+                self.assertIsNone(index.lookup(query, SCOPE))
+        self.assertGreater(index.stats()["rejected"], 0)
+
+    def test_other_model_misses(self):
+        self.assertIsNone(make_index().lookup("Coca-Cola Zero 1.5l", ("other-model",)))
+
+    def test_oldest_entries_are_evicted(self):
+        index = make_index(maxsize=2)
+        self.assertEqual(index.stats()["entries"], 2)
+        self.assertIsNone(index.lookup(QUERIES[0], SCOPE))
+        self.assertIsNotNone(index.lookup(QUERIES[2], SCOPE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Zweistufige Einreihung: Vorauswahl der Positionen (shortlist_*) und kompakter Prompt der zweiten Stufe.
+
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+
+class ParseShortlistTest(unittest.TestCase):
+    def test_positions_in_order(self):
+        self.assertEqual(app.parse_shortlist({"positions": ["2009", "2202"]}, [22, 20]), (20, ["2009", "2202"]))
+
+    def test_codes_are_normalized_and_deduplicated(self):
+        result = {"positions": ["22.02", 2202, "Nr. 2009", "2202.1000"]}
+        self.assertEqual(app.parse_shortlist(result, [22, 20]), (22, ["2202", "2009"]))
+
+    def test_only_listed_chapters_and_known_positions(self):
+        result = {"positions": ["0901", "2299", "2201"]}
+        self.assertEqual(app.parse_shortlist(result, [22, 20]), (22, ["2201"]))
+
+    def test_capped_at_max_positions(self):
+        result = {"positions": ["2201", "2202", "2203", "2204", "2009"]}
+        self.assertEqual(len(app.parse_shortlist(result, [22, 20])[1]), app.SHORTLIST_MAX_POSITIONS)
+
+    def test_unusable_answers(self):
+        for result in (None, [], {}, {"positions": "2202"}, {"positions": []}, {"positions": ["9999"]}):
+            with self.subTest(result=result):
+                self.assertIsNone(app.parse_shortlist(result, [22, 20]))
+
+
+class ShortlistPositionsTest(unittest.TestCase):
+    def test_chapters_are_filled_up_by_retrieval(self):
+        chapters = app.shortlist_chapters("Orangensaft 1l", None, 22, [99])
+        self.assertEqual(chapters[0], 22)
+        self.assertEqual(len(chapters), app.SHORTLIST_CHAPTERS)
+        self.assertIn(20, chapters)
+        self.assertNotIn(99, chapters)   # nicht im Korpus
+
+    def test_small_model_picks_positions(self):
+        with mock.patch.object(app, "_call_groq_model", return_value={"positions": ["2009"]}) as call:
+            self.assertEqual(app.shortlist_positions("Orangensaft 1l", None, 22, [20]), (20, ["2009"]))
+        self.assertEqual(call.call_args.args[0], app.SHORTLIST_MODEL)
+        self.assertEqual(call.call_args.kwargs["purpose"], "shortlist")
+        prompt = call.call_args.args[1][1]["content"]
+        self.assertIn("Kapitel 22:", prompt)
+        self.assertIn("Kapitel 20:", prompt)
+
+    def test_failure_falls_back_to_single_stage(self):
+        with mock.patch.object(app, "_call_groq_model", side_effect=TimeoutError("zu langsam")):
+            self.assertIsNone(app.shortlist_positions("Orangensaft 1l", None, 22, [20]))
+        with mock.patch.object(app, "_call_groq_model", return_value={"positions": ["0101"]}):
+            self.assertIsNone(app.shortlist_positions("Orangensaft 1l", None, 22, [20]))
+
+
+class SecondStagePromptTest(unittest.TestCase):
+    def test_prompt_covers_shortlist_within_budget(self):
+        chapters, prompt, report = app.prepare_prompt("Rivella Rot 50cl", None, "none", 9, [],
+                                                      shortlist=(22, ["2202", "2009"]))
+        self.assertEqual(chapters, [22, 20])
+        self.assertEqual(report["shortlist"], ["2202", "2009"])
+        self.assertLessEqual(report["prompt_tokens"], app.TWO_STAGE_PROMPT_BUDGET)
+        self.assertEqual(set(report["corpus_versions"]), {"22", "20"})
+        self.assertIn("2202", prompt)
+        self.assertIn("2009", prompt)
+
+    def test_result_key_separates_modes(self):
+        with mock.patch.object(app, "CLASSIFY_MODE", "single"):
+            single = app.classification_model()
+        with mock.patch.object(app, "CLASSIFY_MODE", "two_stage"):
+            two_stage = app.classification_model()
+        self.assertEqual(single, app.GROQ_MODEL)
+        self.assertEqual(two_stage, f"{app.SHORTLIST_MODEL}+{app.GROQ_MODEL}")
+
+
+if __name__ == "__main__":
+    unittest.main()
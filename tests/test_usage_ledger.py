@@ -0,0 +1,93 @@
+"""Groq-Verbrauch (GroqUsageLedger): Summen pro Modell, Zweck, Route und Kapitel, rollierende TPM.
+
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_STORE_PATH", "")
+os.environ.setdefault("CORPUS_WATCH_INTERVAL", "0")
+import app  # noqa: E402
+
+LARGE, SMALL = "llama-3.3-70b-versatile", "llama-3.1-8b-instant"
+
+
+def usage(prompt, completion):
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+class UsageLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.ledger = app.GroqUsageLedger()
+        self.now = 1000.0
+        patcher = mock.patch.object(app.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def classify(self, chapter, *calls, route="/classify"):
+        """Eine Klassifizierung mit den Aufrufen (Modell, Zweck, usage)."""
+        token = app.REQUEST_ROUTE.set(route)
+        try:
+            with app.collect_usage() as collected:
+                for model, purpose, call_usage in calls:
+                    self.ledger.record(model, purpose, call_usage)
+        finally:
+            app.REQUEST_ROUTE.reset(token)
+        self.ledger.record_request(chapter, collected)
+        return collected
+
+    def test_cost_from_list_prices(self):
+        self.assertAlmostEqual(app.groq_cost_usd(LARGE, 1_000_000, 1_000_000), 0.59 + 0.79)
+        self.assertIsNone(app.groq_cost_usd("groq/compound", 1000, 100))
+
+    def test_calls_are_collected_per_request(self):
+        calls = self.classify(22, (SMALL, "shortlist", usage(1000, 50)), (LARGE, "classify", usage(3000, 200)))
+        summary = app.summarize_usage(calls)
+        self.assertEqual((summary["prompt_tokens"], summary["completion_tokens"], summary["total_tokens"]),
+                         (4000, 250, 4250))
+        self.assertAlmostEqual(summary["cost_usd"], (1000 * 0.05 + 50 * 0.08 + 3000 * 0.59 + 200 * 0.79) / 1e6)
+        self.assertEqual([c["purpose"] for c in summary["calls"]], ["shortlist", "classify"])
+        # ausserhalb einer Klassifizierung wird nur global gebucht
+        self.ledger.record(LARGE, "web_search", usage(10, 10))
+        self.assertEqual(len(calls), 2)
+
+    def test_groups(self):
+        self.classify(22, (LARGE, "classify", usage(3000, 200)))
+        self.classify(22, (LARGE, "classify", usage(1000, 100)), route="/classify/batch")
+        self.classify(9, (SMALL, "shortlist", usage(500, 20)), (LARGE, "classify", usage(2000, 100)))
+        report = self.ledger.report()
+
+        self.assertEqual(report["by_model"][LARGE]["calls"], 3)
+        self.assertEqual(report["by_model"][LARGE]["total_tokens"], 6400)
+        self.assertEqual(report["by_model"][LARGE]["avg_prompt_tokens"], 2000)
+        self.assertEqual(report["by_purpose"]["shortlist"]["total_tokens"], 520)
+        self.assertEqual({route: e["calls"] for route, e in report["by_route"].items()},
+                         {"/classify": 3, "/classify/batch": 1})
+
+        chapter_22 = report["by_chapter"]["22"]
+        self.assertEqual((chapter_22["requests"], chapter_22["calls"], chapter_22["prompt_tokens"]), (2, 2, 4000))
+        self.assertEqual((chapter_22["avg_prompt_tokens"], chapter_22["max_prompt_tokens"]), (2000, 3000))
+        self.assertEqual(report["by_chapter"]["9"]["calls"], 2)
+        self.assertEqual(list(report["by_chapter"]), ["22", "9"])   # grösste Verbraucher zuerst
+
+        stats = self.ledger.stats()
+        self.assertEqual((stats["calls"], stats["total_tokens"]), (4, 6920))
+
+    def test_unpriced_model_has_no_cost(self):
+        self.ledger.record("groq/compound", "web_search", usage(1000, 100))
+        self.assertIsNone(self.ledger.report()["by_model"]["groq/compound"]["cost_usd"])
+
+    def test_rolling_windows(self):
+        self.ledger.record(LARGE, "classify", usage(5000, 1000))
+        self.now += 120
+        self.ledger.record(LARGE, "classify", usage(2000, 1000))
+        rolling = self.ledger.rolling()[LARGE]
+        self.assertEqual((rolling["tpm_1m"], rolling["rpm_1m"]), (3000, 1.0))
+        self.assertEqual((rolling["tpm_5m"], rolling["rpm_5m"]), (1800, 0.4))
+        self.now += 901   # älter als das längste Fenster: verworfen
+        self.assertEqual(self.ledger.rolling(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()